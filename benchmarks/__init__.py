@@ -0,0 +1,4 @@
+"""
+Benchmarks of pyhrv's hot paths, for airspeed velocity (asv). Run from the
+repository root, e.g. ``asv run`` or ``asv continuous master HEAD``.
+"""
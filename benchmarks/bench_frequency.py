@@ -0,0 +1,119 @@
+import numpy as np
+
+import pyhrv.hrv as hrv
+import pyhrv.conf as conf
+import pyhrv.rri.frequency as frequency
+
+from .common import DURATIONS, WHOLE_RECORD_DURATIONS, synthetic_rri
+
+OVERSAMPLE_FACTORS = [1, 4]
+
+# Window duration for pxx_lomb, in seconds
+T_WIN = 5 * 60
+
+
+def _freq_axis(t_win, oversample_factor):
+    return frequency.build_uniform_freq_axis(
+        t_win,
+        conf.get_val("hrv_freq.vlf_band")[0],
+        conf.get_val("hrv_freq.hf_band")[1],
+        conf.get_val("hrv_freq.resample_factor"),
+        oversample_factor,
+    )
+
+
+class BuildUniformFreqAxis(object):
+    params = ([5 * 60, 60 * 60, 24 * 60 * 60], [1, 4, 16])
+    param_names = ["t_win", "oversample_factor"]
+
+    def time_build_uniform_freq_axis(self, t_win, oversample_factor):
+        _freq_axis(t_win, oversample_factor)
+
+
+class PxxLomb(object):
+    timeout = 600
+    params = (list(DURATIONS), OVERSAMPLE_FACTORS)
+    param_names = ["duration", "oversample_factor"]
+
+    def setup(self, duration, oversample_factor):
+        if DURATIONS[duration] <= T_WIN:
+            raise NotImplementedError("No complete windows")  # Skipped by asv
+        self.trr, self.rri = synthetic_rri(DURATIONS[duration])
+        self.f_axis, _ = _freq_axis(T_WIN, oversample_factor)
+
+    def time_pxx_lomb(self, duration, oversample_factor):
+        frequency.pxx_lomb(self.rri, self.f_axis, self.trr, T_WIN)
+
+    def peakmem_pxx_lomb(self, duration, oversample_factor):
+        frequency.pxx_lomb(self.rri, self.f_axis, self.trr, T_WIN)
+
+
+class HRVFreq(object):
+    timeout = 600
+    params = (
+        list(DURATIONS),
+        OVERSAMPLE_FACTORS,
+        ["lomb", "welch", "lomb+welch"],
+        [5, None],
+    )
+    param_names = ["duration", "oversample_factor", "methods", "window_minutes"]
+
+    def setup(self, duration, oversample_factor, methods, window_minutes):
+        if window_minutes is None and duration not in WHOLE_RECORD_DURATIONS:
+            raise NotImplementedError("Whole record too long")  # Skipped by asv
+        self.trr, self.rri = synthetic_rri(DURATIONS[duration])
+
+    def time_hrv_freq(self, duration, oversample_factor, methods, window_minutes):
+        hrv.hrv_freq(
+            self.rri,
+            self.trr,
+            methods=methods.split("+"),
+            window_minutes=window_minutes,
+            oversample_factor=oversample_factor,
+        )
+
+    def peakmem_hrv_freq(self, duration, oversample_factor, methods, window_minutes):
+        hrv.hrv_freq(
+            self.rri,
+            self.trr,
+            methods=methods.split("+"),
+            window_minutes=window_minutes,
+            oversample_factor=oversample_factor,
+        )
+
+
+class HRVFreqThreads(object):
+    timeout = 600
+    params = (list(DURATIONS), [1, 2, 4])
+    param_names = ["duration", "n_jobs"]
+
+    def setup(self, duration, n_jobs):
+        self.trr, self.rri = synthetic_rri(DURATIONS[duration])
+
+    def time_hrv_freq(self, duration, n_jobs):
+        hrv.hrv_freq(
+            self.rri,
+            self.trr,
+            methods=["lomb", "welch"],
+            window_minutes=5,
+            n_jobs=n_jobs,
+        )
+
+
+class Beta(object):
+    # Number of windows, e.g. 288 for the 5-minute windows of a day
+    params = ([1, 288, 7 * 288], [1, 4])
+    param_names = ["n_windows", "oversample_factor"]
+
+    def setup(self, n_windows, oversample_factor):
+        self.f_axis, _ = _freq_axis(T_WIN, oversample_factor)
+        # 1/f spectra with multiplicative noise
+        rng = np.random.default_rng(0)
+        shape = (n_windows, len(self.f_axis))
+        self.pxx = {
+            method: rng.uniform(0.5, 1.5, size=shape) / self.f_axis
+            for method in ["lomb", "welch"]
+        }
+
+    def time_beta(self, n_windows, oversample_factor):
+        hrv.beta(self.pxx, self.f_axis)
@@ -0,0 +1,33 @@
+import pyhrv.rri.processing as processing
+
+from .common import DURATIONS, synthetic_rri
+
+
+class Filtrr(object):
+    params = list(DURATIONS)
+    param_names = ["duration"]
+
+    def setup(self, duration):
+        self.trr, self.rri = synthetic_rri(DURATIONS[duration])
+
+    def time_filtrr(self, duration):
+        processing.filtrr(self.trr, self.rri)
+
+    def peakmem_filtrr(self, duration):
+        processing.filtrr(self.trr, self.rri)
+
+
+class Splitrr(object):
+    params = (list(DURATIONS), [60, 300])
+    param_names = ["duration", "win_sec"]
+
+    def setup(self, duration, win_sec):
+        if DURATIONS[duration] <= win_sec:
+            raise NotImplementedError("No complete windows")  # Skipped by asv
+        _, self.rri = synthetic_rri(DURATIONS[duration])
+
+    def time_splitrr(self, duration, win_sec):
+        processing.splitrr(self.rri, win_sec)
+
+    def peakmem_splitrr(self, duration, win_sec):
+        processing.splitrr(self.rri, win_sec)
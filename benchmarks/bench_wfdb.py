@@ -0,0 +1,42 @@
+import pyhrv.wfdb.rri as rri
+import pyhrv.wfdb.utils as utils
+
+from .common import DURATIONS, SIGNAL_DURATIONS, RecordsBenchmark
+
+
+class ECGRRAnnotations(RecordsBenchmark):
+    params = list(DURATIONS)
+    param_names = ["duration"]
+
+    def time_ecgrr(self, records, duration):
+        rri.ecgrr(records[duration], ann_ext="atr")
+
+    def peakmem_ecgrr(self, records, duration):
+        rri.ecgrr(records[duration], ann_ext="atr")
+
+
+class ECGRRDetector(RecordsBenchmark):
+    params = SIGNAL_DURATIONS
+    param_names = ["duration"]
+
+    def time_ecgrr(self, records, duration):
+        rri.ecgrr(records[duration], detector="rqrs")
+
+    def peakmem_ecgrr(self, records, duration):
+        rri.ecgrr(records[duration], detector="rqrs")
+
+
+class RdannByType(RecordsBenchmark):
+    params = (list(DURATIONS), [False, True])
+    param_names = ["duration", "cache"]
+
+    def setup(self, records, duration, cache):
+        if cache:
+            # Create the sidecar cache, so that only loading it is measured
+            utils.rdann_by_type(records[duration], "atr", cache=True)
+
+    def time_rdann_by_type(self, records, duration, cache):
+        utils.rdann_by_type(records[duration], "atr", cache=cache)
+
+    def peakmem_rdann_by_type(self, records, duration, cache):
+        utils.rdann_by_type(records[duration], "atr", cache=cache)
@@ -0,0 +1,65 @@
+"""
+Synthetic inputs for the benchmarks, generated deterministically so that
+results are comparable between commits.
+"""
+import os
+
+import pyhrv.generator as generator
+
+# Durations of the benchmarked inputs, in seconds, keyed by label
+DURATIONS = {
+    "5min": 5 * 60,
+    "1h": 60 * 60,
+    "6h": 6 * 60 * 60,
+    "1d": 24 * 60 * 60,
+    "7d": 7 * 24 * 60 * 60,
+}
+
+# A spectrum of a whole record (without windowing) has a frequency resolution
+# of 1 / duration, so its cost grows quadratically with the duration; those
+# benchmarks stop at six hours.
+WHOLE_RECORD_DURATIONS = ["5min", "1h", "6h"]
+
+# Durations for which a signal is written, for benchmarking QRS detection
+SIGNAL_DURATIONS = ["5min", "1h"]
+
+FS = 128
+SEED = 42
+
+
+def synthetic_rri(duration: float):
+    """
+    :param duration: Duration in seconds.
+    :return: Tuple of time axis and RR intervals, in seconds.
+    """
+    return generator.generate_rr(duration, seed=SEED)
+
+
+def write_records(rec_dir: str) -> dict:
+    """
+    Writes a synthetic record for each benchmarked duration.
+    :param rec_dir: Directory to write to.
+    :return: A dict mapping each duration label to its record path.
+    """
+    return {
+        label: generator.write_record(
+            os.path.join(rec_dir, label),
+            generator.generate_beats(duration, seed=SEED),
+            fs=FS,
+            signal=label in SIGNAL_DURATIONS,
+        )
+        for label, duration in DURATIONS.items()
+    }
+
+
+class RecordsBenchmark(object):
+    """
+    Base class of benchmarks which read the synthetic records. The records
+    are written once, and passed to each benchmark method as its first
+    argument.
+    """
+
+    timeout = 600
+
+    def setup_cache(self):
+        return write_records(os.path.abspath("records"))
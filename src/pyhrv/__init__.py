@@ -1,10 +1,35 @@
-import pyhrv.hrv
-import pyhrv.rri
-import pyhrv.conf
-import pyhrv.wfdb
-import pyhrv.utils
+import importlib
 
-from ._version import get_versions
+# Submodules are imported on first access (PEP 562), so that importing pyhrv
+# doesn't pull in heavy dependencies which the caller may not need.
+_SUBMODULES = (
+    "batch",
+    "conf",
+    "generator",
+    "hrv",
+    "main",
+    "profiling",
+    "rri",
+    "server",
+    "store",
+    "utils",
+    "wfdb",
+)
 
-__version__ = get_versions()["version"]
-del get_versions
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+
+    if name == "__version__":
+        from ._version import get_versions
+
+        version = get_versions()["version"]
+        globals()["__version__"] = version
+        return version
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted({*globals(), *_SUBMODULES, "__version__"})
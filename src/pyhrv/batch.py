@@ -0,0 +1,267 @@
+"""
+This module contains functions for processing many PhysioNet records in
+parallel, e.g. an entire database.
+"""
+import os
+import time
+import traceback
+import collections
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Union
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from tqdm import tqdm
+
+import pyhrv.conf
+import pyhrv.store as store
+import pyhrv.wfdb.rri as rri
+from pyhrv.store import ResultsStore
+from pyhrv.wfdb.catalog import RecordCatalog
+
+
+class BatchResult(NamedTuple):
+    rec_path: str
+    # Return value of the processing function, None if it failed
+    result: object
+    # Wall time in seconds spent on the record
+    wall_time: float
+    # Error description if processing failed, otherwise None
+    error: str = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def ecgrr_many(
+    records: Union[str, Iterable[str]],
+    n_jobs: int = None,
+    chunksize: int = None,
+    progress: bool = True,
+    **ecgrr_kw,
+) -> Iterator[BatchResult]:
+    """
+    Calculates RR intervals of many records in parallel.
+    :param records: A list of record paths (without extension), or a directory
+    which will be searched recursively for records.
+    :param n_jobs: Number of worker processes. None means the number of CPUs,
+    1 means processing in the current process.
+    :param chunksize: Number of records to send to a worker in each task.
+    None means choosing automatically based on the number of records.
+    :param progress: Whether to show a progress bar.
+    :param ecgrr_kw: Arguments for :meth:`pyhrv.wfdb.rri.ecgrr`.
+    :return: A generator of :class:`BatchResult`, yielded as records complete
+    (not necessarily in order), where each result is a tuple of time axis and
+    RR intervals.
+    """
+    rec_paths = _rec_paths(records, ecgrr_kw.get("ann_ext"))
+    return map_records(rri.ecgrr, rec_paths, n_jobs, chunksize, progress, **ecgrr_kw)
+
+
+def hrv_many(
+    records: Union[str, Iterable[str]],
+    n_jobs: int = None,
+    chunksize: int = None,
+    progress: bool = True,
+    filter_rri: bool = True,
+    store_dir: str = None,
+    **ecgrr_kw,
+) -> Iterator[BatchResult]:
+    """
+    Calculates HRV metrics of many records in parallel.
+    :param records: A list of record paths (without extension), or a directory
+    which will be searched recursively for records.
+    :param n_jobs: Number of worker processes. None means the number of CPUs,
+    1 means processing in the current process.
+    :param chunksize: Number of records to send to a worker in each task.
+    None means choosing automatically based on the number of records.
+    :param progress: Whether to show a progress bar.
+    :param filter_rri: Whether to remove outlier intervals with
+    :meth:`pyhrv.rri.processing.filtrr` before calculating the metrics.
+    :param store_dir: Directory of a :class:`pyhrv.store.ResultsStore`. If
+    provided, intermediate and final results are saved there, and results
+    which were already computed (with the same record files, parameters and
+    pyhrv version) are loaded instead of recomputed. This allows resuming a
+    batch which was interrupted.
+    :param ecgrr_kw: Arguments for :meth:`pyhrv.wfdb.rri.ecgrr`.
+    :return: A generator of :class:`BatchResult`, yielded as records complete
+    (not necessarily in order), where each result is a dict of the time- and
+    frequency-domain metrics of the entire record, as returned by
+    :meth:`pyhrv.main.hrv_rr_rows`.
+    """
+    rec_paths = _rec_paths(records, ecgrr_kw.get("ann_ext"))
+    if store_dir is not None:
+        ResultsStore(store_dir)  # Create it once before starting workers
+        return map_records(
+            store.hrv_record,
+            rec_paths,
+            n_jobs,
+            chunksize,
+            progress,
+            store=str(store_dir),
+            filter_rri=filter_rri,
+            **ecgrr_kw,
+        )
+    return map_records(
+        _hrv_record,
+        rec_paths,
+        n_jobs,
+        chunksize,
+        progress,
+        filter_rri=filter_rri,
+        **ecgrr_kw,
+    )
+
+
+def map_records(
+    func: Callable,
+    rec_paths: List[str],
+    n_jobs: int = None,
+    chunksize: int = None,
+    progress: bool = True,
+    **kw,
+) -> Iterator[BatchResult]:
+    """
+    Applies a function to many records in a pool of worker processes.
+    Failures are captured per record, so that one bad record doesn't stop the
+    batch. If a worker crashes (e.g. in native code), the records in flight
+    are retried one at a time, so only a record which crashes a worker on its
+    own fails. Configuration overrides of the current
+    context (see :func:`pyhrv.conf.override`) also apply in the workers.
+    :param func: A picklable function accepting a record path and kw.
+    :param rec_paths: Paths of records.
+    :param n_jobs: Number of worker processes. None means the number of CPUs,
+    1 means processing in the current process.
+    :param chunksize: Number of records to send to a worker in each task.
+    :param progress: Whether to show a progress bar.
+    :param kw: Extra arguments for func.
+    :return: A generator of :class:`BatchResult`, yielded as records complete.
+    """
+    rec_paths = [str(rec_path) for rec_path in rec_paths]
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    with tqdm(total=len(rec_paths), disable=not progress, unit="rec") as pbar:
+        if n_jobs == 1 or len(rec_paths) < 2:
+            results = (_run_record(func, p, kw) for p in rec_paths)
+        else:
+            if not chunksize:
+                chunksize = max(1, min(16, len(rec_paths) // (4 * n_jobs)))
+            results = _map_pool(func, rec_paths, n_jobs, chunksize, kw)
+
+        for result in results:
+            pbar.update()
+            if not result.ok:
+                pbar.set_postfix_str(f"failed: {os.path.basename(result.rec_path)}")
+            yield result
+
+
+# How a chunk is run: as submitted, as a single record retried concurrently
+# with other chunks, or as a single record alone in the pool.
+_ATTEMPT_CHUNK, _ATTEMPT_SINGLE, _ATTEMPT_ISOLATED = range(3)
+
+
+def _map_pool(func, rec_paths, n_jobs, chunksize, kw):
+    chunks = [
+        (rec_paths[i : i + chunksize], _ATTEMPT_CHUNK)
+        for i in range(0, len(rec_paths), chunksize)
+    ]
+    chunks.reverse()
+    # Records of chunks which failed as a whole, to retry one at a time
+    retries = collections.deque()
+
+    # Keep a bounded number of chunks in flight, so that results stream back
+    # while the remaining chunks are submitted.
+    max_pending = 2 * n_jobs
+    pool = ProcessPoolExecutor(max_workers=n_jobs)
+    pending = {}
+    broken = False
+    overrides = pyhrv.conf.get_overrides()
+    try:
+        while chunks or retries or pending:
+            if broken and not pending:
+                # A worker died (e.g. crashed in native code), which fails all
+                # chunks in flight. Once they're drained, restart the pool.
+                pool.shutdown(wait=False)
+                pool = ProcessPoolExecutor(max_workers=n_jobs)
+                broken = False
+
+            while not broken and len(pending) < max_pending and (retries or chunks):
+                chunk, attempt = retries[0] if retries else chunks[-1]
+                # Isolated attempts run alone in the pool
+                if pending and (
+                    attempt == _ATTEMPT_ISOLATED
+                    or any(a == _ATTEMPT_ISOLATED for _, a in pending.values())
+                ):
+                    break
+                try:
+                    future = pool.submit(_run_chunk, func, chunk, kw, overrides)
+                except BrokenProcessPool:
+                    broken = True
+                    break
+                pending[future] = retries.popleft() if retries else chunks.pop()
+
+            if not pending:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk, attempt = pending.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # The chunk failed as a whole, e.g. a worker died or a
+                    # result can't be pickled
+                    error = e
+                else:
+                    yield from results
+                    continue
+
+                broken |= isinstance(error, BrokenProcessPool)
+                if attempt == _ATTEMPT_CHUNK and len(chunk) > 1:
+                    retries.extend(([rec_path], _ATTEMPT_SINGLE) for rec_path in chunk)
+                elif attempt != _ATTEMPT_ISOLATED and isinstance(
+                    error, BrokenProcessPool
+                ):
+                    # Another record in flight may have broken the pool
+                    retries.append((chunk, _ATTEMPT_ISOLATED))
+                else:
+                    for rec_path in chunk:
+                        yield BatchResult(rec_path, None, 0.0, _format_error(error))
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+def _run_chunk(func, rec_paths, kw, overrides=None) -> List[BatchResult]:
+    with pyhrv.conf.override(**(overrides or {})):
+        return [_run_record(func, rec_path, kw) for rec_path in rec_paths]
+
+
+def _run_record(func, rec_path, kw) -> BatchResult:
+    start = time.perf_counter()
+    try:
+        result = func(rec_path, **kw)
+        return BatchResult(rec_path, result, time.perf_counter() - start)
+    except Exception as e:
+        return BatchResult(
+            rec_path, None, time.perf_counter() - start, _format_error(e)
+        )
+
+
+def _format_error(e: BaseException) -> str:
+    return str.join("", traceback.format_exception_only(type(e), e)).strip()
+
+
+def _hrv_record(rec_path, filter_rri=True, **ecgrr_kw):
+    import pyhrv.main as main  # main imports this module
+
+    trr, rr = rri.ecgrr(rec_path, **ecgrr_kw)
+    (row,) = main.hrv_rr_rows(trr, rr, filter_rri)
+    return row
+
+
+def _rec_paths(records, ann_ext=None):
+    if isinstance(records, (str, os.PathLike)) and os.path.isdir(records):
+        catalog = RecordCatalog.build(records, n_jobs=1)
+        return [catalog.path(rec) for rec in catalog.query(ann_ext=ann_ext)]
+    return list(records)
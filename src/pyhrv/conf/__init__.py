@@ -1,16 +1,128 @@
 import os
-import confuse
+import inspect
+import functools
+import threading
+import contextlib
+import contextvars
+from types import MappingProxyType
 
 CONFIG_DEFAULT_FILENAME = os.path.join(os.path.dirname(__file__), "config_default.yaml")
 
-pyhrv_conf = confuse.LazyConfig("pyhrv", __name__)
+# The underlying confuse configuration is only created (and the YAML files
+# parsed) when a parameter is first accessed. Parameters are then read from an
+# immutable snapshot of the configuration, which is rebuilt after load().
+_lock = threading.RLock()
+_config = None
+_config_files = []
+_snapshot = None
 
+# Parameter values overridden in the current context, see override()
+_overrides = contextvars.ContextVar("pyhrv_conf_overrides", default=None)
 
-def _get(key: str):
-    view = pyhrv_conf
-    for subkey in key.split("."):
-        view = view[subkey]
-    return view.get()
+
+class _Snapshot(object):
+    __slots__ = ("values", "params", "base")
+
+    def __init__(self, values: dict, params: dict, base=None):
+        # Flat, read-only mappings from full parameter names
+        self.values = MappingProxyType(dict(sorted(values.items())))
+        self.params = MappingProxyType(dict(sorted(params.items())))
+        # The snapshot this one overrides, if any
+        self.base = base
+
+    @classmethod
+    def from_tree(cls, tree: dict):
+        values, params = {}, {}
+
+        def _collect(key, node):
+            if "value" in node:
+                params[key] = MappingProxyType({k: _freeze(v) for k, v in node.items()})
+                values[key] = params[key]["value"]
+                return
+            for subkey, subnode in node.items():
+                if isinstance(subnode, dict):
+                    _collect(f"{key}.{subkey}" if key else subkey, subnode)
+
+        _collect("", tree)
+        return cls(values, params)
+
+    def override(self, overrides: dict):
+        values, params = dict(self.values), dict(self.params)
+        for key, val in overrides.items():
+            values[key] = val
+            params[key] = MappingProxyType({**params[key], "value": val})
+        return _Snapshot(values, params, base=self)
+
+
+class _Overrides(object):
+    __slots__ = ("values", "snapshot")
+
+    def __init__(self, values: dict):
+        self.values = MappingProxyType(values)
+        # The overridden snapshot, built on first use in a context
+        self.snapshot = None
+
+
+def _freeze(val):
+    if isinstance(val, (list, tuple)):
+        return tuple(_freeze(v) for v in val)
+    if isinstance(val, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in val.items()})
+    return val
+
+
+def _thaw(val):
+    # Values are stored frozen, and returned as new lists and dicts as in the
+    # YAML files, so that callers can't modify the shared snapshot.
+    if isinstance(val, tuple):
+        return [_thaw(v) for v in val]
+    if isinstance(val, MappingProxyType):
+        return {k: _thaw(v) for k, v in val.items()}
+    return val
+
+
+def _get_config():
+    global _config
+    with _lock:
+        if _config is None:
+            import confuse
+
+            config = confuse.LazyConfig("pyhrv", __name__)
+            for filename in _config_files:
+                config.set_file(filename)
+            _config = config
+        return _config
+
+
+def _get_base_snapshot() -> _Snapshot:
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is None:
+        with _lock:
+            if _snapshot is None:
+                _snapshot = _Snapshot.from_tree(_get_config().flatten())
+            snapshot = _snapshot
+    return snapshot
+
+
+def _get_snapshot() -> _Snapshot:
+    base = _get_base_snapshot()
+    overrides = _overrides.get()
+    if overrides is None:
+        return base
+
+    # Rebuilt only if the configuration was loaded since it was cached
+    snapshot = overrides.snapshot
+    if snapshot is None or snapshot.base is not base:
+        snapshot = overrides.snapshot = base.override(overrides.values)
+    return snapshot
+
+
+def __getattr__(name):
+    # The confuse configuration object, created on first access
+    if name == "pyhrv_conf":
+        return _get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_val(key: str):
@@ -19,7 +131,7 @@ def get_val(key: str):
     :param key: The full name of the parameter, e.g. foo.bar.baz
     :return: The value of that parameter.
     """
-    return _get(key + ".value")
+    return _thaw(_get_snapshot().values[key])
 
 
 def get_desc(key: str):
@@ -28,7 +140,21 @@ def get_desc(key: str):
     :param key: The full name of the parameter, e.g. 'foo.bar.baz'
     :return: The description of that parameter.
     """
-    return _get(key + ".description")
+    return _get_snapshot().params[key]["description"]
+
+
+def get_vals(prefix: str) -> dict:
+    """
+    Returns the values of all configuration parameters under a prefix.
+    :param prefix: A common prefix of parameter names, e.g. 'foo.bar'.
+    :return: A dict mapping the full name of each parameter to its value,
+    sorted by name.
+    """
+    values = _get_snapshot().values
+    if prefix in values:
+        return {prefix: _thaw(values[prefix])}
+    prefix = f"{prefix}."
+    return {k: _thaw(v) for k, v in values.items() if k.startswith(prefix)}
 
 
 def get_override(common_prefix, **param_overrides):
@@ -50,8 +176,145 @@ def get_override(common_prefix, **param_overrides):
     return retvals
 
 
+def get_overrides() -> dict:
+    """
+    :return: A dict mapping the full name of each parameter which is
+    overridden in the current context (see :func:`override`) to its value.
+    """
+    overrides = _overrides.get()
+    return {} if overrides is None else dict(overrides.values)
+
+
+@contextlib.contextmanager
+def override(common_prefix: str = None, **param_overrides):
+    """
+    A context manager which overrides parameter values in the current context
+    only, without changing the global configuration. Other threads and asyncio
+    tasks are unaffected, so they can use different parameters concurrently.
+    Overrides can be nested.
+
+    Example::
+
+        with pyhrv.conf.override("hrv_freq", lf_band=(0.05, 0.15)):
+            pyhrv.hrv.hrv_freq(rri)
+
+    Note that threads don't inherit the context they're started from; to
+    apply the overrides in a thread pool, either enter the context in the
+    worker or submit ``contextvars.copy_context().run``.
+
+    :param common_prefix: The prefix of all the given parameters,
+    e.g. 'foo.bar'. If None, the parameters must be full names, which can be
+    passed with ``**{'foo.bar.baz': value}``.
+    :param param_overrides: Key-value pairs of parameter names and their
+    values in the context.
+    """
+    base = _get_base_snapshot()
+    values = get_overrides()
+    for k, v in param_overrides.items():
+        key = f"{common_prefix}.{k}" if common_prefix else k
+        if key not in base.values:
+            raise KeyError(f"Unknown configuration parameter: {key}")
+        values[key] = _freeze(v)
+
+    token = _overrides.set(_Overrides(values))
+    try:
+        yield
+    finally:
+        _overrides.reset(token)
+
+
+class ConfParam(object):
+    """
+    A placeholder for the value of a configuration parameter, to be used as
+    the default value of an argument of a function decorated with
+    :func:`resolve_params`. It's replaced with the parameter's current value
+    when the function is called.
+    """
+
+    __slots__ = ("key",)
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def __repr__(self):
+        return f"conf({self.key!r})"
+
+
+def param(key: str) -> ConfParam:
+    """
+    :param key: The full name of a configuration parameter.
+    :return: A placeholder for the parameter's value, see :class:`ConfParam`.
+    """
+    return ConfParam(key)
+
+
+def resolve_params(fn):
+    """
+    A decorator which replaces :class:`ConfParam` default arguments of a
+    function with the current values of the corresponding configuration
+    parameters, each time the function is called.
+    """
+    conf_args = []
+    for i, (name, p) in enumerate(inspect.signature(fn).parameters.items()):
+        if isinstance(p.default, ConfParam):
+            if p.kind == inspect.Parameter.KEYWORD_ONLY:
+                i = float("inf")
+            conf_args.append((i, name, p.default.key))
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kw):
+        values = _get_snapshot().values
+        n_args = len(args)
+        for i, name, key in conf_args:
+            if i < n_args:
+                continue
+            val = kw.get(name, fn)
+            if val is fn:
+                kw[name] = _thaw(values[key])
+            elif isinstance(val, ConfParam):
+                kw[name] = _thaw(values[val.key])
+        return fn(*args, **kw)
+
+    if inspect.iscoroutinefunction(fn):
+        # Keep it recognizable as a coroutine function
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kw):
+            return await wrapper(*args, **kw)
+
+        return async_wrapper
+
+    return wrapper
+
+
 def load(filename: str):
-    pyhrv_conf.set_file(filename)
+    """
+    Loads a configuration file. Its values take precedence over those of
+    previously loaded files.
+    :param filename: Path of a YAML configuration file.
+    """
+    global _snapshot
+    with _lock:
+        _config_files.append(filename)
+        if _config is not None:
+            _config.set_file(filename)
+        _snapshot = None
+
+
+def read_file(filename: str) -> dict:
+    """
+    Reads parameter values from a configuration file, without loading it.
+    The values can then be applied to a context with :func:`override`.
+    :param filename: Path of a YAML configuration file, in the same format as
+    the default configuration (only the values of parameters are used).
+    :return: A dict mapping the full name of each parameter in the file to
+    its value.
+    """
+    import yaml
+
+    with open(filename, "r") as f:
+        tree = yaml.safe_load(f) or {}
+    return {k: _thaw(v) for k, v in _Snapshot.from_tree(tree).values.items()}
 
 
 def load_default():
@@ -0,0 +1,308 @@
+"""
+This module generates synthetic heartbeats, RR intervals and ECG signals of
+any length, e.g. for benchmarks and scaling tests.
+
+Beat times are generated with an integral pulse frequency modulation (IPFM)
+model: the instantaneous heart rate is modulated by band-limited noise with
+LF and HF spectral peaks, and a beat occurs whenever the integral of the
+rate reaches an integer. Ectopic beats, spurious detections (artifacts) and
+gaps of signal loss can be added. Generation is deterministic given a seed.
+"""
+import os
+import math
+import numpy as np
+from typing import Iterator, NamedTuple
+
+import wfdb
+
+from pyhrv.wfdb.utils import _INVALID_SAMPLE
+
+# Sampling rate, in Hz, of the IPFM modulating signal
+_IPFM_FS = 8.0
+
+# Duration in seconds of the blocks in which ECG signals are generated
+_BLOCK_SEC = 3600
+
+# Waves of the ECG template of each beat symbol: time offset from the R-peak
+# (seconds), amplitude (mV) and width (seconds) of a gaussian.
+_WAVES = {
+    "N": (
+        (-0.2, 0.15, 0.025),
+        (-0.03, -0.1, 0.008),
+        (0.0, 1.0, 0.01),
+        (0.03, -0.25, 0.008),
+        (0.3, 0.3, 0.04),
+    ),
+    "V": ((0.0, 1.4, 0.03), (0.07, -0.4, 0.02), (0.3, -0.35, 0.05)),
+    "|": ((0.0, 0.8, 0.004),),
+}
+_TEMPLATE_SEC = (-0.3, 0.45)
+
+# Gain of written signals, in ADC units per mV
+_ADC_GAIN = 200.0
+
+
+class SyntheticBeats(NamedTuple):
+    # Beat times, in seconds, sorted
+    time: np.ndarray
+    # WFDB annotation symbol of each beat: N (normal), V (ectopic) or |
+    # (artifact, i.e. a spurious detection)
+    symbol: np.ndarray
+    # Total duration in seconds
+    duration: float
+    # Start and end times, in seconds, of gaps of signal loss, shape (N, 2)
+    gaps: np.ndarray
+    seed: int
+
+    def rr(self, types: str = None, dtype=np.float64):
+        """
+        :param types: Symbols of the beats to use, e.g. 'N'. None means all.
+        :param dtype: Desired dtype of output arrays.
+        :return: Tuple of time axis and interval durations, in seconds, in the
+        same form as :meth:`pyhrv.wfdb.rri.ecgrr`.
+        """
+        time = self.time
+        if types is not None:
+            time = time[np.isin(self.symbol, list(types))]
+        return time[:-1].astype(dtype), np.diff(time).astype(dtype)
+
+
+def generate_beats(
+    duration: float,
+    mean_rr: float = 0.8,
+    sdnn: float = 0.05,
+    lf_hf_ratio: float = 1.5,
+    lf_freq: float = 0.1,
+    hf_freq: float = 0.25,
+    band_width: float = 0.01,
+    ectopic_rate: float = 0.0,
+    artifact_rate: float = 0.0,
+    gap_rate: float = 0.0,
+    gap_sec: float = 10.0,
+    seed: int = 0,
+) -> SyntheticBeats:
+    """
+    Generates synthetic beat times.
+    :param duration: Duration in seconds.
+    :param mean_rr: Mean RR interval, in seconds.
+    :param sdnn: Approximate standard deviation of the RR intervals of normal
+    beats, in seconds.
+    :param lf_hf_ratio: Ratio between the power of the LF and HF components
+    of the heart rate modulation.
+    :param lf_freq: Center frequency of the LF component, in Hz.
+    :param hf_freq: Center frequency of the HF component, in Hz.
+    :param band_width: Standard deviation, in Hz, of the spectral peak of
+    each component.
+    :param ectopic_rate: Fraction of beats which are premature ectopic beats
+    (followed by a compensatory pause).
+    :param artifact_rate: Number of spurious detections, as a fraction of
+    the number of beats.
+    :param gap_rate: Mean number of gaps of signal loss per hour.
+    :param gap_sec: Duration of each gap, in seconds.
+    :param seed: Random seed.
+    :return: A :class:`SyntheticBeats`.
+    """
+    rng = np.random.default_rng(seed)
+    time = _ipfm_times(
+        duration, mean_rr, sdnn, lf_hf_ratio, lf_freq, hf_freq, band_width, rng
+    )
+    symbol = np.full(len(time), "N")
+
+    # Ectopic beats occur early, without shifting the next beat
+    ectopic = rng.random(len(time)) < ectopic_rate
+    ectopic[:1] = ectopic[-1:] = False
+    prematurity = rng.uniform(0.25, 0.4, size=len(time))
+    prev_rr = np.diff(time, prepend=time[:1])
+    time = np.where(ectopic, time - prematurity * prev_rr, time)
+    symbol[ectopic] = "V"
+
+    # Artifacts are placed between two consecutive beats
+    n_artifacts = rng.binomial(max(len(time) - 1, 0), min(artifact_rate, 1.0))
+    after = rng.integers(0, max(len(time) - 1, 1), size=n_artifacts)
+    frac = rng.uniform(0.2, 0.8, size=n_artifacts)
+    artifact_time = time[after] + frac * (time[after + 1] - time[after])
+    time = np.concatenate([time, artifact_time])
+    symbol = np.concatenate([symbol, np.full(n_artifacts, "|")])
+    idx = np.argsort(time, kind="stable")
+    time, symbol = time[idx], symbol[idx]
+
+    # Beats within gaps are lost
+    n_gaps = rng.poisson(gap_rate * duration / 3600)
+    starts = np.sort(rng.uniform(0, max(0.0, duration - gap_sec), size=n_gaps))
+    gaps = np.stack([starts, starts + gap_sec], axis=1)
+    lost = np.zeros(len(time), dtype=bool)
+    for start, end in gaps:
+        lost |= (time >= start) & (time < end)
+
+    return SyntheticBeats(time[~lost], symbol[~lost], float(duration), gaps, seed)
+
+
+def generate_rr(duration: float, dtype=np.float64, **kw):
+    """
+    Generates synthetic RR intervals, see :meth:`generate_beats`.
+    :param duration: Duration in seconds.
+    :param dtype: Desired dtype of output arrays.
+    :param kw: Arguments for :meth:`generate_beats`.
+    :return: Tuple of time axis and interval durations, in seconds.
+    """
+    return generate_beats(duration, **kw).rr(dtype=dtype)
+
+
+def generate_ecg(beats: SyntheticBeats, fs: float = 250, noise_mv: float = 0.02):
+    """
+    Generates a single-channel ECG signal for given beats.
+    :param beats: Beats, from :meth:`generate_beats`.
+    :param fs: Sampling frequency, in Hz.
+    :param noise_mv: Standard deviation of additive noise, in mV.
+    :return: The signal, in mV. Samples within gaps are NaN.
+    """
+    return np.concatenate(list(_iter_ecg_blocks(beats, fs, noise_mv)))
+
+
+def write_record(
+    rec_path: str,
+    beats: SyntheticBeats,
+    fs: float = 250,
+    signal: bool = True,
+    ann_ext: str = "atr",
+    noise_mv: float = 0.02,
+) -> str:
+    """
+    Writes beats as a PhysioNet record with an annotation file.
+    The signal is generated and written in blocks, so long records can be
+    written without holding the whole signal in memory.
+    :param rec_path: Path of the record to write, without extension. Its
+    directory is created if needed.
+    :param beats: Beats, from :meth:`generate_beats`.
+    :param fs: Sampling frequency, in Hz.
+    :param signal: Whether to write an ECG signal (see :meth:`generate_ecg`),
+    in format 16. Otherwise only a header without signals is written.
+    :param ann_ext: Extension of the annotation file.
+    :param noise_mv: Standard deviation of the signal's noise, in mV.
+    :return: The record path.
+    """
+    rec_path = str(rec_path)
+    rec_dir, rec_name = os.path.split(rec_path)
+    os.makedirs(rec_dir or ".", exist_ok=True)
+    sig_len = int(beats.duration * fs)
+
+    samples = np.round(beats.time * fs).astype(np.int64)
+    wfdb.wrann(
+        rec_name,
+        ann_ext,
+        sample=samples,
+        symbol=beats.symbol.tolist(),
+        write_dir=rec_dir,
+    )
+
+    if not signal:
+        # wfdb can't write a header without signals
+        with open(f"{rec_path}.hea", "w") as f:
+            f.write(f"{rec_name} 0 {fs:g} {sig_len}\n")
+        return rec_path
+
+    checksum, init_value = 0, None
+    with open(f"{rec_path}.dat", "wb") as f:
+        for block in _iter_ecg_blocks(beats, fs, noise_mv):
+            digital = np.clip(np.round(block * _ADC_GAIN), -32767, 32767)
+            digital[np.isnan(block)] = _INVALID_SAMPLE["16"]
+            digital = digital.astype("<i2")
+            digital.tofile(f)
+            checksum += int(np.sum(digital, dtype=np.int64))
+            if init_value is None:
+                init_value = int(digital[0])
+
+    record = wfdb.Record(
+        record_name=rec_name,
+        n_sig=1,
+        fs=fs,
+        sig_len=sig_len,
+        file_name=[f"{rec_name}.dat"],
+        fmt=["16"],
+        adc_gain=[_ADC_GAIN],
+        baseline=[0],
+        units=["mV"],
+        sig_name=["ECG"],
+        adc_res=[16],
+        adc_zero=[0],
+        init_value=[init_value or 0],
+        # Checksums are 16-bit signed
+        checksum=[(checksum + 2 ** 15) % 2 ** 16 - 2 ** 15],
+        block_size=[0],
+    )
+    record.wrheader(write_dir=rec_dir)
+    return rec_path
+
+
+def _ipfm_times(
+    duration, mean_rr, sdnn, lf_hf_ratio, lf_freq, hf_freq, band_width, rng
+):
+    fs = _IPFM_FS
+    n = int(math.ceil(duration * fs)) + 2
+    t = np.arange(n) / fs
+
+    # Band-limited gaussian noise with the given spectral peaks
+    f = np.fft.rfftfreq(n, 1 / fs)
+    psd = lf_hf_ratio * _gaussian(f, lf_freq, band_width)
+    psd += _gaussian(f, hf_freq, band_width)
+    coeffs = rng.standard_normal(len(f)) + 1j * rng.standard_normal(len(f))
+    m = np.fft.irfft(np.sqrt(psd) * coeffs, n)
+    m_std = np.std(m)
+    m *= (sdnn / mean_rr) / m_std if m_std > 0 else 0.0
+    m = np.clip(m, -0.5, 0.5)
+
+    # A beat occurs whenever the integrated rate crosses an integer
+    rate = (1 + m) / mean_rr
+    phase = np.empty(n)
+    phase[0] = rng.random()
+    np.cumsum((rate[1:] + rate[:-1]) / (2 * fs), out=phase[1:])
+    phase[1:] += phase[0]
+    k = np.arange(math.ceil(phase[0]), math.floor(phase[-1]) + 1)
+    time = np.interp(k, phase, t)
+    return time[time < duration]
+
+
+def _gaussian(x, mu, sigma):
+    return np.exp(-0.5 * ((x - mu) / sigma) ** 2)
+
+
+def _templates(fs):
+    offsets = np.arange(
+        math.floor(_TEMPLATE_SEC[0] * fs), math.ceil(_TEMPLATE_SEC[1] * fs) + 1
+    )
+    t = offsets / fs
+    templates = {
+        symbol: sum(amp * _gaussian(t, mu, width) for mu, amp, width in waves)
+        for symbol, waves in _WAVES.items()
+    }
+    return offsets, templates
+
+
+def _iter_ecg_blocks(beats, fs, noise_mv) -> Iterator[np.ndarray]:
+    offsets, templates = _templates(fs)
+    samples = np.round(beats.time * fs).astype(np.int64)
+    sig_len = int(beats.duration * fs)
+    block_len = int(_BLOCK_SEC * fs)
+
+    for i, start in enumerate(range(0, sig_len, block_len)):
+        stop = min(start + block_len, sig_len)
+        # Noise depends only on the seed and block index
+        rng = np.random.default_rng([beats.seed, i])
+        t = np.arange(start, stop) / fs
+        block = noise_mv * rng.standard_normal(stop - start)
+        block += 0.05 * np.sin(2 * np.pi * 0.3 * t)  # Baseline wander
+
+        # Beats whose template overlaps the block
+        lo = np.searchsorted(samples, start - offsets[-1])
+        hi = np.searchsorted(samples, stop - offsets[0])
+        for symbol, template in templates.items():
+            sym_samples = samples[lo:hi][beats.symbol[lo:hi] == symbol]
+            idx = sym_samples[:, None] + offsets - start
+            valid = (idx >= 0) & (idx < stop - start)
+            values = np.broadcast_to(template, idx.shape)[valid]
+            np.add.at(block, idx[valid], values)
+
+        for gap_start, gap_end in beats.gaps:
+            block[(t >= gap_start) & (t < gap_end)] = np.nan
+
+        yield block
@@ -1,21 +1,57 @@
+import os
 import math
-import numpy as np
 import logging
-import scipy.signal
-import scipy.interpolate
+import contextlib
+import contextvars
+import numpy as np
 from typing import Tuple, Union, Callable
+from concurrent.futures import ThreadPoolExecutor
 
 import pyhrv.conf
-import pyhrv.rri.frequency as frequency
 from pyhrv import utils
+from pyhrv import profiling
 
 logger = logging.getLogger(__name__)
 
 
 def v(k):
-    return pyhrv.conf.get_val(f"hrv_freq.{k}")
+    return pyhrv.conf.param(f"hrv_freq.{k}")
+
+
+@profiling.profiled("hrv_time")
+@pyhrv.conf.resolve_params
+def hrv_time(
+    rri: np.ndarray,
+    pnn_thresh_ms: float = pyhrv.conf.param("hrv_time.pnn_thresh_ms"),
+) -> dict:
+    """
+    Time-domain HRV metrics of an NN interval sequence.
+
+    :param rri: RR/NN intervals, in seconds.
+    :param pnn_thresh_ms: Threshold in milliseconds for the pNNx metric.
+    :return: A dict with the following metrics:
+        - ``AVNN``: Average NN interval duration, in milliseconds.
+        - ``SDNN``: Standard deviation of NN intervals, in milliseconds.
+        - ``RMSSD``: RMS of successive NN interval differences, in
+          milliseconds.
+        - ``pNNx``: Percent of successive NN intervals differing by more
+          than ``pnn_thresh_ms``.
+    """
+    rri, _ = utils.standardize_rri_trr(rri)
+    rri_ms = rri.astype(np.float64) * 1000
+    drri_ms = np.diff(rri_ms)
+
+    return {
+        "AVNN": np.mean(rri_ms),
+        "SDNN": np.std(rri_ms, ddof=1) if len(rri_ms) > 1 else np.nan,
+        "RMSSD": np.sqrt(np.mean(drri_ms ** 2)) if len(drri_ms) else np.nan,
+        f"pNN{pnn_thresh_ms:g}": 100 * np.mean(np.abs(drri_ms) > pnn_thresh_ms)
+        if len(drri_ms)
+        else np.nan,
+    }
 
 
+@pyhrv.conf.resolve_params
 def hrv_freq(
     rri: np.ndarray,
     trr: np.ndarray = None,
@@ -31,6 +67,7 @@ def hrv_freq(
     resample_factor: float = v("resample_factor"),
     welch_overlap: float = v("welch_overlap"),
     ar_order: int = v("ar_order"),
+    n_jobs: int = v("n_jobs"),
 ):
     """
     NN interval spectrum and frequency-domain HRV metrics.
@@ -44,7 +81,8 @@ def hrv_freq(
 
     :param methods: A cell array of strings containing names of methods to use
     to estimate the spectrum. Supported methods are:
-       - ``lomb``: Lomb-scargle periodogram.
+       - ``lomb``: Lomb-scargle periodogram, scaled as a one-sided PSD
+          like the other methods, so their band powers are comparable.
        - ``ar``: Yule-Walker autoregressive model. Data will be resampled.
           No windowing will be performed for this method.
        - ``welch``: Welch's method (overlapping windows).
@@ -96,8 +134,16 @@ def hrv_freq(
     :param welch_overlap: Percentage of overlap between windows when using
     Welch's method.
 
+    :param n_jobs: Number of threads. The methods run concurrently, the
+    windows and frequencies of the ``lomb`` method are split between threads,
+    and the FFTs of the ``welch`` method are multithreaded. The results don't
+    depend on the number of threads. None means the number of CPUs.
+
     :returns:
     """
+    # scipy is slow to import, and only needed for the spectral metrics
+    import scipy.interpolate
+    import pyhrv.rri.frequency as frequency
 
     # Validate methods
     supported_methods = {"lomb", "ar", "welch"}
@@ -109,7 +155,7 @@ def hrv_freq(
         )
 
     # Validate norm method
-    supported_norm_methods = {"total", "lf_af"}
+    supported_norm_methods = {"total", "lf_hf"}
     norm_method = norm_method.lower()
     if norm_method not in supported_norm_methods:
         raise ValueError(
@@ -163,31 +209,161 @@ def hrv_freq(
             "Nyquist criterion not met for given window length and " "frequency bands"
         )
 
-    # Calculate spectrums
-    pxx = {}
-    if "lomb" in methods:
-        pxx["lomb"] = frequency.pxx_lomb(rri, f_axis, trr, t_win, win_func)
+    n_jobs = n_jobs or os.cpu_count() or 1
 
-    # Resample on a uniform time axis to obtain spectral estimate
-    rri_interpolator = scipy.interpolate.interp1d(
-        trr, rri, kind="cubic", assume_sorted=True, fill_value="extrapolate"
-    )
-    rri_uni = rri_interpolator(trr_uni)
+    def _pxx_lomb():
+        with profiling.stage("hrv_freq.lomb", len(rri)):
+            return frequency.pxx_lomb(rri, f_axis, trr, t_win, win_func, n_jobs)
 
-    if "welch" in methods:
-        welch_window = win_func(n_win_uni)
-        welch_overlap = math.floor(n_win_uni * welch_overlap / 100)
-        f_welch, pxx_welch = scipy.signal.welch(
-            rri_uni,
-            fs=fs_uni,
-            nperseg=n_win_uni,
-            noverlap=welch_overlap,
-            window=welch_window,
-            detrend="constant",
-            scaling="density",
-            return_onesided=True,
-        )
+    # Calculate spectrums. The lomb method runs in another thread while the
+    # intervals are resampled for the other methods.
+    pxx = {}
+    lomb_future = None
+    with contextlib.ExitStack() as stack:
+        if "lomb" in methods and n_jobs > 1:
+            pool = stack.enter_context(ThreadPoolExecutor(max_workers=1))
+            lomb_future = pool.submit(contextvars.copy_context().run, _pxx_lomb)
+        elif "lomb" in methods:
+            pxx["lomb"] = _pxx_lomb()
+
+        # Resample on a uniform time axis to obtain spectral estimate
+        with profiling.stage("hrv_freq.resample", len(trr_uni)):
+            rri_interpolator = scipy.interpolate.interp1d(
+                trr, rri, kind="cubic", assume_sorted=True, fill_value="extrapolate"
+            )
+            rri_uni = rri_interpolator(trr_uni)
+
+        if "welch" in methods:
+            welch_window = win_func(n_win_uni)
+            welch_overlap = math.floor(n_win_uni * welch_overlap / 100)
+            with profiling.stage("hrv_freq.welch", len(rri_uni)):
+                f_welch, pxx_welch = frequency.pxx_welch(
+                    rri_uni, fs_uni, welch_window, welch_overlap, workers=n_jobs
+                )
+
+        if lomb_future is not None:
+            pxx["lomb"] = lomb_future.result()
 
-        pxx["welch"] = pxx_welch[f_welch <= f_max]
+    if "welch" in methods:
+        # Evaluate at the same frequencies as the other methods
+        pxx["welch"] = np.interp(f_axis, f_welch, pxx_welch)
 
     return pxx, f_axis
+
+
+def _spectra_size(pxx: dict) -> int:
+    return sum(np.size(pxx_method) for pxx_method in pxx.values())
+
+
+@profiling.profiled("hrv_freq.band_powers", size=_spectra_size)
+@pyhrv.conf.resolve_params
+def band_powers(
+    pxx: dict,
+    f_axis: np.ndarray,
+    norm_method: str = v("norm_method"),
+    vlf_band: Tuple[float] = v("vlf_band"),
+    lf_band: Tuple[float] = v("lf_band"),
+    hf_band: Tuple[float] = v("hf_band"),
+    extra_bands: Tuple[float] = v("extra_bands"),
+) -> dict:
+    """
+    Power in frequency bands of NN interval spectra.
+
+    :param pxx: A dict mapping each method to its spectrum, and the frequency
+    axis, as returned by :meth:`hrv_freq`.
+    :param f_axis: Frequency axis of the spectra, in Hz.
+    :param norm_method: Either ``total`` or ``lf_hf``, see :meth:`hrv_freq`.
+    :param vlf_band: 2-element vector of frequencies in Hz defining the VLF
+    band.
+    :param lf_band: 2-element vector of frequencies in Hz defining the LF band.
+    :param hf_band: 2-element vector of frequencies in Hz defining the HF band.
+    :param extra_bands: Pairs of frequencies, each defining a custom band.
+    :return: A dict mapping each method to a dict with the following metrics:
+        - ``TOTAL_POWER``: Power of the entire spectrum, in ms^2.
+        - ``VLF_POWER``, ``LF_POWER``, ``HF_POWER``: Power in each band, in
+          ms^2. Also for each extra band, named e.g. ``0.1-0.2Hz_POWER``.
+        - ``VLF_NORM``, ``LF_NORM``, ``HF_NORM``: Normalized power in each
+          band (and each extra band), in percent.
+        - ``LF_TO_HF``: Ratio of LF to HF power.
+    """
+    norm_method = norm_method.lower()
+    if norm_method not in {"total", "lf_hf"}:
+        raise ValueError(f"Unsupported norm_method ({norm_method})")
+
+    f_axis = np.asarray(f_axis)
+    df = f_axis[1] - f_axis[0] if len(f_axis) > 1 else 1.0
+    bands = {"VLF": vlf_band, "LF": lf_band, "HF": hf_band}
+    for f_lo, f_hi in extra_bands or ():
+        bands[f"{f_lo:g}-{f_hi:g}Hz"] = (f_lo, f_hi)
+
+    powers = {}
+    for method, pxx_method in pxx.items():
+        # Spectra are of intervals in seconds, so power is in s^2
+        pxx_ms = np.asarray(pxx_method, dtype=np.float64) * 1e6
+        metrics = {"TOTAL_POWER": np.sum(pxx_ms) * df}
+        for name, (f_lo, f_hi) in bands.items():
+            idx = (f_axis >= f_lo) & (f_axis < f_hi)
+            metrics[f"{name}_POWER"] = np.sum(pxx_ms[idx]) * df
+
+        total = metrics["TOTAL_POWER"]
+        lf, hf = metrics["LF_POWER"], metrics["HF_POWER"]
+        for name in bands:
+            norm = total
+            if norm_method == "lf_hf" and name in ("LF", "HF"):
+                norm = lf + hf
+            metrics[f"{name}_NORM"] = 100 * metrics[f"{name}_POWER"] / norm
+        metrics["LF_TO_HF"] = lf / hf if hf > 0 else np.nan
+        powers[method] = metrics
+
+    return powers
+
+
+@profiling.profiled("hrv_freq.beta", size=_spectra_size)
+@pyhrv.conf.resolve_params
+def beta(
+    pxx: dict,
+    f_axis: np.ndarray,
+    beta_band: Tuple[float] = v("beta_band"),
+    vlf_band: Tuple[float] = v("vlf_band"),
+) -> dict:
+    """
+    Power-law exponent (beta) of NN interval spectra: the slope of a linear
+    fit of log10(power) to log10(frequency) within a band. All spectra are
+    fitted with a single least-squares solve.
+
+    :param pxx: A dict mapping each method to its spectrum, as returned by
+    :meth:`hrv_freq`, or to a matrix with the spectrum of each window in a row.
+    :param f_axis: Frequency axis of the spectra, in Hz.
+    :param beta_band: 2-element vector of frequencies in Hz defining the band
+    of the fit. Empty means the VLF band.
+    :param vlf_band: 2-element vector of frequencies in Hz defining the VLF
+    band.
+    :return: A dict mapping each method to its beta, or to an array with the
+    beta of each window. Spectra with non-positive power within the band have
+    a beta of NaN.
+    """
+    f_lo, f_hi = beta_band if beta_band is not None and len(beta_band) else vlf_band
+    f_axis = np.asarray(f_axis, dtype=np.float64)
+    idx = (f_axis >= f_lo) & (f_axis < f_hi) & (f_axis > 0)
+    if np.count_nonzero(idx) < 2:
+        raise ValueError("Less than two frequencies within the beta band")
+
+    # Spectra of all methods and windows, one per row
+    methods = list(pxx)
+    spectra = [np.atleast_2d(np.asarray(pxx[m], dtype=np.float64)) for m in methods]
+    log_pxx = np.concatenate([s[:, idx] for s in spectra], axis=0)
+    valid = np.all(log_pxx > 0, axis=1) & np.all(np.isfinite(log_pxx), axis=1)
+    log_pxx = np.log10(log_pxx[valid])
+
+    # Columns of the design matrix: log10(f) and an intercept
+    design = np.stack([np.log10(f_axis[idx]), np.ones(np.count_nonzero(idx))], 1)
+    coeffs, *_ = np.linalg.lstsq(design, log_pxx.T, rcond=None)
+    betas = np.full(len(valid), np.nan)
+    betas[valid] = coeffs[0]
+
+    result, start = {}, 0
+    for method, spectrum in zip(methods, spectra):
+        method_betas = betas[start : start + len(spectrum)]
+        start += len(spectrum)
+        result[method] = method_betas if np.ndim(pxx[method]) > 1 else method_betas[0]
+    return result
@@ -0,0 +1,323 @@
+"""
+The ``pyhrv`` command: calculates HRV metrics of many PhysioNet records in
+parallel, and streams the results as JSON lines (one per record, or per
+window of each record) as records complete.
+
+Example::
+
+    pyhrv --jobs 8 --ann-ext atr --window-minutes 5 db/mitdb -o mitdb.jsonl
+"""
+import os
+import sys
+import glob
+import json
+import math
+import argparse
+import numpy as np
+from typing import List, Sequence
+
+import pyhrv.conf
+import pyhrv.utils
+import pyhrv.hrv as hrv
+import pyhrv.batch as batch
+import pyhrv.wfdb.rri as rri
+import pyhrv.wfdb.utils as wfdb_utils
+import pyhrv.rri.processing as processing
+
+
+def hrv_record_rows(
+    rec_path: str,
+    filter_rri: bool = True,
+    window_minutes: float = None,
+    methods: Sequence[str] = None,
+    **ecgrr_kw,
+) -> List[dict]:
+    """
+    Calculates time- and frequency-domain HRV metrics of a record.
+    :param rec_path: Path of the record (without extension).
+    :param filter_rri: Whether to filter the RR intervals with
+    :meth:`pyhrv.rri.processing.filtrr`.
+    :param window_minutes: If provided, the metrics are calculated separately
+    for consecutive windows of this duration. Otherwise, for the entire record.
+    :param methods: Spectral methods for :meth:`pyhrv.hrv.hrv_freq`. None means
+    the configured methods, and an empty sequence disables the frequency-domain
+    metrics.
+    :param ecgrr_kw: Arguments for :meth:`pyhrv.wfdb.rri.ecgrr`.
+    :return: A list of dicts as returned by :meth:`hrv_rr_rows`, each also
+    with the record path.
+    """
+    trr, rr = rri.ecgrr(rec_path, **ecgrr_kw)
+    rows = hrv_rr_rows(trr, rr, filter_rri, window_minutes, methods)
+    return [dict(rec_path=str(rec_path), **row) for row in rows]
+
+
+def hrv_rr_rows(
+    trr: np.ndarray,
+    rr: np.ndarray,
+    filter_rri: bool = True,
+    window_minutes: float = None,
+    methods: Sequence[str] = None,
+) -> List[dict]:
+    """
+    Calculates time- and frequency-domain HRV metrics of RR intervals.
+    :param trr: Time axis of the intervals, in seconds. None means starting
+    from zero.
+    :param rr: RR intervals, in seconds.
+    :param filter_rri: Whether to filter the intervals with
+    :meth:`pyhrv.rri.processing.filtrr`.
+    :param window_minutes: If provided, the metrics are calculated separately
+    for consecutive windows of this duration. Otherwise, for all intervals.
+    :param methods: Spectral methods for :meth:`pyhrv.hrv.hrv_freq`. None means
+    the configured methods, and an empty sequence disables the frequency-domain
+    metrics.
+    :return: A list of dicts (one per window, or a single one), each with the
+    time range of the window, the number of intervals in it, and the metrics
+    calculated by :meth:`pyhrv.hrv.hrv_time`, :meth:`pyhrv.hrv.band_powers`
+    (named e.g. ``lomb.LF_POWER``) and :meth:`pyhrv.hrv.beta` (``lomb.BETA``).
+    Windows with less than two intervals have no metrics, and the
+    frequency-domain metrics are omitted if the spectrum can't be estimated.
+    """
+    trr = None if trr is None else np.asarray(trr)
+    rr, trr = pyhrv.utils.standardize_rri_trr(np.asarray(rr), trr)
+    if filter_rri:
+        trr, rr = processing.filtrr(trr, rr)
+
+    if window_minutes and len(trr):
+        # Windows are aligned to the start of the record, and only complete
+        # windows are used.
+        win_sec = 60 * window_minutes
+        first, last = math.floor(trr[0] / win_sec), math.floor(trr[-1] / win_sec)
+        windows = [(win_sec * k, win_sec * (k + 1)) for k in range(first, last)]
+    elif window_minutes:
+        windows = []
+    else:
+        windows = [(trr[0], trr[-1]) if len(trr) else (0.0, 0.0)]
+
+    rows, spectra = [], {}
+    for i, (t_start, t_end) in enumerate(windows):
+        start, end = np.searchsorted(trr, [t_start, t_end])
+        if not window_minutes:
+            start, end = 0, len(trr)
+        row = dict(window=i) if window_minutes else {}
+        row.update(t_start=float(t_start), t_end=float(t_end), n_rr=int(end - start))
+        metrics, spectrum = _window_metrics(trr[start:end], rr[start:end], methods)
+        row.update(metrics)
+        rows.append(row)
+        if spectrum is not None:
+            # Windows with the same frequency axis are grouped for hrv.beta
+            pxx, f_axis = spectrum
+            key = (f_axis.tobytes(), tuple(pxx))
+            spectra.setdefault(key, (f_axis, []))[1].append((row, pxx))
+
+    for f_axis, windows_pxx in spectra.values():
+        _add_betas(f_axis, windows_pxx)
+    return rows
+
+
+def _window_metrics(trr, rr, methods):
+    if len(rr) < 2:
+        return {}, None
+
+    metrics = hrv.hrv_time(rr)
+    if methods is not None and not methods:
+        return metrics, None
+
+    # The spectrum is only estimated for at least a minute of intervals
+    try:
+        if len(rr) < 3 or trr[-1] - trr[0] < 60:
+            raise ValueError("Not enough intervals")
+        kw = {} if methods is None else dict(methods=methods)
+        pxx, f_axis = hrv.hrv_freq(rr, trr - trr[0], **kw)
+        powers = hrv.band_powers(pxx, f_axis)
+    except ValueError:
+        return metrics, None
+    for method, method_powers in powers.items():
+        for name, val in method_powers.items():
+            metrics[f"{method}.{name}"] = val
+    return metrics, (pxx, f_axis)
+
+
+def _add_betas(f_axis, windows_pxx):
+    # The spectra of all windows are fitted at once
+    methods = list(windows_pxx[0][1])
+    pxx = {m: np.stack([w_pxx[m] for _, w_pxx in windows_pxx]) for m in methods}
+    try:
+        betas = hrv.beta(pxx, f_axis)
+    except ValueError:
+        return
+    for method in methods:
+        for (row, _), val in zip(windows_pxx, betas[method]):
+            row[f"{method}.BETA"] = val
+
+
+def find_records(inputs: Sequence[str], ann_ext: str = None) -> List[str]:
+    """
+    Finds records given paths, glob patterns or directories.
+    :param inputs: Each one is either a record path (with or without the
+    ``.hea`` extension), a glob pattern matching record files (e.g.
+    ``db/*.hea``), or a directory which is searched recursively.
+    :param ann_ext: Extension of an annotation file which the records found in
+    directories and by patterns must have.
+    :return: Record paths (without extension), in order of the inputs and
+    without duplicates.
+    """
+    rec_paths = []
+    for path in inputs:
+        path = str(path)
+        if os.path.isdir(path):
+            rec_paths.extend(batch._rec_paths(path, ann_ext))
+        elif glob.has_magic(path):
+            matched = [os.path.splitext(p)[0] for p in sorted(glob.glob(path))]
+            rec_paths.extend(
+                p for p in matched if wfdb_utils.is_record(p, ann_ext=ann_ext)
+            )
+        else:
+            rec_paths.append(path[:-4] if path.endswith(".hea") else path)
+    return list(dict.fromkeys(rec_paths))
+
+
+def _to_json(obj) -> str:
+    # NaN isn't valid JSON, so it's written as null
+    def _val(val):
+        if isinstance(val, dict):
+            return {k: _val(v) for k, v in val.items()}
+        if isinstance(val, (list, tuple)):
+            return [_val(v) for v in val]
+        if isinstance(val, (float, np.floating)):
+            val = float(val)
+            return val if math.isfinite(val) else None
+        if isinstance(val, np.integer):
+            return int(val)
+        return val
+
+    return json.dumps(_val(obj))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="pyhrv",
+        description="Calculate HRV metrics of PhysioNet records, and write them as "
+        "JSON lines as records complete.",
+        epilog="Run 'pyhrv serve --help' for the service mode.",
+    )
+    parser.add_argument(
+        "records",
+        nargs="+",
+        help="Record paths (without extension), glob patterns of record files, "
+        "or directories to search for records",
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", help="Output file (default: stdout)"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="YAML configuration file, in the format of config_default.yaml",
+    )
+    parser.add_argument(
+        "-a",
+        "--ann-ext",
+        help="Read R-peaks from annotation files with this extension, "
+        "instead of detecting them",
+    )
+    parser.add_argument("--detector", help="Name of a registered R-peak detector")
+    parser.add_argument("--channel", type=int, help="ECG channel of the records")
+    parser.add_argument("--from-time", help="Start time (PhysioNet format)")
+    parser.add_argument("--to-time", help="End time (PhysioNet format)")
+    parser.add_argument(
+        "-w",
+        "--window-minutes",
+        type=float,
+        help="Write a line per window of this duration, instead of per record",
+    )
+    parser.add_argument(
+        "-m",
+        "--method",
+        action="append",
+        choices=["lomb", "welch"],
+        help="Spectral method (can be repeated, default: configured methods)",
+    )
+    parser.add_argument(
+        "--no-freq", action="store_true", help="Skip frequency-domain metrics"
+    )
+    parser.add_argument(
+        "--no-filter", action="store_true", help="Don't filter RR intervals"
+    )
+    parser.add_argument(
+        "--progress", action="store_true", help="Show a progress bar on stderr"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    """
+    Runs the ``pyhrv`` command, or ``pyhrv serve`` (see :mod:`pyhrv.server`).
+    :param argv: Command-line arguments (default: sys.argv).
+    :return: Exit code: 0 if all records were processed, 1 if any failed.
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ["serve"]:
+        import pyhrv.server as server
+
+        return server.main(argv[1:])
+
+    args = parse_args(argv)
+    overrides = pyhrv.conf.read_file(args.config) if args.config else {}
+
+    ecgrr_kw = dict(
+        ann_ext=args.ann_ext,
+        channel=args.channel,
+        from_time=args.from_time,
+        to_time=args.to_time,
+    )
+    if args.detector is not None:
+        ecgrr_kw["detector"] = args.detector
+
+    rec_paths = find_records(args.records, args.ann_ext)
+    n_failed = 0
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        # Workers apply the overrides of the current context
+        with pyhrv.conf.override(**overrides):
+            results = batch.map_records(
+                hrv_record_rows,
+                rec_paths,
+                n_jobs=args.jobs,
+                progress=args.progress,
+                filter_rri=not args.no_filter,
+                window_minutes=args.window_minutes,
+                methods=() if args.no_freq else args.method,
+                **ecgrr_kw,
+            )
+            for result in results:
+                if result.ok:
+                    rows = result.result
+                else:
+                    n_failed += 1
+                    rows = [dict(rec_path=result.rec_path, error=result.error)]
+                for row in rows:
+                    out.write(_to_json(row) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    return 1 if n_failed else 0
+
+
+def run():
+    """
+    Entry point of the ``pyhrv`` console script.
+    """
+    sys.exit(main(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,489 @@
+"""
+This module contains opt-in instrumentation of the processing pipeline.
+
+Each instrumented stage (e.g. reading a header, running a QRS detector or
+estimating a spectrum) records its wall time and the size of its input into
+the active collectors and sinks. When no collector or sink is active, an
+instrumented stage costs a single flag check.
+
+Example::
+
+    with pyhrv.profiling.profile() as stats:
+        pyhrv.batch.hrv_many(records, n_jobs=1)
+    print(stats.summary())
+
+Stages which run in worker processes (e.g. of :meth:`pyhrv.batch.map_records`)
+are recorded in those processes, not in the caller's collectors.
+
+Memory allocations of each stage can also be measured with tracemalloc, see
+:func:`profile`. This module can be run as a script to profile the
+processing of synthetic RR intervals of various lengths.
+"""
+import time
+import logging
+import argparse
+import functools
+import threading
+import contextlib
+import tracemalloc
+from typing import Callable, Dict, Iterator, NamedTuple, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Whether any collector or sink is active. Checked on the hot paths, so it's
+# kept as a plain module-level flag.
+_enabled = False
+_lock = threading.Lock()
+_collectors = ()
+_sinks = ()
+
+# Number of active profile() contexts which measure memory
+_trace_memory = 0
+# Per thread, a stack of [start, peak] traced memory of the stages being run
+_mem_frames = threading.local()
+
+
+class StageStats(NamedTuple):
+    # Number of times the stage was run
+    calls: int
+    # Wall time in seconds, over all calls
+    total_time: float
+    min_time: float
+    max_time: float
+    # Total size of the inputs (e.g. number of samples), over calls which
+    # reported one
+    total_size: int
+    # Maximal peak of memory allocated during a call, in bytes, relative to
+    # the start of the call. -1 if not measured.
+    peak_mem: int = -1
+    # Total memory allocated and not freed by the calls, in bytes
+    net_mem: int = 0
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.calls if self.calls else float("nan")
+
+
+class Stats(object):
+    """
+    Statistics of instrumented stages, collected while active (see
+    :func:`profile` and :func:`enable`).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(
+        self,
+        stage: str,
+        wall_time: float,
+        size: int = None,
+        peak_mem: int = None,
+        net_mem: int = None,
+    ):
+        """
+        Adds a run of a stage.
+        :param stage: Name of the stage.
+        :param wall_time: Wall time of the run, in seconds.
+        :param size: Size of the stage's input, if applicable.
+        :param peak_mem: Peak memory allocated during the run, if measured.
+        :param net_mem: Memory allocated and not freed by the run, if measured.
+        """
+        with self._lock:
+            s = self._stages.get(stage)
+            if s is None:
+                s = self._stages[stage] = [0, 0.0, wall_time, wall_time, 0, -1, 0]
+            s[0] += 1
+            s[1] += wall_time
+            s[2] = min(s[2], wall_time)
+            s[3] = max(s[3], wall_time)
+            s[4] += size or 0
+            if peak_mem is not None:
+                s[5] = max(s[5], peak_mem)
+                s[6] += net_mem
+
+    def get(self, prefix: str = "") -> Dict[str, StageStats]:
+        """
+        :param prefix: A common prefix of stage names, e.g. 'qrs'.
+        :return: A dict mapping the name of each stage matching the prefix to
+        its statistics, sorted by name.
+        """
+        with self._lock:
+            return {
+                stage: StageStats(*s)
+                for stage, s in sorted(self._stages.items())
+                if stage == prefix or stage.startswith(prefix)
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def summary(self) -> str:
+        """
+        :return: A table of the statistics of all stages, sorted by total
+        time.
+        """
+        stats = sorted(self.get().items(), key=lambda kv: -kv[1].total_time)
+        with_mem = any(s.peak_mem >= 0 for _, s in stats)
+        lines = [
+            f"{'stage':<24} {'calls':>8} {'total [s]':>10} {'mean [ms]':>10} "
+            f"{'max [ms]':>10} {'size':>12}"
+            + (f" {'peak [MB]':>10} {'net [MB]':>10}" if with_mem else "")
+        ]
+        for stage, s in stats:
+            lines.append(
+                f"{stage:<24} {s.calls:>8} {s.total_time:>10.3f} "
+                f"{s.mean_time * 1e3:>10.3f} {s.max_time * 1e3:>10.3f} "
+                f"{s.total_size:>12}"
+                + (
+                    f" {s.peak_mem / 2 ** 20:>10.2f} {s.net_mem / 2 ** 20:>10.2f}"
+                    if with_mem
+                    else ""
+                )
+            )
+        return str.join("\n", lines)
+
+    def __getitem__(self, stage: str) -> StageStats:
+        with self._lock:
+            return StageStats(*self._stages[stage])
+
+    def __contains__(self, stage: str):
+        return stage in self._stages
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(sorted(self._stages))
+
+    def __len__(self):
+        return len(self._stages)
+
+
+# Collector of enable()/disable()
+_global_stats = Stats()
+
+
+class _Stage(object):
+    __slots__ = ("name", "size", "_start", "_mem_frame")
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def __enter__(self):
+        self._mem_frame = _mem_enter() if _trace_memory else None
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall_time = time.perf_counter() - self._start
+        peak_mem = net_mem = None
+        if self._mem_frame is not None:
+            peak_mem, net_mem = _mem_exit(self._mem_frame)
+        record(self.name, wall_time, self.size, peak_mem, net_mem)
+
+
+def _mem_enter():
+    stack = _mem_frames.__dict__.setdefault("stack", [])
+    current, peak = tracemalloc.get_traced_memory()
+    if stack:
+        # The peak is reset for this stage, so keep the enclosing stage's
+        stack[-1][1] = max(stack[-1][1], peak)
+    tracemalloc.reset_peak()
+    frame = [current, current]
+    stack.append(frame)
+    return frame
+
+
+def _mem_exit(frame):
+    stack = _mem_frames.stack
+    current, peak = tracemalloc.get_traced_memory()
+    peak = max(frame[1], peak)
+    stack.pop()
+    if stack:
+        stack[-1][1] = max(stack[-1][1], peak)
+    return peak - frame[0], current - frame[0]
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    # Setting the size of a disabled stage is ignored
+    size = property(lambda self: None, lambda self, size: None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str, size: int = None):
+    """
+    A context manager which records the wall time of the code it wraps as a
+    run of a stage. The size can also be set on the returned object, e.g.
+    once it's known::
+
+        with stage("wfdb.rdann") as s:
+            ann = read()
+            s.size = len(ann)
+
+    :param name: Name of the stage.
+    :param size: Size of the stage's input.
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, size)
+
+
+def profiled(name: str, size: Callable = len):
+    """
+    A decorator which records each call of a function as a run of a stage.
+    :param name: Name of the stage.
+    :param size: A function which calculates the stage's size from the first
+    argument of the decorated function, or None.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kw):
+            if not _enabled:
+                return fn(*args, **kw)
+            with _Stage(name, size(args[0]) if size and args else None):
+                return fn(*args, **kw)
+
+        return wrapper
+
+    return decorator
+
+
+def record(
+    name: str,
+    wall_time: float,
+    size: int = None,
+    peak_mem: int = None,
+    net_mem: int = None,
+):
+    """
+    Records a run of a stage in all active collectors and sinks.
+    :param name: Name of the stage.
+    :param wall_time: Wall time of the run, in seconds.
+    :param size: Size of the stage's input, if applicable.
+    :param peak_mem: Peak memory allocated during the run, if measured. Only
+    passed to collectors.
+    :param net_mem: Memory allocated and not freed by the run, if measured.
+    """
+    for stats in _collectors:
+        stats.record(name, wall_time, size, peak_mem, net_mem)
+    for sink in _sinks:
+        try:
+            sink(name, wall_time, size)
+        except Exception:
+            logger.exception(f"Profiling sink {sink!r} failed")
+
+
+def _update(collectors, sinks):
+    global _enabled, _collectors, _sinks
+    # Replaced rather than modified, so record() can iterate without locking
+    _collectors, _sinks = tuple(collectors), tuple(sinks)
+    _enabled = bool(_collectors or _sinks)
+
+
+@contextlib.contextmanager
+def profile(memory: bool = False) -> Iterator[Stats]:
+    """
+    A context manager which collects the statistics of all stages run in the
+    current process while it's active.
+    :param memory: Whether to also measure the memory allocated by each stage
+    with tracemalloc (which is started if needed). This slows down all
+    allocations, and the measurements of stages which run concurrently in
+    several threads include each other's allocations. Requires python 3.9+.
+    :return: A :class:`Stats` object with the collected statistics.
+    """
+    global _trace_memory
+    stats = Stats()
+    start_tracing = False
+    with _lock:
+        if memory:
+            if not hasattr(tracemalloc, "reset_peak"):
+                raise RuntimeError("Memory profiling requires python 3.9 or later")
+            start_tracing = not tracemalloc.is_tracing()
+            if start_tracing:
+                tracemalloc.start()
+            _trace_memory += 1
+        _update(_collectors + (stats,), _sinks)
+    try:
+        yield stats
+    finally:
+        with _lock:
+            _update((c for c in _collectors if c is not stats), _sinks)
+            if memory:
+                _trace_memory -= 1
+                if start_tracing:
+                    tracemalloc.stop()
+
+
+def enable():
+    """
+    Starts collecting statistics into the process-wide collector, see
+    :func:`get_stats`.
+    """
+    with _lock:
+        if _global_stats not in _collectors:
+            _update(_collectors + (_global_stats,), _sinks)
+
+
+def disable():
+    """
+    Stops collecting statistics into the process-wide collector. Its
+    statistics are kept.
+    """
+    with _lock:
+        _update((c for c in _collectors if c is not _global_stats), _sinks)
+
+
+def is_enabled() -> bool:
+    """
+    :return: Whether any collector or sink is active.
+    """
+    return _enabled
+
+
+def get_stats() -> Stats:
+    """
+    :return: The process-wide collector, see :func:`enable`.
+    """
+    return _global_stats
+
+
+def add_sink(sink: Callable):
+    """
+    Adds a sink which is called on every run of a stage, e.g. to forward
+    timings to an external metrics system.
+    :param sink: A function accepting the name of the stage, its wall time in
+    seconds and its size (or None). It's called synchronously, so it should
+    be fast.
+    """
+    with _lock:
+        _update(_collectors, _sinks + (sink,))
+
+
+def remove_sink(sink: Callable):
+    """
+    Removes a sink added with :func:`add_sink`.
+    """
+    with _lock:
+        _update(_collectors, (s for s in _sinks if s is not sink))
+
+
+def profile_pipeline(
+    durations: Sequence[float],
+    methods: Sequence[str] = ("lomb", "welch"),
+    window_minutes: float = 5,
+    memory: bool = True,
+    seed: int = 0,
+) -> Dict[float, Stats]:
+    """
+    Profiles the processing of synthetic RR intervals (see
+    :meth:`pyhrv.generator.generate_rr`) of several durations: filtering,
+    splitting into windows, and time- and frequency-domain metrics (spectra,
+    band powers and beta).
+    :param durations: Durations of the RR intervals, in seconds.
+    :param methods: Spectral methods for :meth:`pyhrv.hrv.hrv_freq`.
+    :param window_minutes: Window duration for splitting and spectral
+    estimation, in minutes.
+    :param memory: Whether to measure memory, see :func:`profile`.
+    :param seed: Random seed of the RR intervals.
+    :return: A dict mapping each duration to the statistics of its stages.
+    """
+    import pyhrv.hrv as hrv
+    import pyhrv.generator as generator
+    import pyhrv.rri.processing as processing
+
+    def run(trr, rri):
+        trr, rri = processing.filtrr(trr, rri)
+        processing.splitrr(rri, 60 * window_minutes)
+        hrv.hrv_time(rri)
+        pxx, f_axis = hrv.hrv_freq(
+            rri, trr, methods=methods, window_minutes=window_minutes
+        )
+        hrv.band_powers(pxx, f_axis)
+        hrv.beta(pxx, f_axis)
+
+    # Exclude one-time costs, e.g. lazy imports and loading the configuration
+    run(*generator.generate_rr(4 * 60 * window_minutes, seed=seed))
+
+    results = {}
+    for duration in durations:
+        trr, rri = generator.generate_rr(duration, seed=seed)
+        with profile(memory=memory) as stats:
+            run(trr, rri)
+        results[duration] = stats
+    return results
+
+
+def format_pipeline_stats(results: Dict[float, Stats]) -> str:
+    """
+    :param results: Output of :func:`profile_pipeline`.
+    :return: A printable table of time and memory per stage and duration.
+    """
+    lines = [
+        f"{'stage':<24}{'duration[h]':>12}{'size':>10}{'time[ms]':>10}"
+        f"{'peak[MB]':>10}{'net[MB]':>10}"
+    ]
+    stages = sorted({stage for stats in results.values() for stage in stats})
+    for stage in stages:
+        for duration, stats in results.items():
+            if stage not in stats:
+                continue
+            s = stats[stage]
+            lines.append(
+                f"{stage:<24}{duration / 3600:>12.2f}{s.total_size:>10}"
+                f"{s.total_time * 1e3:>10.1f}"
+                f"{s.peak_mem / 2 ** 20:>10.2f}{s.net_mem / 2 ** 20:>10.2f}"
+            )
+    return str.join("\n", lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Profile time and memory of each processing stage."
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        type=float,
+        action="append",
+        help="Duration of RR intervals in hours (can be repeated, default: 1 6 24)",
+    )
+    parser.add_argument(
+        "-m",
+        "--method",
+        action="append",
+        choices=["lomb", "welch"],
+        help="Spectral method (can be repeated, default: all)",
+    )
+    parser.add_argument("-w", "--window-minutes", type=float, default=5)
+    parser.add_argument("--no-memory", action="store_true", help="Skip memory")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = profile_pipeline(
+        [3600 * h for h in args.duration or [1, 6, 24]],
+        methods=args.method or ["lomb", "welch"],
+        window_minutes=args.window_minutes,
+        memory=not args.no_memory,
+        seed=args.seed,
+    )
+    print(format_pipeline_stats(results))
+
+
+if __name__ == "__main__":
+    # When run with -m, this module is __main__, but the instrumented code
+    # records into the imported pyhrv.profiling.
+    from pyhrv.profiling import main
+
+    main()
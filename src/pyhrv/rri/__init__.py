@@ -1,2 +1,13 @@
-import pyhrv.rri.frequency
-import pyhrv.rri.processing
+import importlib
+
+_SUBMODULES = ("frequency", "processing")
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted({*globals(), *_SUBMODULES})
@@ -1,8 +1,10 @@
+import os
 import math
 import numpy as np
 import logging
 import scipy.signal as sps
 from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
 
 from pyhrv import utils
 
@@ -15,19 +17,26 @@ def pxx_lomb(
     trr: np.ndarray = None,
     t_win: float = None,
     win_func: Callable = sps.windows.hamming,
+    n_jobs: int = 1,
 ):
     """
-    Lomb-Scargle periodogram of RR intervals.
-    Can optionally split the data into equal-length windows and average
-    the periodogram from each window.
+    Lomb-Scargle periodogram of RR intervals, scaled as a one-sided power
+    spectral density. Can optionally split the data into equal-length windows
+    and average the periodogram from each window.
 
     :param rri: RR intervals.
     :param f_axis: Frequencies, in Hz, to evaluate at.
     :param trr: RR intervals times.
     :param t_win: Duration in seconds of each window. If none, no windowing.
-    :param win_func: Window function to apply to the data (e.g. Hamming).
-    None to disable (use rectangular window).
-    :return: Periodogram.
+    Windows with less than two intervals (e.g. in a gap of the recording) are
+    skipped.
+    :param win_func: Window function to taper the (centered) data of each
+    window with (e.g. Hamming). The spectrum is corrected for the power lost
+    by the taper. None to disable (use rectangular window).
+    :param n_jobs: Number of threads. The windows, and the frequencies of each
+    window, are split between them. The result doesn't depend on the number of
+    threads. None means the number of CPUs.
+    :return: PSD, in units of rri^2/Hz. Zeros if no window has intervals.
     """
     # Standardize input vectors
     rri, trr = utils.standardize_rri_trr(rri, trr)
@@ -38,23 +47,32 @@ def pxx_lomb(
     if not win_func:
         win_func = sps.windows.boxcar
 
+    n_jobs = n_jobs or os.cpu_count() or 1
+
     # Convert frequency to normalized (angular freq)
     w_axis = f_axis * 2 * math.pi
 
     sig_duration = trr[-1]
-    window_starts = (t_win * i for i in range(2 ** 63 - 1))
-
-    pxx = np.zeros_like(f_axis)
-    i = 0
-    for i, win_start in enumerate(window_starts):
-        win_end = win_start + t_win
-        if win_end > sig_duration:
-            break
-
-        win_idx = (trr >= win_start) & (trr < win_end)
-        rri_win = rri[win_idx]
+    num_windows = 0
+    while t_win * (num_windows + 1) <= sig_duration:
+        num_windows += 1
+
+    windows = []
+    min_samples_nyq = math.ceil(2 * f_axis[-1] * t_win)
+    for i in range(num_windows):
+        # Intervals with win_start <= trr < win_start + t_win (trr is sorted)
+        win_start = t_win * i
+        start, end = np.searchsorted(trr, [win_start, win_start + t_win])
+        trr_win, rri_win = trr[start:end], rri[start:end]
+
+        if len(rri_win) < 2:
+            # E.g. a gap in the recording, there's no spectrum to estimate
+            logger.warning(
+                f"Skipping window {i} of lomb periodogram "
+                f"({len(rri_win)} samples)."
+            )
+            continue
 
-        min_samples_nyq = math.ceil(2 * f_axis[-1] * t_win)
         if len(rri_win) < min_samples_nyq:
             logger.warning(
                 f"Nyquist criterion not met for lomb periodogram "
@@ -64,24 +82,101 @@ def pxx_lomb(
 
         # Apply window
         win_coeffs = win_func(len(rri_win))
-        rri_win *= win_coeffs
-
-        # Calculate periodogram
-        pxx_win = sps.lombscargle(
-            trr,
-            rri,
-            w_axis,
-            precenter=True,
+        rri_win = (rri_win - np.mean(rri_win)) * win_coeffs
+        windows.append((trr_win, rri_win, np.mean(win_coeffs ** 2)))
+
+    # Each window's frequencies are split into chunks, so that a single window
+    # can also use all threads.
+    n_chunks = max(1, min(len(w_axis), math.ceil(n_jobs / max(len(windows), 1))))
+    w_chunks = np.array_split(w_axis, n_chunks)
+
+    def _pxx_chunk(task):
+        (trr_win, rri_win, _), w_chunk = task
+        return sps.lombscargle(
+            trr_win,
+            rri_win,
+            w_chunk,
+            precenter=False,
             normalize=False,
         )
-        # Window gain correction
-        pxx_win *= 1 / np.mean(win_coeffs)
+
+    tasks = [(win, w_chunk) for win in windows for w_chunk in w_chunks]
+    pxx_chunks = _thread_map(_pxx_chunk, tasks, n_jobs)
+
+    # Sum the windows in order, so the result is deterministic. Average over
+    # the windows which have a spectrum.
+    pxx = np.zeros_like(f_axis)
+    for i, (trr_win, _, win_power) in enumerate(windows):
+        pxx_win = np.concatenate(pxx_chunks[i * n_chunks : (i + 1) * n_chunks])
+        # The periodogram of a sinusoid with amplitude A peaks at A^2 * N / 4,
+        # with a width of 1 / t_win. Scale it so that it integrates to the
+        # sinusoid's power, A^2 / 2, and correct for the window's power gain.
+        pxx_win *= 2 * t_win / (len(trr_win) * win_power)
         pxx += pxx_win
 
-    pxx /= i
+    if windows:
+        pxx /= len(windows)
     return pxx
 
 
+def pxx_welch(
+    x: np.ndarray,
+    fs: float,
+    window: np.ndarray,
+    noverlap: int = None,
+    workers: int = 1,
+):
+    """
+    Welch's estimate of the power spectral density of a uniformly sampled
+    signal. Equivalent to ``scipy.signal.welch`` with constant detrending,
+    density scaling and a one-sided spectrum, but the FFTs of all segments
+    are computed at once, with multiple threads.
+
+    :param x: The signal.
+    :param fs: Sampling frequency, in Hz.
+    :param window: Window coefficients. Their number is the segment length.
+    :param noverlap: Number of samples by which segments overlap. None means
+    half a segment.
+    :param workers: Number of threads for the FFTs. None means the number of
+    CPUs.
+    :return: Tuple of frequencies and PSD.
+    """
+    import scipy.fft
+
+    x = np.asarray(x, dtype=np.float64)
+    window = np.asarray(window, dtype=np.float64)
+    nperseg = len(window)
+    if noverlap is None:
+        noverlap = nperseg // 2
+    step = nperseg - noverlap
+    n_segments = (len(x) - noverlap) // step
+    if len(x) < nperseg or n_segments < 1:
+        raise ValueError("The signal is shorter than one segment")
+
+    seg_idx = step * np.arange(n_segments)[:, None] + np.arange(nperseg)
+    segments = x[seg_idx]
+    segments -= np.mean(segments, axis=-1, keepdims=True)
+    segments *= window
+
+    spec = scipy.fft.rfft(segments, axis=-1, workers=workers or os.cpu_count())
+    pxx = spec.real ** 2 + spec.imag ** 2
+    pxx *= 1 / (fs * np.sum(window ** 2))
+    # All frequencies except DC and Nyquist also represent negative frequencies
+    if nperseg % 2:
+        pxx[:, 1:] *= 2
+    else:
+        pxx[:, 1:-1] *= 2
+
+    return scipy.fft.rfftfreq(nperseg, 1 / fs), np.mean(pxx, axis=0)
+
+
+def _thread_map(fn, items, n_jobs):
+    if n_jobs == 1 or len(items) < 2:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(n_jobs, len(items))) as pool:
+        return list(pool.map(fn, items))
+
+
 def build_uniform_freq_axis(
     t_win: float,
     f_min: float,
@@ -4,12 +4,15 @@ produce a processed RR-interval time series.
 """
 import math
 import numpy as np
-import scipy.signal as sps
 
 import pyhrv.utils
-from pyhrv.conf import get_val as v
+from pyhrv import profiling
+from pyhrv.conf import param as v
+from pyhrv.conf import resolve_params
 
 
+@profiling.profiled("filtrr")
+@resolve_params
 def filtrr(
     t,
     rr,
@@ -31,7 +34,7 @@ def filtrr(
     :meth:`filtrr_quotient`.
     :return: tuple of time axis and RR intervals after filtering.
     """
-    idx = np.ones_like(rr).astype(np.bool)
+    idx = np.ones_like(rr).astype(bool)
 
     if enable_range:
         range_idx = _filtrr_range(rr, **kw)
@@ -45,6 +48,7 @@ def filtrr(
     return t_f, rr_f
 
 
+@resolve_params
 def _filtrr_range(
     rr, rr_min=v("filtrr.range.rr_min"), rr_max=v("filtrr.range.rr_max"), **kw
 ):
@@ -53,18 +57,21 @@ def _filtrr_range(
     if rr_min is None:
         rr_min = 0.0
     if rr_max is None:
-        rr_max = np.float("inf")
+        rr_max = float("inf")
 
     idx = (rr >= rr_min) & (rr <= rr_max)
     return idx
 
 
+@resolve_params
 def _filtrr_ma(
     rr,
     win_len=v("filtrr.moving_average.win_samples"),
     win_thresh=v("filtrr.moving_average.thresh_percent"),
     **kw,
 ):
+    import scipy.signal as sps
+
     b_fir = np.r_[np.ones(win_len), 0.0, np.ones(win_len)].astype(np.float32)
     b_fir *= 1 / (2 * win_len)
 
@@ -76,6 +83,8 @@ def _filtrr_ma(
     return idx, rr_ma
 
 
+@profiling.profiled("splitrr")
+@resolve_params
 def splitrr(
     rri,
     win_sec,
@@ -0,0 +1,336 @@
+"""
+A long-running service which calculates HRV metrics in a pool of warm worker
+processes, so that each request doesn't pay for process startup, imports and
+loading the configuration.
+
+Requests and responses are JSON lines, over a Unix domain socket or a
+localhost TCP connection. Each request is an object with either a record:
+
+    {"id": 1, "rec_path": "db/mitdb/100", "ann_ext": "atr"}
+
+or RR intervals, in seconds (and optionally their times):
+
+    {"id": 2, "rr": [0.81, 0.79, ...], "trr": [0.0, 0.81, ...]}
+
+and optionally ``filter``, ``window_minutes`` and ``methods`` (see
+:meth:`pyhrv.main.hrv_rr_rows`). Record requests can also have ``channel``,
+``from_time``, ``to_time`` and ``detector`` (see :meth:`pyhrv.wfdb.rri.ecgrr`).
+
+Each response has the request's ``id``, ``ok``, either ``result`` (a list of
+rows, as in the output of the ``pyhrv`` command) or ``error``, and ``timing``
+in seconds: ``queue`` (waiting for a free slot), ``worker`` (processing in the
+worker) and ``total``. Requests on one connection are processed concurrently,
+so responses may arrive out of order.
+
+Start the service with ``pyhrv serve --socket PATH`` or ``pyhrv serve --port
+PORT``, and send requests e.g. with :func:`request`.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import asyncio
+import argparse
+import traceback
+import numpy as np
+from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pyhrv.conf
+import pyhrv.main
+
+# Maximal length of a request line, e.g. for days of RR intervals
+MAX_REQUEST_BYTES = 2 ** 27
+
+_RR_FIELDS = {"rr", "trr"}
+_RECORD_FIELDS = {"rec_path", "ann_ext", "channel", "from_time", "to_time", "detector"}
+_COMMON_FIELDS = {"id", "filter", "window_minutes", "methods"}
+
+
+class HRVServer(object):
+    """
+    Serves HRV requests with a pool of worker processes.
+    """
+
+    def __init__(self, n_jobs: int = None, max_concurrent: int = None, config=None):
+        """
+        :param n_jobs: Number of worker processes. None means the number of CPUs.
+        :param max_concurrent: Maximal number of requests processed at a time;
+        further requests wait. None means twice the number of workers.
+        :param config: Path of a YAML configuration file, loaded by each worker.
+        """
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.max_concurrent = max_concurrent or 2 * self.n_jobs
+        self.config = None if config is None else str(config)
+        self._pool = None
+        self._server = None
+        self._semaphore = None
+        self._socket_path = None
+
+    async def start(self, path: str = None, host: str = "127.0.0.1", port: int = 0):
+        """
+        Starts the workers, waits until they're warm, and starts listening.
+        :param path: Path of a Unix domain socket to listen on. If None, listen
+        on TCP instead.
+        :param host: Host to listen on for TCP.
+        :param port: TCP port. 0 means any free port, see :attr:`address`.
+        """
+        if self.config is not None:
+            pyhrv.conf.read_file(self.config)  # Fail early if it's invalid
+
+        self._pool = self._new_pool()
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        loop = asyncio.get_running_loop()
+        # Each worker is started by a task, and warms up before running it
+        await asyncio.gather(
+            *(loop.run_in_executor(self._pool, os.getpid) for _ in range(self.n_jobs))
+        )
+
+        if path is not None:
+            self._socket_path = str(path)
+            self._server = await asyncio.start_unix_server(
+                self._handle_connection, self._socket_path, limit=MAX_REQUEST_BYTES
+            )
+        else:
+            self._server = await asyncio.start_server(
+                self._handle_connection, host, port, limit=MAX_REQUEST_BYTES
+            )
+
+    @property
+    def address(self):
+        """
+        :return: The socket path, or a (host, port) tuple.
+        """
+        if self._socket_path is not None:
+            return self._socket_path
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        """
+        Stops listening, and shuts down the workers.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._socket_path is not None and os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    async def handle(self, request: dict) -> dict:
+        """
+        Processes a request.
+        :param request: A request, see the module documentation.
+        :return: The response.
+        """
+        start = time.perf_counter()
+        response = dict(id=request.get("id"))
+        async with self._semaphore:
+            started = time.perf_counter()
+            pool = self._pool
+            loop = asyncio.get_running_loop()
+            try:
+                rows, worker_time = await loop.run_in_executor(
+                    pool, _process_request, request
+                )
+                response.update(ok=True, result=rows)
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool) and pool is self._pool:
+                    # A worker died, e.g. crashed in native code
+                    pool.shutdown(wait=False)
+                    self._pool = self._new_pool()
+                worker_time = None
+                error = traceback.format_exception_only(type(e), e)
+                response.update(ok=False, error=str.join("", error).strip())
+
+        end = time.perf_counter()
+        response["timing"] = dict(
+            queue=started - start, worker=worker_time, total=end - start
+        )
+        return response
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.n_jobs, initializer=_init_worker, initargs=(self.config,)
+        )
+
+    async def _handle_connection(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def _respond(line):
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("Request must be a JSON object")
+            except ValueError as e:
+                response = dict(id=None, ok=False, error=f"Invalid request: {e}")
+            else:
+                response = await self.handle(request)
+            async with lock:
+                writer.write(pyhrv.main._to_json(response).encode() + b"\n")
+                await writer.drain()
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The line is too long, so the rest of the stream is lost
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(_respond(line))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def _init_worker(config=None):
+    if config is not None:
+        pyhrv.conf.load(config)
+
+    # Run the processing once, so that requests don't pay for lazy imports,
+    # loading the configuration and other one-time costs.
+    import pyhrv.generator as generator
+
+    trr, rr = generator.generate_rr(600, seed=0)
+    _process_request(dict(rr=rr.tolist(), trr=trr.tolist(), window_minutes=5))
+
+
+def _process_request(request: dict) -> Tuple[List[dict], float]:
+    start = time.perf_counter()
+    request = dict(request)
+    unknown = set(request) - _RR_FIELDS - _RECORD_FIELDS - _COMMON_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown request fields: {sorted(unknown)}")
+    if ("rr" in request) == ("rec_path" in request):
+        raise ValueError("Request must have either rec_path or rr")
+
+    kw = dict(
+        filter_rri=request.pop("filter", True),
+        window_minutes=request.pop("window_minutes", None),
+        methods=request.pop("methods", None),
+    )
+    request.pop("id", None)
+    if "rr" in request:
+        if set(request) - _RR_FIELDS:
+            raise ValueError("Record fields can't be used with rr")
+        rr = np.asarray(request["rr"], dtype=np.float64)
+        trr = request.get("trr")
+        trr = None if trr is None else np.asarray(trr, dtype=np.float64)
+        rows = pyhrv.main.hrv_rr_rows(trr, rr, **kw)
+    else:
+        rows = pyhrv.main.hrv_record_rows(request.pop("rec_path"), **kw, **request)
+    return rows, time.perf_counter() - start
+
+
+def request(
+    req: dict,
+    path: str = None,
+    host: str = "127.0.0.1",
+    port: int = None,
+    timeout: float = None,
+) -> dict:
+    """
+    Sends a single request to a running server, and waits for its response.
+    :param req: The request, see the module documentation.
+    :param path: Path of the server's Unix domain socket.
+    :param host: The server's host, if it listens on TCP.
+    :param port: The server's TCP port, if it listens on TCP.
+    :param timeout: Timeout in seconds for connecting and for the response.
+    :return: The response, with NaN metrics as None.
+    """
+    if path is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        address = str(path)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        address = (host, port)
+
+    with sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        with sock.makefile("rwb") as f:
+            f.write(pyhrv.main._to_json(req).encode() + b"\n")
+            f.flush()
+            line = f.readline()
+    if not line:
+        raise ConnectionError("The server closed the connection")
+    return json.loads(line)
+
+
+def main(argv=None) -> int:
+    """
+    Runs the ``pyhrv serve`` command.
+    :param argv: Command-line arguments, after ``serve``.
+    :return: Exit code.
+    """
+    parser = argparse.ArgumentParser(
+        prog="pyhrv serve",
+        description="Serve HRV requests from a pool of warm worker processes.",
+    )
+    parser.add_argument("-s", "--socket", help="Path of a Unix domain socket")
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="Host for TCP (default: 127.0.0.1)"
+    )
+    parser.add_argument("-p", "--port", type=int, help="TCP port")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--max-concurrent",
+        type=int,
+        default=None,
+        help="Maximal number of requests processed at a time "
+        "(default: twice the number of workers)",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="YAML configuration file, in the format of config_default.yaml",
+    )
+    args = parser.parse_args(argv)
+    if (args.socket is None) == (args.port is None):
+        parser.error("Exactly one of --socket or --port is required")
+
+    async def _serve():
+        server = HRVServer(args.jobs, args.max_concurrent, args.config)
+        await server.start(args.socket, args.host, args.port)
+        print(f"Listening on {server.address}", file=sys.stderr, flush=True)
+
+        loop = asyncio.get_running_loop()
+        serving = asyncio.ensure_future(server.serve_forever())
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, serving.cancel)
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await server.close()
+
+    asyncio.run(_serve())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
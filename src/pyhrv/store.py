@@ -0,0 +1,289 @@
+"""
+This module contains an on-disk store of per-record results, which allows
+batch jobs to be resumed without recomputing what was already computed.
+
+Results are content-addressed: the key of each result is a hash of the
+record's files, the parameters of the stage that produced it (and of all
+stages it depends on), and the pyhrv version. Changing a parameter therefore
+only invalidates the stages that depend on it.
+"""
+import os
+import json
+import hashlib
+import inspect
+import tempfile
+import threading
+import numpy as np
+from typing import Dict, Optional
+
+import pyhrv
+import pyhrv.conf
+import pyhrv.wfdb.rri as rri
+import pyhrv.wfdb.utils as wfdb_utils
+import pyhrv.rri.processing as processing
+
+INDEX_FILENAME = "index.jsonl"
+SHARDS_DIRNAME = "shards"
+
+# Stages of the per-record pipeline, in order of dependency
+STAGE_RR = "rr"
+STAGE_FILTRR = "filtrr"
+STAGE_HRV = "hrv"
+
+
+class ResultsStore(object):
+    """
+    A directory containing one ``.npz`` shard per result and an append-only
+    index (JSON lines) describing each shard.
+    """
+
+    def __init__(self, root: str):
+        """
+        :param root: Directory of the store. Created if it doesn't exist.
+        """
+        self.root = str(root)
+        self.shards_dir = os.path.join(self.root, SHARDS_DIRNAME)
+        self.index_path = os.path.join(self.root, INDEX_FILENAME)
+        os.makedirs(self.shards_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: str):
+        return os.path.isfile(self._shard_path(key))
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """
+        :param key: Key of a result.
+        :return: A dict of the arrays stored under the key, or None if there's
+        no such result.
+        """
+        try:
+            with np.load(self._shard_path(key)) as npz:
+                return {name: npz[name] for name in npz.files}
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, stage: str, rec_path: str, params: dict, **arrays):
+        """
+        Stores a result.
+        :param key: Key of the result.
+        :param stage: Name of the stage which produced the result.
+        :param rec_path: Path of the record the result belongs to.
+        :param params: The parameters which the key was calculated from.
+        :param arrays: Named arrays to store.
+        """
+        shard_path = self._shard_path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.shards_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, shard_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        entry = dict(key=key, stage=stage, rec_path=str(rec_path), params=params)
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock, open(self.index_path, "a") as f:
+            # A single write of a short line in append mode, so concurrent
+            # writers don't interleave.
+            f.write(line)
+
+    def index(self) -> Dict[str, dict]:
+        """
+        :return: A dict mapping each key to its index entry. Entries whose
+        shard is missing are skipped.
+        """
+        entries = {}
+        try:
+            with open(self.index_path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Partially written line, e.g. if a job was killed
+                        continue
+                    if entry["key"] in self:
+                        entries[entry["key"]] = entry
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _shard_path(self, key: str):
+        return os.path.join(self.shards_dir, f"{key}.npz")
+
+
+def record_digest(rec_path: str, ann_ext: str = None) -> str:
+    """
+    Calculates a hash of the contents of a record's files.
+    :param rec_path: Path of the record (without extension).
+    :param ann_ext: Extension of an annotation file to include.
+    :return: The hash, as a hex string.
+    """
+    rec_path = str(rec_path)
+    rec_dir = os.path.dirname(rec_path)
+    header = wfdb_utils.rdheader(rec_path)
+
+    paths = [f"{rec_path}.hea"]
+    if ann_ext is not None:
+        paths.append(f"{rec_path}.{ann_ext}")
+    else:
+        for file_name in sorted(set(getattr(header, "file_name", None) or [])):
+            paths.append(os.path.join(rec_dir, file_name))
+
+    sha1 = hashlib.sha1()
+    for path in paths:
+        sha1.update(os.path.basename(path).encode())
+        sha1.update(wfdb_utils._file_sha1(path).encode())
+    return sha1.hexdigest()
+
+
+def result_key(stage: str, parent_key: str, params: dict) -> str:
+    """
+    Calculates the key of a stage's result.
+    :param stage: Name of the stage.
+    :param parent_key: Key of the stage's input (the record digest for the
+    first stage).
+    :param params: Parameters of the stage.
+    :return: The key, as a hex string.
+    """
+    blob = json.dumps(
+        dict(
+            stage=stage,
+            parent=parent_key,
+            params=params,
+            version=pyhrv.__version__,
+        ),
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+def ecgrr_params(
+    ann_ext=None, channel=None, from_time=None, to_time=None, detector=None, dtype=None
+) -> dict:
+    """
+    :return: The parameters which affect the output of
+    :meth:`pyhrv.wfdb.rri.ecgrr`, given its arguments.
+    """
+    defaults = inspect.signature(rri.ecgrr).parameters
+    if dtype is None:
+        dtype = defaults["dtype"].default
+    params = dict(
+        ann_ext=ann_ext,
+        channel=channel,
+        from_time=from_time,
+        to_time=to_time,
+        dtype=np.dtype(dtype).name,
+    )
+    if ann_ext is None:
+        if detector is None:
+            detector = defaults["detector"].default
+        if callable(detector):
+            detector = f"{detector.__module__}.{detector.__qualname__}"
+        params["detector"] = detector
+        params.update(pyhrv.conf.get_vals("rqrs"))
+    return params
+
+
+def filtrr_params() -> dict:
+    """
+    :return: The configuration parameters which affect the output of
+    :meth:`pyhrv.rri.processing.filtrr`: those of the range and moving average
+    filters, and of each only whether it's enabled if it isn't. The quotient
+    filter's parameters aren't used.
+    """
+    params = {}
+    for name in ("range", "moving_average"):
+        vals = pyhrv.conf.get_vals(f"filtrr.{name}")
+        enable = f"filtrr.{name}.enable"
+        params.update(vals if vals[enable] else {enable: vals[enable]})
+    return params
+
+
+def hrv_params() -> dict:
+    """
+    :return: The configuration parameters of :meth:`pyhrv.hrv.hrv_time` and
+    :meth:`pyhrv.hrv.hrv_freq`, except ones which don't affect the results.
+    """
+    params = {**pyhrv.conf.get_vals("hrv_time"), **pyhrv.conf.get_vals("hrv_freq")}
+    params.pop("hrv_freq.n_jobs", None)
+    return params
+
+
+def hrv_record(
+    rec_path: str, store: ResultsStore, filter_rri: bool = True, **ecgrr_kw
+) -> dict:
+    """
+    Calculates the HRV metrics of a record, reusing any stage results which
+    are already in the store and storing the ones which aren't.
+    :param rec_path: Path of the record (without extension).
+    :param store: A results store, or the path of one.
+    :param filter_rri: Whether to filter the RR intervals with
+    :meth:`pyhrv.rri.processing.filtrr`.
+    :param ecgrr_kw: Arguments for :meth:`pyhrv.wfdb.rri.ecgrr`.
+    :return: A dict of the time- and frequency-domain metrics of the entire
+    record, as returned by :meth:`pyhrv.main.hrv_rr_rows`.
+    """
+    import pyhrv.main as main  # main imports this module via pyhrv.batch
+
+    if not isinstance(store, ResultsStore):
+        store = ResultsStore(store)
+    rec_path = str(rec_path)
+
+    keys = []
+    parent_key = record_digest(rec_path, ecgrr_kw.get("ann_ext"))
+    stages = [(STAGE_RR, ecgrr_params(**ecgrr_kw))]
+    if filter_rri:
+        stages.append((STAGE_FILTRR, filtrr_params()))
+    stages.append((STAGE_HRV, hrv_params()))
+    for stage, params in stages:
+        parent_key = result_key(stage, parent_key, params)
+        keys.append(parent_key)
+
+    hrv_key = keys[-1]
+    result = store.get(hrv_key)
+    if result is not None:
+        return {name: val.item() for name, val in result.items()}
+
+    # Find the last stage which is already stored, and continue from it
+    trr = rr = None
+    first = 0
+    for i in reversed(range(len(stages) - 1)):
+        result = store.get(keys[i])
+        if result is not None:
+            trr, rr = result["trr"], result["rr"]
+            first = i + 1
+            break
+
+    for i in range(first, len(stages)):
+        stage, params = stages[i]
+        if stage == STAGE_RR:
+            trr, rr = rri.ecgrr(rec_path, **ecgrr_kw)
+            store.put(keys[i], stage, rec_path, params, trr=trr, rr=rr)
+        elif stage == STAGE_FILTRR:
+            trr, rr = _filtrr(trr, rr, params)
+            store.put(keys[i], stage, rec_path, params, trr=trr, rr=rr)
+        else:
+            # Calculate with exactly the parameters the key was calculated from
+            with pyhrv.conf.override(**params):
+                (metrics,) = main.hrv_rr_rows(trr, rr, filter_rri=False)
+            store.put(keys[i], stage, rec_path, params, **metrics)
+
+    return metrics
+
+
+def _filtrr(trr, rr, params):
+    # Pass the parameters explicitly, so that the intervals are filtered with
+    # exactly the parameters the key was calculated from. Those of a disabled
+    # filter are missing, and not used.
+    return processing.filtrr(
+        trr,
+        rr,
+        enable_range=params["filtrr.range.enable"],
+        enable_moving_average=params["filtrr.moving_average.enable"],
+        rr_min=params.get("filtrr.range.rr_min"),
+        rr_max=params.get("filtrr.range.rr_max"),
+        win_len=params.get("filtrr.moving_average.win_samples"),
+        win_thresh=params.get("filtrr.moving_average.thresh_percent"),
+    )
@@ -1,5 +1,15 @@
-import pyhrv.wfdb.qrs
-import pyhrv.wfdb.rri
-import pyhrv.wfdb.utils
+import importlib
 
 from .consts import *
+
+_SUBMODULES = ("benchmark", "catalog", "qrs", "rri", "utils")
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted({*globals(), *_SUBMODULES})
@@ -0,0 +1,265 @@
+"""
+This module contains a harness for comparing the accuracy and throughput of
+QRS detectors on a database of PhysioNet records.
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+from typing import List, NamedTuple
+
+import pyhrv.wfdb.qrs as qrs
+import pyhrv.wfdb.utils as utils
+from pyhrv.wfdb.consts import WFDB_ANN_ALL_PEAK_TYPES
+
+
+class DetectorResult(NamedTuple):
+    detector: str
+    rec_path: str
+    n_samples: int
+    n_beats: int
+    wall_time: float
+    peak_mem: int
+    tp: int
+    fn: int
+    fp: int
+    error: str = None
+
+    @property
+    def beats_per_sec(self):
+        return self.n_beats / self.wall_time if self.wall_time else float("nan")
+
+    @property
+    def sensitivity(self):
+        return utils.DetectionStats(self.tp, self.fn, self.fp).sensitivity
+
+    @property
+    def ppv(self):
+        return utils.DetectionStats(self.tp, self.fn, self.fp).ppv
+
+
+def find_records(db_dir: str, ann_ext: str = None) -> List[str]:
+    """
+    Finds all records in a directory (non-recursively).
+    :param db_dir: Path of the directory.
+    :param ann_ext: If provided, only records which have an annotation file
+    with this extension will be returned.
+    :return: A sorted list of record paths (without extension).
+    """
+    rec_paths = []
+    with os.scandir(db_dir) as it:
+        for entry in it:
+            if not entry.name.endswith(".hea"):
+                continue
+            rec_path = os.path.join(db_dir, entry.name[: -len(".hea")])
+            if ann_ext and not os.path.isfile(f"{rec_path}.{ann_ext}"):
+                continue
+            if utils.is_record(rec_path, ann_ext=ann_ext):
+                rec_paths.append(rec_path)
+    return sorted(rec_paths)
+
+
+def benchmark_detectors(
+    db_dir: str,
+    detectors=None,
+    ref_ann_ext: str = "atr",
+    ref_types: str = WFDB_ANN_ALL_PEAK_TYPES,
+    tol_sec: float = 0.15,
+    from_time: str = None,
+    to_time: str = None,
+    measure_memory: bool = True,
+) -> List[DetectorResult]:
+    """
+    Runs QRS detectors on all the records in a directory and compares their
+    detections to reference annotations.
+
+    :param db_dir: Path of a directory containing PhysioNet records.
+    :param detectors: A list of detector names (see
+    :meth:`pyhrv.wfdb.qrs.list_detectors`). None means all registered detectors.
+    :param ref_ann_ext: Extension of the reference annotation files. Only
+    records with such a file are used.
+    :param ref_types: Annotation types to use as reference beats.
+    :param tol_sec: Maximal distance in seconds between a detection and a
+    reference beat for them to be considered a match.
+    :param from_time: Start time. A string in PhysioNet time format.
+    :param to_time: End time. A string in PhysioNet time format.
+    :param measure_memory: Whether to measure peak memory. If True, each
+    detector runs twice on each record: once for timing and once with
+    tracemalloc enabled. Note that only allocations made by the python
+    process are measured, not those of external tools (e.g. ecgpuwave).
+    :return: A list with one result per detector and record.
+    """
+    if detectors is None:
+        detectors = qrs.list_detectors()
+
+    results = []
+    for rec_path in find_records(db_dir, ann_ext=ref_ann_ext):
+        header = utils.rdheader(rec_path)
+        ref = utils.rdann_by_type(rec_path, ref_ann_ext, from_time, to_time, ref_types)
+        ref = np.sort(np.concatenate(list(ref.values())))
+
+        sampfrom, sampto = 0, header.sig_len
+        if from_time:
+            sampfrom = utils.wfdb_time_to_samples(from_time, header.fs)
+        if to_time:
+            sampto = utils.wfdb_time_to_samples(to_time, header.fs)
+            if sampto < 0 or sampto > header.sig_len:
+                sampto = header.sig_len
+
+        for name in detectors:
+            detector = qrs.get_detector(name)
+            try:
+                start = time.perf_counter()
+                detections = detector(rec_path, from_time=from_time, to_time=to_time)
+                wall_time = time.perf_counter() - start
+
+                peak_mem = -1
+                if measure_memory:
+                    tracemalloc.start()
+                    try:
+                        detector(rec_path, from_time=from_time, to_time=to_time)
+                        _, peak_mem = tracemalloc.get_traced_memory()
+                    finally:
+                        tracemalloc.stop()
+
+                stats = utils.match_detections(
+                    ref, detections, tol=round(tol_sec * header.fs)
+                )
+                results.append(
+                    DetectorResult(
+                        name,
+                        rec_path,
+                        sampto - sampfrom,
+                        len(detections),
+                        wall_time,
+                        peak_mem,
+                        *stats,
+                    )
+                )
+            except Exception as e:
+                results.append(
+                    DetectorResult(
+                        name,
+                        rec_path,
+                        sampto - sampfrom,
+                        0,
+                        0.0,
+                        -1,
+                        0,
+                        len(ref),
+                        0,
+                        error=f"{type(e).__name__}: {e}",
+                    )
+                )
+
+    return results
+
+
+def summarize(results: List[DetectorResult]) -> dict:
+    """
+    Aggregates benchmark results per detector.
+    :param results: Results from :meth:`benchmark_detectors`.
+    :return: A dict mapping detector names to a dict of aggregate metrics:
+    number of records and errors, total wall time, beats/second, maximal
+    peak memory and the gross sensitivity and PPV.
+    """
+    summary = {}
+    for name in dict.fromkeys(r.detector for r in results):
+        det_results = [r for r in results if r.detector == name]
+        ok_results = [r for r in det_results if r.error is None]
+        tp, fn, fp = (
+            sum(getattr(r, f) for r in det_results) for f in "tp fn fp".split()
+        )
+        wall_time = sum(r.wall_time for r in ok_results)
+        stats = utils.DetectionStats(tp, fn, fp)
+        summary[name] = dict(
+            n_records=len(det_results),
+            n_errors=len(det_results) - len(ok_results),
+            wall_time=wall_time,
+            beats_per_sec=sum(r.n_beats for r in ok_results) / wall_time
+            if wall_time
+            else float("nan"),
+            peak_mem=max((r.peak_mem for r in ok_results), default=-1),
+            sensitivity=stats.sensitivity,
+            ppv=stats.ppv,
+        )
+    return summary
+
+
+def fastest_detector(summary: dict, min_sensitivity=0.99, min_ppv=0.99):
+    """
+    Selects the fastest detector which meets an accuracy floor.
+    :param summary: Output of :meth:`summarize`.
+    :param min_sensitivity: Minimal gross sensitivity.
+    :param min_ppv: Minimal gross positive predictive value.
+    :return: Name of the detector with the highest beats/second out of those
+    with no errors and sufficient accuracy, or None if there's no such detector.
+    """
+    candidates = [
+        (s["beats_per_sec"], name)
+        for name, s in summary.items()
+        if s["n_errors"] == 0
+        and s["sensitivity"] >= min_sensitivity
+        and s["ppv"] >= min_ppv
+    ]
+    return max(candidates)[1] if candidates else None
+
+
+def format_summary(summary: dict) -> str:
+    """
+    :param summary: Output of :meth:`summarize`.
+    :return: The summary as a printable table.
+    """
+    lines = [
+        f"{'detector':<12}{'records':>8}{'errors':>8}{'time[s]':>10}"
+        f"{'beats/s':>12}{'mem[MB]':>10}{'Se[%]':>8}{'PPV[%]':>8}"
+    ]
+    for name, s in summary.items():
+        lines.append(
+            f"{name:<12}{s['n_records']:>8}{s['n_errors']:>8}"
+            f"{s['wall_time']:>10.2f}{s['beats_per_sec']:>12.0f}"
+            f"{s['peak_mem'] / 2 ** 20:>10.1f}"
+            f"{100 * s['sensitivity']:>8.2f}{100 * s['ppv']:>8.2f}"
+        )
+    return str.join("\n", lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark QRS detectors against reference annotations."
+    )
+    parser.add_argument("db_dir", help="Directory containing PhysioNet records")
+    parser.add_argument(
+        "-d",
+        "--detector",
+        action="append",
+        choices=qrs.list_detectors(),
+        help="Detector to benchmark (can be repeated, default: all)",
+    )
+    parser.add_argument("-a", "--ann-ext", default="atr", help="Reference annotation")
+    parser.add_argument("-f", "--from-time", default=None, help="Start time")
+    parser.add_argument("-t", "--to-time", default=None, help="End time")
+    parser.add_argument("--tol", type=float, default=0.15, help="Tolerance [sec]")
+    parser.add_argument("--no-memory", action="store_true", help="Skip memory")
+    args = parser.parse_args(argv)
+
+    results = benchmark_detectors(
+        args.db_dir,
+        detectors=args.detector,
+        ref_ann_ext=args.ann_ext,
+        tol_sec=args.tol,
+        from_time=args.from_time,
+        to_time=args.to_time,
+        measure_memory=not args.no_memory,
+    )
+    for r in results:
+        if r.error:
+            print(f"{r.detector} failed on {r.rec_path}: {r.error}", file=sys.stderr)
+
+    print(format_summary(summarize(results)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+This module contains a catalog (index) of the records in a database of
+PhysioNet records, which can be persisted and queried.
+"""
+import os
+import json
+import wfdb
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+import pyhrv.wfdb.utils as utils
+
+CATALOG_VERSION = 1
+INDEX_FILENAME = ".pyhrv_catalog.json"
+
+
+class RecordInfo(NamedTuple):
+    # Path of the record relative to the database directory, without extension
+    name: str
+    fs: float
+    sig_len: int
+    sig_name: Tuple[str, ...]
+    ecg_channel: Optional[int]
+    ann_exts: Tuple[str, ...]
+    dat_files: Tuple[str, ...]
+    hea_mtime_ns: int
+    hea_size: int
+
+    @property
+    def duration(self):
+        """
+        :return: Duration of the record, in seconds.
+        """
+        return self.sig_len / self.fs if self.fs else 0.0
+
+
+class RecordCatalog(object):
+    """
+    An index of all the records in a database directory tree.
+
+    The catalog is built by scanning the directory tree once and parsing all
+    headers, and can then be saved to disk, loaded, and refreshed
+    incrementally (only headers which were modified are parsed again).
+    """
+
+    def __init__(self, db_dir: str, records: Dict[str, RecordInfo] = None):
+        """
+        :param db_dir: Root directory of the database.
+        :param records: Mapping from record name to its info.
+        """
+        self.db_dir = str(db_dir)
+        self.records = dict(records) if records else {}
+
+    @classmethod
+    def build(cls, db_dir: str, n_jobs: int = None) -> "RecordCatalog":
+        """
+        Builds a catalog of all records in a directory tree.
+        :param db_dir: Root directory of the database.
+        :param n_jobs: Number of processes to use for parsing headers. None
+        means the number of CPUs, 1 means no separate processes.
+        :return: The catalog.
+        """
+        catalog = cls(db_dir)
+        catalog.refresh(n_jobs=n_jobs)
+        return catalog
+
+    @classmethod
+    def open(
+        cls, db_dir: str, index_path: str = None, n_jobs: int = None
+    ) -> "RecordCatalog":
+        """
+        Loads the saved catalog of a database directory if it exists, refreshes
+        it and saves it back if anything changed.
+        :param db_dir: Root directory of the database.
+        :param index_path: Path of the index file. Defaults to a file named
+        :attr:`INDEX_FILENAME` in the database directory.
+        :param n_jobs: Number of processes to use for parsing headers.
+        :return: The catalog.
+        """
+        if index_path is None:
+            index_path = os.path.join(db_dir, INDEX_FILENAME)
+
+        try:
+            catalog = cls.load(index_path, db_dir=db_dir)
+        except (OSError, ValueError, KeyError, TypeError):
+            catalog = cls(db_dir)
+
+        old_records = catalog.records
+        catalog.refresh(n_jobs=n_jobs)
+        if catalog.records != old_records:
+            catalog.save(index_path)
+        return catalog
+
+    @classmethod
+    def load(cls, index_path: str, db_dir: str = None) -> "RecordCatalog":
+        """
+        Loads a catalog saved with :meth:`save`.
+        :param index_path: Path of the index file.
+        :param db_dir: Root directory of the database. If None, the directory
+        stored in the index file is used.
+        :return: The catalog.
+        """
+        with open(index_path, "r") as f:
+            index = json.load(f)
+
+        if index.get("version") != CATALOG_VERSION:
+            raise ValueError(f"Unsupported catalog version in {index_path}")
+
+        records = {}
+        for rec in index["records"]:
+            for field in ("sig_name", "ann_exts", "dat_files"):
+                rec[field] = tuple(rec[field])
+            records[rec["name"]] = RecordInfo(**rec)
+
+        return cls(db_dir or index["db_dir"], records)
+
+    def save(self, index_path: str):
+        """
+        Saves the catalog to a file.
+        :param index_path: Path of the index file.
+        """
+        index = dict(
+            version=CATALOG_VERSION,
+            db_dir=self.db_dir,
+            records=[rec._asdict() for rec in self.records.values()],
+        )
+        tmp_path = f"{index_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+
+    def refresh(self, n_jobs: int = None):
+        """
+        Scans the database directory tree and updates the catalog. Only new
+        records and records whose header was modified are parsed; records
+        which no longer exist are removed.
+        :param n_jobs: Number of processes to use for parsing headers. None
+        means the number of CPUs, 1 means no separate processes.
+        :return: The number of headers that were parsed.
+        """
+        scanned = _scan_tree(self.db_dir)
+
+        to_parse = []
+        records = {}
+        for name, (hea_mtime_ns, hea_size, exts) in scanned.items():
+            rec = self.records.get(name)
+            if rec is None or (rec.hea_mtime_ns, rec.hea_size) != (
+                hea_mtime_ns,
+                hea_size,
+            ):
+                to_parse.append(name)
+                continue
+            records[name] = rec._replace(ann_exts=_ann_exts(exts, rec))
+
+        rec_paths = [os.path.join(self.db_dir, name) for name in to_parse]
+        if n_jobs == 1 or len(to_parse) < 2:
+            parsed = map(_read_record_info, rec_paths)
+        else:
+            n_jobs = n_jobs or os.cpu_count() or 1
+            pool = ProcessPoolExecutor(max_workers=n_jobs)
+            chunksize = max(1, len(rec_paths) // (4 * n_jobs))
+            parsed = pool.map(_read_record_info, rec_paths, chunksize=chunksize)
+
+        try:
+            for name, rec in zip(to_parse, parsed):
+                if rec is None:
+                    continue
+                hea_mtime_ns, hea_size, exts = scanned[name]
+                records[name] = rec._replace(
+                    name=name,
+                    hea_mtime_ns=hea_mtime_ns,
+                    hea_size=hea_size,
+                    ann_exts=_ann_exts(exts, rec),
+                )
+        finally:
+            if not isinstance(parsed, map):
+                pool.shutdown()
+
+        self.records = dict(sorted(records.items()))
+        return len(to_parse)
+
+    def query(
+        self,
+        ann_ext: str = None,
+        require_ecg: bool = False,
+        min_duration: float = None,
+        max_duration: float = None,
+        fs: float = None,
+        where: Callable[[RecordInfo], bool] = None,
+    ) -> List[RecordInfo]:
+        """
+        Finds records matching some criteria. All criteria must hold.
+        :param ann_ext: Only records with an annotation file of this extension.
+        :param require_ecg: Only records with a (heuristically detected) ECG
+        channel.
+        :param min_duration: Minimal record duration, in seconds.
+        :param max_duration: Maximal record duration, in seconds.
+        :param fs: Only records with this sampling frequency.
+        :param where: A function accepting a RecordInfo and returning whether
+        to include it.
+        :return: A list of the matching records.
+        """
+        return [
+            rec
+            for rec in self.records.values()
+            if (ann_ext is None or ann_ext in rec.ann_exts)
+            and (not require_ecg or rec.ecg_channel is not None)
+            and (min_duration is None or rec.duration >= min_duration)
+            and (max_duration is None or rec.duration <= max_duration)
+            and (fs is None or rec.fs == fs)
+            and (where is None or where(rec))
+        ]
+
+    def path(self, rec: RecordInfo) -> str:
+        """
+        :param rec: A record from this catalog.
+        :return: The full path of the record (without extension).
+        """
+        return os.path.join(self.db_dir, rec.name)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def __getitem__(self, name: str) -> RecordInfo:
+        return self.records[name]
+
+
+def _scan_tree(db_dir: str):
+    """
+    Finds all header files in a directory tree.
+    :return: A dict mapping record names (relative paths without extension)
+    to a tuple of the header's mtime, size and the set of extensions of
+    all files with the same name.
+    """
+    scanned = {}
+    dirs = [""]
+    while dirs:
+        rel_dir = dirs.pop()
+        stems, headers = {}, {}
+        with os.scandir(os.path.join(db_dir, rel_dir)) as it:
+            for entry in it:
+                if entry.is_dir():
+                    dirs.append(os.path.join(rel_dir, entry.name))
+                    continue
+                # Record names may contain dots, e.g. rec.v2.hea
+                stem, dot, ext = entry.name.rpartition(".")
+                if not dot:
+                    continue
+                stems.setdefault(stem, set()).add(ext)
+                if ext == "hea":
+                    headers[stem] = entry.stat()
+
+        for stem, st in headers.items():
+            scanned[os.path.join(rel_dir, stem)] = (
+                st.st_mtime_ns,
+                st.st_size,
+                stems[stem],
+            )
+    return scanned
+
+
+def _ann_exts(exts, rec: RecordInfo):
+    # Annotation files are all files named after the record, except the
+    # header, data files and files with compound extensions (e.g. caches).
+    dat_exts = {f.rpartition(".")[2] for f in rec.dat_files}
+    return tuple(
+        sorted(e for e in exts if e != "hea" and e not in dat_exts and "." not in e)
+    )
+
+
+def _read_record_info(rec_path: str) -> Optional[RecordInfo]:
+    try:
+        header = utils.rdheader(rec_path)
+    except Exception:
+        # Not a valid header
+        return None
+
+    if isinstance(header, wfdb.MultiRecord):
+        dat_files = ()
+    else:
+        dat_files = tuple(sorted(set(header.file_name or [])))
+
+    return RecordInfo(
+        name=rec_path,
+        fs=float(header.fs),
+        sig_len=int(header.sig_len or 0),
+        sig_name=tuple(header.sig_name or []),
+        ecg_channel=utils.find_ecg_channel(rec_path),
+        ann_exts=(),
+        dat_files=dat_files,
+        hea_mtime_ns=0,
+        hea_size=0,
+    )
@@ -4,6 +4,8 @@ PHYSIONET_TOOLS_BIN_DIR = f"{path.abspath(path.dirname(__file__))}/bin"
 
 ECGPUWAVE_BIN = f"{PHYSIONET_TOOLS_BIN_DIR}/ecgpuwave-1.3.3/ecgpuwave"
 
+HEADER_CACHE_MAXSIZE = 4096
+
 WFDB_ANN_ALL_PEAK_TYPES = "NVSFQLRBAaJrFejnE/f"
 
 """
@@ -1,63 +1,525 @@
 import os
 import re
 import glob
+import time
 import wfdb
+import asyncio
+import weakref
 import tempfile
 import warnings
+import functools
+import threading
+import contextlib
 import subprocess
+import collections
+import contextvars
+import numpy as np
+import scipy.signal as sps
+import scipy.ndimage as ndi
+import wfdb.processing
+from typing import Callable, NamedTuple, Union
+from concurrent.futures import ThreadPoolExecutor
 
+import pyhrv.conf
 import pyhrv.wfdb.utils as utils
+from pyhrv import profiling
+from pyhrv.conf import param as v
+from pyhrv.conf import resolve_params
 from pyhrv.wfdb.consts import ECGPUWAVE_BIN
 
+_DETECTORS = {}
 
-def ecgpuwave_detect_sig(sig, fs, from_samp=0, to_samp=-1, **kw):
+
+def register_detector(name: str):
+    """
+    A decorator which registers a QRS detector under a given name, so that
+    it can be referred to by name, e.g. in :meth:`pyhrv.wfdb.rri.ecgrr`.
+
+    A detector is a function with the signature
+    ``detector(rec_path, channel=None, from_time=None, to_time=None, **kw)``,
+    which returns a numpy array of sample indices of the detections.
+
+    :param name: Name of the detector.
+    :return: The decorator.
+    """
+
+    def decorator(detector: Callable):
+        _DETECTORS[name] = detector
+        return detector
+
+    return decorator
+
+
+def get_detector(detector: Union[str, Callable]) -> Callable:
+    """
+    Returns a registered QRS detector.
+    :param detector: Name of the detector. Can also be a detector function,
+    in which case it's returned as-is.
+    :return: The detector function.
+    """
+    if callable(detector):
+        return detector
+
+    if detector not in _DETECTORS:
+        raise ValueError(
+            f"Unknown detector {detector}, must be one of {list_detectors()}"
+        )
+    return _DETECTORS[detector]
+
+
+def list_detectors():
+    """
+    :return: A list of the names of all registered QRS detectors.
+    """
+    return list(_DETECTORS.keys())
+
+
+@profiling.profiled("qrs.rqrs")
+@resolve_params
+def rqrs_detect_sig(
+    sig,
+    fs,
+    from_samp=0,
+    to_samp=-1,
+    window_size_sec=v("rqrs.window_size_sec"),
+    use_gqpost=v("rqrs.use_gqpost"),
+    gqconf=v("rqrs.gqconf"),
+    **kw,
+):
+    """
+    Detects R-peaks in a single channel ECG signal, without running any
+    external tool.
+
+    QRS complexes are first located using the slope energy of the band-passed
+    signal (similar to gqrs [1]_) and then each detection is refined by
+    searching for the R-peak within a window around it (as in rqrs [2]_).
+
+    :param sig: A 1-d numpy array containing one ECG channel.
+    :param fs: The sampling frequency of that channel.
+    :param from_samp: Start sample index.
+    :param to_samp: End sample index. -1 for end of record.
+    :param window_size_sec: Size of the R-peak search window, in seconds.
+    :param use_gqpost: Whether to post-process the detections in order to
+    remove low-amplitude detections which are too close to their neighbours
+    (similar to gqpost [1]_).
+    :param gqconf: Path to a gqrs configuration file. Relative paths
+    which don't exist are looked for in the pyhrv configuration directory.
+    :return: A numpy array of sample indices corresponding to R-peaks.
+
+    .. [1] https://physionet.org/physiotools/wag/gqrs-1.htm
+    .. [2] https://github.com/physiozoo/mhrv
+    """
+    assert sig.ndim == 1
+    if to_samp < 0:
+        to_samp = len(sig)
+    sig = np.asarray(sig[from_samp:to_samp], dtype=np.float64)
+
+    # Interpolate over invalid samples (NaNs)
+    invalid = np.isnan(sig)
+    if np.all(invalid):
+        return np.empty(0, dtype=np.int64)
+    if np.any(invalid):
+        # Don't overwrite the caller's array, asarray may not have copied it
+        sig = sig.copy()
+        sig[invalid] = np.interp(
+            np.flatnonzero(invalid), np.flatnonzero(~invalid), sig[~invalid]
+        )
+
+    conf = _read_gqconf(gqconf)
+    hr, rr_min, qs, thresh = conf["hr"], conf["rrmin"], conf["qs"], conf["thresh"]
+
+    # QRS energy: squared slope of band-passed signal, integrated over ~QRS
+    sos = sps.butter(2, [5.0, min(15.0, 0.45 * fs)], "bandpass", fs=fs, output="sos")
+    sig_bp = sps.sosfiltfilt(sos, sig)
+    qrs_energy = ndi.uniform_filter1d(np.gradient(sig_bp) ** 2, round(2 * qs * fs) or 1)
+
+    # Candidates, at most one per minimal RR interval
+    cand, _ = sps.find_peaks(qrs_energy, distance=max(1, round(rr_min * fs)))
+    if len(cand) == 0:
+        return cand.astype(np.int64)
+
+    # Adaptive threshold relative to the local level of the QRS peaks
+    # (median over a few seconds of the local candidate maxima).
+    heights = qrs_energy[cand]
+    ref_len = 2 * round(2.5 * hr / 60) + 1
+    ref_level = ndi.median_filter(ndi.maximum_filter1d(heights, 3), ref_len)
+    min_heights = 0.3 * thresh * ref_level
+    accepted = heights >= min_heights
+
+    # Search-back: lower the threshold in unusually long RR intervals
+    peaks = cand[accepted]
+    if len(peaks) > 2:
+        rri = np.diff(peaks)
+        long_rr = rri > 1.66 * ndi.median_filter(rri, 9)
+        rr_idx = np.searchsorted(peaks, cand, side="right") - 1
+        in_long_rr = np.zeros_like(accepted)
+        valid = (rr_idx >= 0) & (rr_idx < len(rri))
+        in_long_rr[valid] = long_rr[rr_idx[valid]]
+        accepted |= in_long_rr & (heights >= 0.5 * min_heights)
+
+    if use_gqpost:
+        accepted &= ~_rqrs_post(cand, heights, accepted, min_heights)
+
+    # Refine each detection to the R-peak: maximal absolute value of the
+    # band-passed signal within the search window.
+    peaks = cand[accepted]
+    win_len = max(1, round(window_size_sec * fs))
+    win_starts = np.clip(peaks - win_len // 2, 0, max(0, len(sig) - win_len))
+    win_idx = win_starts[:, None] + np.arange(min(win_len, len(sig)))
+    r_peaks = win_idx[np.arange(len(peaks)), np.argmax(np.abs(sig_bp[win_idx]), 1)]
+
+    return np.unique(r_peaks).astype(np.int64) + from_samp
+
+
+@register_detector("rqrs")
+@resolve_params
+def rqrs_detect_rec(
+    rec_path,
+    channel=None,
+    from_time=None,
+    to_time=None,
+    block_sec=v("rqrs.block_sec"),
+    overlap_sec=10.0,
+    merge_tol_sec=0.1,
+    **kw,
+):
+    """
+    Runs the rqrs R-peak detector on a single channel ECG signal from a
+    given PhysioNet record, and returns the indices of detections.
+
+    :param rec_path: Path to PhysioNet record without extension.
+    :param channel: Index of channel to read when using rec_path. If None,
+    it will be heuristically estimated.
+    :param from_time: Start time. A string in PhysioNet time format [1]_.
+    :param to_time: End time.  A string in PhysioNet time format [1]_.
+    :param block_sec: If provided, the signal is read and processed in blocks
+    of this duration (in seconds), so that memory usage doesn't depend on the
+    length of the record. If None, the whole signal is read at once.
+    :param overlap_sec: Duration in seconds by which each block is extended
+    on both sides, so that the detector can settle before reaching the part
+    of the block whose detections are kept.
+    :param merge_tol_sec: Detections from adjacent blocks which are closer
+    than this duration (in seconds) across a block boundary are considered
+    to be the same beat.
+    :param kw: Extra arguments for :meth:`rqrs_detect_sig`.
+    :return: A numpy array of sample indices corresponding to R-peaks.
+
+    .. [1] https://www.physionet.org/physiotools/wag/intro.htm#time
+    """
+    if not block_sec:
+        sig, fs, sampfrom = _read_ecg_channel(rec_path, channel, from_time, to_time)
+        return rqrs_detect_sig(sig, fs, **kw) + sampfrom
+
+    return _detect_blocks(
+        rqrs_detect_sig,
+        rec_path,
+        channel,
+        from_time,
+        to_time,
+        block_sec,
+        overlap_sec,
+        merge_tol_sec,
+        **kw,
+    )
+
+
+@register_detector("gqrs")
+def gqrs_detect_rec(rec_path, channel=None, from_time=None, to_time=None, **kw):
+    """
+    Runs the in-process python implementation of the gqrs [1]_ QRS detector,
+    from the wfdb package, on a single channel ECG signal from a given
+    PhysioNet record.
+
+    :param rec_path: Path to PhysioNet record without extension.
+    :param channel: Index of channel to read when using rec_path. If None,
+    it will be heuristically estimated.
+    :param from_time: Start time. A string in PhysioNet time format.
+    :param to_time: End time.  A string in PhysioNet time format.
+    :param kw: Extra arguments for :meth:`wfdb.processing.gqrs_detect`.
+    :return: A numpy array of sample indices corresponding to QRS locations.
+
+    .. [1] https://physionet.org/physiotools/wag/gqrs-1.htm
+    """
+    sig, fs, sampfrom = _read_ecg_channel(rec_path, channel, from_time, to_time)
+    detections = wfdb.processing.gqrs_detect(sig=np.nan_to_num(sig), fs=fs, **kw)
+    return np.asarray(detections, dtype=np.int64) + sampfrom
+
+
+@register_detector("xqrs")
+def xqrs_detect_rec(rec_path, channel=None, from_time=None, to_time=None, **kw):
+    """
+    Runs the XQRS QRS detector from the wfdb package on a single channel ECG
+    signal from a given PhysioNet record.
+
+    :param rec_path: Path to PhysioNet record without extension.
+    :param channel: Index of channel to read when using rec_path. If None,
+    it will be heuristically estimated.
+    :param from_time: Start time. A string in PhysioNet time format.
+    :param to_time: End time.  A string in PhysioNet time format.
+    :param kw: Extra arguments for :meth:`wfdb.processing.xqrs_detect`.
+    :return: A numpy array of sample indices corresponding to QRS locations.
+    """
+    sig, fs, sampfrom = _read_ecg_channel(rec_path, channel, from_time, to_time)
+    detections = wfdb.processing.xqrs_detect(
+        np.nan_to_num(sig), fs, verbose=False, **kw
+    )
+    return np.asarray(detections, dtype=np.int64) + sampfrom
+
+
+def _read_ecg_channel(rec_path, channel=None, from_time=None, to_time=None):
+    """
+    Reads a single ECG channel from a record.
+    :param rec_path: Path to PhysioNet record without extension.
+    :param channel: Index of channel to read. If None, it will be
+    heuristically estimated.
+    :param from_time: Start time. A string in PhysioNet time format.
+    :param to_time: End time.  A string in PhysioNet time format.
+    :return: A tuple (sig, fs, sampfrom) of the physical signal, its
+    sampling frequency and the index of its first sample in the record.
+    """
+    rec_path = str(rec_path)
+    if channel is None:
+        channel = utils.find_ecg_channel(rec_path)
+
+    header = utils.rdheader(rec_path)
+    sampfrom, sampto = _sample_range(header, from_time, to_time)
+    sig = utils.rdsignal(rec_path, channel or 0, sampfrom, sampto)
+    return sig, header.fs, sampfrom
+
+
+def _sample_range(header, from_time=None, to_time=None):
+    sampfrom, sampto = 0, header.sig_len
+    if from_time:
+        sampfrom = utils.wfdb_time_to_samples(from_time, header.fs)
+    if to_time:
+        sampto = utils.wfdb_time_to_samples(to_time, header.fs)
+        if sampto < 0 or sampto > header.sig_len:
+            sampto = header.sig_len
+    return sampfrom, sampto
+
+
+def _detect_blocks(
+    detect_sig,
+    rec_path,
+    channel,
+    from_time,
+    to_time,
+    block_sec,
+    overlap_sec,
+    merge_tol_sec,
+    **kw,
+):
+    """
+    Runs a detector on consecutive overlapping blocks of a record's signal,
+    reading one block at a time, and merges the detections.
+    :param detect_sig: A detector accepting a signal and sampling frequency,
+    and returning sample indices.
+    :return: A sorted array of sample indices.
+    """
+    rec_path = str(rec_path)
+    if channel is None:
+        channel = utils.find_ecg_channel(rec_path)
+
+    header = utils.rdheader(rec_path)
+    fs = header.fs
+    sampfrom, sampto = _sample_range(header, from_time, to_time)
+
+    # Keep only the block ranges, not the signals
+    segments, seg_detections = [], []
+    for block in utils.iter_signal_blocks(
+        rec_path,
+        channel or 0,
+        sampfrom,
+        sampto,
+        block_len=round(block_sec * fs),
+        overlap_len=round(overlap_sec * fs),
+    ):
+        segments.append(
+            _Segment(block.core_start, block.core_end, block.start, block.end)
+        )
+        seg_detections.append(detect_sig(block.sig, fs, **kw) + block.start)
+
+    if not segments:
+        return np.empty(0, dtype=np.int64)
+    return _merge_segment_detections(
+        seg_detections, segments, tol=round(merge_tol_sec * fs)
+    )
+
+
+def _read_gqconf(gqconf):
+    """
+    Reads a gqrs configuration file.
+    :param gqconf: Path to the file.
+    :return: A dict mapping lower-case parameter names to their values.
+    """
+    if not os.path.isabs(gqconf) and not os.path.isfile(gqconf):
+        gqconf = os.path.join(os.path.dirname(pyhrv.conf.__file__), gqconf)
+
+    conf = {}
+    with open(gqconf, "r") as f:
+        for line in f:
+            line = line.split("#", 1)[0].split()
+            if len(line) >= 2:
+                conf[line[0].lower()] = float(line[1])
+
+    missing = {"hr", "rrmin", "qs", "thresh"} - conf.keys()
+    if missing:
+        raise ValueError(f"Missing parameters {missing} in {gqconf}")
+
+    return conf
+
+
+def _rqrs_post(peaks, heights, accepted, min_heights):
+    """
+    Finds accepted detections which are likely false positives: a detection
+    is rejected if it creates an RR interval much shorter than the local
+    median and its amplitude is lower than its neighbours'.
+    :return: A boolean mask over all candidate peaks.
+    """
+    acc_idx = np.flatnonzero(accepted)
+    if len(acc_idx) < 3:
+        return np.zeros_like(accepted)
+
+    acc_peaks, acc_heights = peaks[acc_idx], heights[acc_idx]
+    rri = np.diff(acc_peaks)
+    short_rr = rri < 0.6 * ndi.median_filter(rri, 9)
+
+    # Of the two detections around a short interval, reject the weaker one,
+    # unless it's well above the threshold.
+    weaker = np.where(acc_heights[:-1] < acc_heights[1:], 0, 1)
+    reject_idx = acc_idx[np.flatnonzero(short_rr) + weaker[short_rr]]
+    reject = np.zeros_like(accepted)
+    reject[reject_idx] = heights[reject_idx] < 2 * min_heights[reject_idx]
+
+    return reject
+
+
+def ecgpuwave_detect_sig(sig, fs, from_samp=0, to_samp=-1, adc_gain=200.0, **kw):
     """
     Runs the ecgpuwave QRS detector on a single channel ECG signal, and returns
     the indices of detections.
 
-    :param sig: A 1-d numpy array containing one ECG channel.
+    The signal is written to a temporary record in a private scratch
+    directory (on tmpfs if available), so it's safe to call this function
+    concurrently from multiple threads or processes.
+
+    :param sig: A 1-d numpy array containing one ECG channel. If it's
+    floating-point, it's assumed to be in mV and will be stored in 16-bit
+    format, with a gain which spans the signal's range (NaNs are stored as
+    invalid samples). If it's an integer array, it's assumed to contain
+    digital (ADC) values, which will be stored as-is.
     :param fs: The sampling frequency of that channel.
     :param from_samp: Start sample index.
     :param to_samp: End sample index. -1 for end of record.
+    :param adc_gain: ADC gain (units per mV) of the signal. Only used if
+    the signal is digital (integer).
+    :param kw: Extra arguments for :meth:`ecgpuwave_detect_rec`.
     :return: A numpy array of sample indices corresponding to detected
     features (either R-peaks or QRS onset).
     """
     assert sig.ndim == 1
-    sig = sig[from_samp:to_samp].reshape(-1, 1)
+    if to_samp < 0:
+        to_samp = len(sig)
+    sig = sig[from_samp:to_samp]
 
-    # We'll write the given data to a temporary record
-    temp_dir = tempfile.gettempdir()
-    temp_recname = f"tmprec_{os.getpid()}"
-    rec_path = os.path.join(temp_dir, temp_recname)
+    (d_sig,), adc_gain, baseline, fmt = _digitize([sig], adc_gain)
+    with _scratch_dir() as scratch_dir:
+        rec_path = _write_scratch_record(
+            scratch_dir, "rec", d_sig, fs, adc_gain, baseline, fmt
+        )
+        return ecgpuwave_detect_rec(rec_path, channel=0, **kw) + from_samp
 
-    try:
-        wfdb.wrsamp(
-            record_name=temp_recname,
-            fs=fs,
-            units=["mV"],
-            sig_name=["ECG"],
-            p_signal=sig,
-            write_dir=temp_dir,
-            fmt=["212"],
+
+def ecgpuwave_detect_sigs(sigs, fs, gap_sec=2.0, adc_gain=200.0, **kw):
+    """
+    Runs the ecgpuwave QRS detector on multiple single channel ECG signals
+    using one ecgpuwave process.
+
+    The signals are written as segments of one temporary multi-segment
+    record, separated by flat gaps, so that the process startup cost is
+    paid once for the entire batch.
+
+    :param sigs: A sequence of 1-d numpy arrays, each containing one ECG
+    channel. See :meth:`ecgpuwave_detect_sig`. All the segments are written
+    with the same gain and baseline: if any signal is floating-point, the
+    gain spans the range of all the signals, and digital signals are first
+    converted to mV with ``adc_gain``.
+    :param fs: The sampling frequency of all the signals.
+    :param gap_sec: Duration in seconds of the flat gap between signals.
+    :param adc_gain: ADC gain (units per mV) of digital (integer) signals.
+    :param kw: Extra arguments for :meth:`ecgpuwave_detect_rec`.
+    :return: A list of numpy arrays of sample indices corresponding to
+    detected features, one for each signal.
+    """
+    if len(sigs) == 0:
+        return []
+
+    gap_len = max(1, round(gap_sec * fs))
+    with _scratch_dir() as scratch_dir:
+        rec_path, seg_starts = _write_scratch_batch(
+            scratch_dir, "batch", sigs, fs, gap_len, adc_gain
         )
+        detections = ecgpuwave_detect_rec(rec_path, channel=0, **kw)
 
-        return ecgpuwave_detect_rec(rec_path, channel=0, **kw)
-    finally:
-        # Remove the temporary record
-        for f in glob.glob(os.path.join(rec_path, ".*")):
-            os.remove(f)
+    # Split detections between the signals
+    split_idx = np.searchsorted(
+        detections, [s + len(sig) for s, sig in zip(seg_starts, sigs)]
+    )
+    start_idx = np.searchsorted(detections, seg_starts)
+    return [
+        detections[i:j] - seg_start
+        for i, j, seg_start in zip(start_idx, split_idx, seg_starts)
+    ]
 
 
-def ecgpuwave_detect_rec(rec_path, channel=None, from_time=None, to_time=None, **kw):
+@register_detector("ecgpuwave")
+@resolve_params
+def ecgpuwave_detect_rec(
+    rec_path,
+    channel=None,
+    from_time=None,
+    to_time=None,
+    segment_sec=None,
+    overlap_sec=10.0,
+    merge_tol_sec=0.1,
+    n_jobs=None,
+    timeout=None,
+    max_splits=v("ecgpuwave.max_splits"),
+    **kw,
+):
     """
     Runs the ecgpuwave QRS detector on a single channel ECG signal from a
     given PhysioNet record, and returns the indices of detections.
 
+    ecgpuwave runs on links to the record's files in a private scratch
+    directory, where it writes its output and temporary files, so it's safe to
+    run concurrently on the same record.
+
+    If ecgpuwave times out, the time range is split in two halves (with
+    overlap) which are retried in parallel, recursively up to ``max_splits``
+    times.
+
     :param rec_path: Path to PhysioNet record without extension.
     :param channel: Index of channel to read when using rec_path. If None,
     it will be heuristically estimated.
     :param from_time: Start time. A string in PhysioNet time format [1]_.
     :param to_time: End time.  A string in PhysioNet time format [1]_.
+    :param segment_sec: If provided, the time range will be split into
+    segments of this duration (in seconds), which will be processed in
+    parallel by separate ecgpuwave processes. If None, or if the time range
+    fits in one segment, a single ecgpuwave process is used.
+    :param overlap_sec: Duration in seconds by which each segment is extended
+    on both sides, so that the detector can settle before reaching the part of
+    the segment whose detections are kept.
+    :param merge_tol_sec: Detections from adjacent segments which are closer
+    than this duration (in seconds) across a segment boundary are considered
+    to be the same beat.
+    :param n_jobs: Maximal number of segments to process in parallel. None
+    means the number of CPUs.
+    :param timeout: Timeout in seconds for each ecgpuwave process. None means
+    estimating it from the duration of the time range (see
+    :meth:`ecgpuwave_wrapper`).
+    :param max_splits: Maximal depth of splitting a time range on timeout.
     :return: A numpy array of sample indices corresponding to detected
     features (either R-peaks or QRS onset).
 
@@ -67,22 +529,541 @@ def ecgpuwave_detect_rec(rec_path, channel=None, from_time=None, to_time=None, *
     if channel is None:
         channel = utils.find_ecg_channel(rec_path)
 
-    ann_ext = f"ecgatr{os.getpid()}"
+    if segment_sec:
+        header = utils.rdheader(rec_path)
+        fs = header.fs
+        segments = _split_segments(
+            utils.wfdb_time_to_samples(from_time, fs) if from_time else 0,
+            utils.wfdb_time_to_samples(to_time, fs) if to_time else -1,
+            header.sig_len,
+            seg_len=round(segment_sec * fs),
+            overlap_len=round(overlap_sec * fs),
+        )
+
+        if len(segments) > 1:
+            with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+                seg_detections = list(
+                    pool.map(
+                        lambda seg: _ecgpuwave_detect_segment(
+                            rec_path,
+                            channel,
+                            seg,
+                            overlap_sec=overlap_sec,
+                            merge_tol_sec=merge_tol_sec,
+                            timeout=timeout,
+                            max_splits=max_splits,
+                        ),
+                        segments,
+                    )
+                )
+            return _merge_segment_detections(
+                seg_detections, segments, tol=round(merge_tol_sec * fs)
+            )
+
+    ann_ext, ann_type = "ecgatr", "N"
+    with _scratch_record(rec_path) as scratch_rec_path:
+        status = _ecgpuwave_run(
+            scratch_rec_path,
+            ann_ext,
+            channel=channel,
+            from_time=from_time,
+            to_time=to_time,
+            timeout=timeout,
+        )
+        if status == _RUN_OK:
+            # Read the annotations from the file it created. It's temporary,
+            # so it's not cached.
+            ann_to_idx = utils.rdann_by_type(
+                scratch_rec_path, ann_ext, types=ann_type, cache=False
+            )
+            return ann_to_idx[ann_type]
+
+    if status == _RUN_TIMEOUT and max_splits > 0:
+        header = utils.rdheader(rec_path)
+        sampfrom, sampto = _sample_range(header, from_time, to_time)
+        overlap_len = round(overlap_sec * header.fs)
+        if sampto - sampfrom > 4 * overlap_len:
+            # Retry each half of the time range, with overlap
+            mid = (sampfrom + sampto) // 2
+            segments = [
+                _Segment(sampfrom, mid, sampfrom, min(sampto, mid + overlap_len)),
+                _Segment(mid, sampto, max(sampfrom, mid - overlap_len), sampto),
+            ]
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                seg_detections = list(
+                    pool.map(
+                        lambda seg: _ecgpuwave_detect_segment(
+                            rec_path,
+                            channel,
+                            seg,
+                            overlap_sec=overlap_sec,
+                            merge_tol_sec=merge_tol_sec,
+                            timeout=timeout,
+                            max_splits=max_splits - 1,
+                        ),
+                        segments,
+                    )
+                )
+            return _merge_segment_detections(
+                seg_detections, segments, tol=round(merge_tol_sec * header.fs)
+            )
+
+    raise RuntimeError(
+        f"ecgpuwave failed on record {rec_path} ({status}), "
+        f"from_time={from_time}, to_time={to_time}"
+    )
+
+
+@resolve_params
+async def async_ecgpuwave_detect_rec(
+    rec_path,
+    channel=None,
+    from_time=None,
+    to_time=None,
+    segment_sec=None,
+    overlap_sec=10.0,
+    merge_tol_sec=0.1,
+    timeout=None,
+    max_splits=v("ecgpuwave.max_splits"),
+):
+    """
+    An asyncio version of :meth:`ecgpuwave_detect_rec`, which runs ecgpuwave
+    processes without blocking the event loop, so many detections can be in
+    flight at once. The number of concurrent ecgpuwave processes is limited
+    by the ``ecgpuwave.max_async_processes`` parameter; further runs wait.
+
+    Each run uses its own scratch directory, so concurrent detections on the
+    same record don't interfere. On timeout or cancellation the ecgpuwave
+    process is killed, and its scratch directory is removed. Reading the
+    record and managing the scratch directory are done in the loop's default
+    executor.
+
+    :param rec_path: Path to PhysioNet record without extension.
+    :param channel: Index of channel to read. If None, it will be
+    heuristically estimated.
+    :param from_time: Start time. A string in PhysioNet time format.
+    :param to_time: End time.  A string in PhysioNet time format.
+    :param segment_sec: If provided, the time range will be split into
+    segments of this duration (in seconds), which are processed concurrently.
+    :param overlap_sec: Duration in seconds by which each segment is extended
+    on both sides.
+    :param merge_tol_sec: Tolerance for merging detections across segment
+    boundaries, in seconds.
+    :param timeout: Timeout in seconds for each ecgpuwave process. None means
+    estimating it from the duration of the time range.
+    :param max_splits: Maximal depth of splitting a time range on timeout.
+    :return: A numpy array of sample indices of detected R-peaks.
+    """
+    if channel is None:
+        channel = await _in_executor(utils.find_ecg_channel, rec_path)
+
+    header = await _in_executor(utils.rdheader, rec_path)
+    detect_kw = dict(overlap_sec=overlap_sec, merge_tol_sec=merge_tol_sec)
+    detect_kw.update(timeout=timeout, max_splits=max_splits)
+
+    if segment_sec:
+        segments = _split_segments(
+            utils.wfdb_time_to_samples(from_time, header.fs) if from_time else 0,
+            utils.wfdb_time_to_samples(to_time, header.fs) if to_time else -1,
+            header.sig_len,
+            seg_len=round(segment_sec * header.fs),
+            overlap_len=round(overlap_sec * header.fs),
+        )
+        if len(segments) > 1:
+            return await _async_detect_segments(
+                rec_path, channel, segments, header.fs, detect_kw
+            )
+
+    ann_ext, ann_type = "ecgatr", "N"
+    async with _async_scratch_record(rec_path) as scratch_rec_path:
+        status = await _async_ecgpuwave_run(
+            scratch_rec_path,
+            ann_ext,
+            channel=channel,
+            from_time=from_time,
+            to_time=to_time,
+            timeout=timeout,
+        )
+        if status == _RUN_OK:
+            read_ann = functools.partial(
+                utils.rdann_by_type,
+                scratch_rec_path,
+                ann_ext,
+                types=ann_type,
+                cache=False,
+            )
+            ann_to_idx = await _in_executor(read_ann)
+            return ann_to_idx[ann_type]
+
+    if status == _RUN_TIMEOUT and max_splits > 0:
+        sampfrom, sampto = _sample_range(header, from_time, to_time)
+        overlap_len = round(overlap_sec * header.fs)
+        if sampto - sampfrom > 4 * overlap_len:
+            # Retry each half of the time range, with overlap
+            mid = (sampfrom + sampto) // 2
+            segments = [
+                _Segment(sampfrom, mid, sampfrom, min(sampto, mid + overlap_len)),
+                _Segment(mid, sampto, max(sampfrom, mid - overlap_len), sampto),
+            ]
+            detect_kw.update(max_splits=max_splits - 1)
+            return await _async_detect_segments(
+                rec_path, channel, segments, header.fs, detect_kw
+            )
+
+    raise RuntimeError(
+        f"ecgpuwave failed on record {rec_path} ({status}), "
+        f"from_time={from_time}, to_time={to_time}"
+    )
+
+
+async def _async_detect_segments(rec_path, channel, segments, fs, detect_kw):
+    tasks = [
+        asyncio.ensure_future(
+            async_ecgpuwave_detect_rec(
+                rec_path,
+                channel=channel,
+                from_time=f"s{seg.start}",
+                to_time=f"s{seg.end}",
+                **detect_kw,
+            )
+        )
+        for seg in segments
+    ]
     try:
-        # Run ecgpuwave
-        ecgpuwave_wrapper(
-            rec_path, ann_ext, channel=channel, from_time=from_time, to_time=to_time
+        seg_detections = await asyncio.gather(*tasks)
+    except BaseException:
+        # Don't leave the other segments running
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    tol = round(detect_kw["merge_tol_sec"] * fs)
+    return _merge_segment_detections(seg_detections, segments, tol=tol)
+
+
+class _Segment(NamedTuple):
+    # Range of samples whose detections are kept
+    core_start: int
+    core_end: int
+    # Range of samples the detector actually runs on
+    start: int
+    end: int
+
+
+def _split_segments(sampfrom, sampto, sig_len, seg_len, overlap_len):
+    """
+    Splits a range of samples into consecutive segments with overlap.
+    :param sampfrom: Start sample index.
+    :param sampto: End sample index. -1 for end of record.
+    :param sig_len: Length of the record, in samples.
+    :param seg_len: Length of each segment (not including the overlap).
+    :param overlap_len: Number of samples to add on each side of a segment.
+    :return: A list of segments. The core ranges of the segments are
+    disjoint and together they cover the entire given range.
+    """
+    if sampto < 0 or sampto > sig_len:
+        sampto = sig_len
+    if seg_len < 1:
+        raise ValueError("Segment length must be at least one sample")
+
+    segments = []
+    for core_start in range(sampfrom, sampto, seg_len):
+        core_end = min(core_start + seg_len, sampto)
+        segments.append(
+            _Segment(
+                core_start,
+                core_end,
+                max(sampfrom, core_start - overlap_len),
+                min(sampto, core_end + overlap_len),
+            )
         )
 
-        # Read the annotations from the file it created.
-        ann_type = "N"
-        ann_to_idx = utils.rdann_by_type(rec_path, ann_ext, types=ann_type)
-        return ann_to_idx[ann_type]
+    # Avoid a tiny last segment, the detector can't handle it well
+    if len(segments) > 1 and segments[-1].core_end - segments[-1].core_start < (
+        seg_len // 2
+    ):
+        last, prev = segments.pop(), segments.pop()
+        segments.append(_Segment(prev.core_start, last.core_end, prev.start, last.end))
+
+    return segments
+
+
+def _ecgpuwave_detect_segment(rec_path, channel, segment: _Segment, **kw):
+    return ecgpuwave_detect_rec(
+        rec_path,
+        channel=channel,
+        from_time=f"s{segment.start}",
+        to_time=f"s{segment.end}",
+        **kw,
+    )
+
+
+def _merge_segment_detections(seg_detections, segments, tol):
+    """
+    Merges detections from overlapping segments.
+    :param seg_detections: A list of arrays of detected sample indices, one
+    per segment.
+    :param segments: A list of segments corresponding to the detections.
+    :param tol: Detections closer than this number of samples, which are on
+    different sides of a segment boundary, are merged into one.
+    :return: A sorted array of sample indices.
+    """
+    kept = []
+    for dets, seg in zip(seg_detections, segments):
+        dets = np.asarray(dets, dtype=np.int64)
+        kept.append(dets[(dets >= seg.core_start) & (dets < seg.core_end)])
+
+    merged = np.sort(np.concatenate(kept))
+    if len(merged) < 2:
+        return merged
+
+    # A beat near a boundary may be detected (at slightly different
+    # locations) by both segments; keep only the first detection.
+    boundaries = np.array([seg.core_end for seg in segments[:-1]])
+    seg_idx = np.searchsorted(boundaries, merged, side="right")
+    duplicate = (np.diff(merged) <= tol) & (np.diff(seg_idx) > 0)
+
+    return merged[np.r_[True, ~duplicate]]
+
+
+@contextlib.contextmanager
+def _scratch_dir():
+    """
+    Creates a uniquely-named temporary directory, preferably on tmpfs.
+    :return: A context manager yielding the path of the directory. The
+    directory and all its contents are removed on exit.
+    """
+    shm_dir = "/dev/shm"
+    root_dir = shm_dir if os.access(shm_dir, os.W_OK | os.X_OK) else None
+
+    with tempfile.TemporaryDirectory(prefix="pyhrv_", dir=root_dir) as scratch_dir:
+        yield scratch_dir
+
+
+@contextlib.contextmanager
+def _scratch_record(rec_path):
+    """
+    Creates a temporary directory containing links to the files of a record.
+    :param rec_path: Path to PhysioNet record without extension.
+    :return: A context manager yielding the path of the linked record
+    (without extension). The directory is removed on exit.
+    """
+    rec_dir, rec_name = os.path.split(os.path.abspath(rec_path))
+    file_names = _record_files(rec_dir, rec_name)
+
+    with _scratch_dir() as scratch_dir:
+        for file_name in file_names:
+            os.symlink(
+                os.path.join(rec_dir, file_name), os.path.join(scratch_dir, file_name)
+            )
+        yield os.path.join(scratch_dir, rec_name)
+
+
+@contextlib.asynccontextmanager
+async def _async_scratch_record(rec_path):
+    """
+    An asyncio version of :meth:`_scratch_record`, which creates and removes
+    the directory in the loop's default executor.
+    """
+    scratch_record = _scratch_record(rec_path)
+    scratch_rec_path = await _in_executor(scratch_record.__enter__)
+    try:
+        yield scratch_rec_path
     finally:
-        # Remove the annotation file
-        ann_file = f"{rec_path}.{ann_ext}"
-        if os.path.exists(ann_file):
-            os.remove(ann_file)
+        await _in_executor(scratch_record.__exit__, None, None, None)
+
+
+def _digitize(sigs, adc_gain):
+    """
+    Converts single channel ECG signals to digital values with a common
+    scaling, so that they can be written as segments of one record.
+    Digital (integer) signals are kept as-is if they all are. Otherwise, all
+    signals are converted to mV, and then to 16-bit values with a gain and
+    baseline which span their overall range.
+    :param sigs: A sequence of 1-d numpy arrays.
+    :param adc_gain: ADC gain (units per mV) of the digital signals.
+    :return: Tuple of the digital signals, the ADC gain, the baseline and the
+    WFDB format.
+    """
+    if all(np.issubdtype(sig.dtype, np.integer) for sig in sigs):
+        int16 = np.iinfo(np.int16)
+        fits_16bit = all(
+            len(sig) == 0 or (sig.min() > int16.min and sig.max() <= int16.max)
+            for sig in sigs
+        )
+        dtype, fmt = (np.int16, "16") if fits_16bit else (np.int32, "32")
+        return [sig.astype(dtype) for sig in sigs], adc_gain, 0, fmt
+
+    sigs = [
+        sig / adc_gain if np.issubdtype(sig.dtype, np.integer) else sig for sig in sigs
+    ]
+    finite = [sig[np.isfinite(sig)] for sig in sigs]
+    finite = np.concatenate(finite) if finite else np.empty(0)
+    lo, hi = (finite.min(), finite.max()) if len(finite) else (0.0, 0.0)
+
+    # Map the range to [-32766, 32766], -32768 marks invalid samples
+    if hi > lo:
+        adc_gain = 2 * 32766 / (hi - lo)
+    baseline = -int(round((lo + hi) / 2 * adc_gain))
+    d_sigs = []
+    for sig in sigs:
+        d_sig = np.round(sig * adc_gain) + baseline
+        d_sig[~np.isfinite(sig)] = utils._INVALID_SAMPLE["16"]
+        d_sigs.append(np.clip(d_sig, -(2 ** 15), 2 ** 15 - 1).astype(np.int16))
+    return d_sigs, adc_gain, baseline, "16"
+
+
+def _record_files(rec_dir, rec_name):
+    """
+    :return: Names of the header and signal files of a record, including the
+    segments of a multi-segment record.
+    """
+    header = utils.rdheader(os.path.join(rec_dir, rec_name))
+    file_names = {f"{rec_name}.hea", *(getattr(header, "file_name", None) or [])}
+    for seg_name in getattr(header, "seg_name", None) or []:
+        if seg_name != "~":
+            file_names |= _record_files(rec_dir, seg_name)
+    return file_names
+
+
+def _write_scratch_batch(write_dir, rec_name, sigs, fs, gap_len, adc_gain):
+    """
+    Writes single channel ECG signals as segments of a multi-segment record,
+    separated by flat gaps. See :meth:`_digitize`.
+    :return: Tuple of the path of the written record (without extension), and
+    the start sample of each signal in it.
+    """
+    assert all(sig.ndim == 1 for sig in sigs)
+    d_sigs, adc_gain, baseline, fmt = _digitize(sigs, adc_gain)
+
+    # Write each signal as a segment, and a flat segment for the gaps (at 0 mV,
+    # if it's within range), all with the same scaling.
+    seg_names, seg_lens, seg_starts = [], [], []
+    gap_name = "gap"
+    gap_value = np.clip(baseline, -32766, 32766)
+    gap = np.full(gap_len, gap_value, dtype=d_sigs[0].dtype)
+    _write_scratch_record(write_dir, gap_name, gap, fs, adc_gain, baseline, fmt)
+
+    seg_start = 0
+    for i, sig in enumerate(d_sigs):
+        seg_name = f"seg{i:06d}"
+        _write_scratch_record(write_dir, seg_name, sig, fs, adc_gain, baseline, fmt)
+        seg_names += [seg_name, gap_name]
+        seg_lens += [len(sig), gap_len]
+        seg_starts.append(seg_start)
+        seg_start += len(sig) + gap_len
+
+    # Write the multi-segment record header
+    with open(os.path.join(write_dir, f"{rec_name}.hea"), "w") as f:
+        f.write(f"{rec_name}/{len(seg_names)} 1 {fs} {sum(seg_lens)}\n")
+        for seg_name, seg_len in zip(seg_names, seg_lens):
+            f.write(f"{seg_name} {seg_len}\n")
+
+    return os.path.join(write_dir, rec_name), seg_starts
+
+
+def _write_scratch_record(write_dir, rec_name, d_sig, fs, adc_gain, baseline, fmt):
+    """
+    Writes a single channel digital ECG signal as a record.
+    :return: Path of the written record (without extension).
+    """
+    wfdb.wrsamp(
+        record_name=rec_name,
+        fs=fs,
+        units=["mV"],
+        sig_name=["ECG"],
+        d_signal=d_sig.reshape(-1, 1),
+        fmt=[fmt],
+        adc_gain=[adc_gain],
+        baseline=[baseline],
+        write_dir=write_dir,
+    )
+    return os.path.join(write_dir, rec_name)
+
+
+class EcgpuwaveAttempt(NamedTuple):
+    record: str
+    from_time: str
+    to_time: str
+    n_samples: int
+    timeout: float
+    wall_time: float
+    # One of "ok", "error" or "timeout"
+    status: str
+
+
+_RUN_OK, _RUN_ERROR, _RUN_TIMEOUT = "ok", "error", "timeout"
+
+
+class _ThroughputModel(object):
+    """
+    Estimates the throughput of ecgpuwave (in samples per second) from the
+    runs which completed, in order to set timeouts proportional to the
+    number of samples to process. Also keeps a log of recent attempts.
+    """
+
+    def __init__(self, log_size):
+        # The throughput estimate is initialized from the configuration on
+        # first use (and on reset).
+        self.samples_per_sec = None
+        self.attempts = collections.deque(maxlen=log_size)
+        self._lock = threading.Lock()
+
+    def timeout(self, n_samples: int) -> float:
+        with self._lock:
+            expected = n_samples / self._samples_per_sec()
+        timeout_factor = pyhrv.conf.get_val("ecgpuwave.timeout_factor")
+        timeout_min = pyhrv.conf.get_val("ecgpuwave.timeout_min_sec")
+        return max(timeout_min, timeout_factor * expected)
+
+    def update(self, attempt: EcgpuwaveAttempt):
+        with self._lock:
+            self.attempts.append(attempt)
+            if attempt.status == _RUN_OK and attempt.wall_time > 0:
+                # Exponential moving average of the observed throughput
+                rate = attempt.n_samples / attempt.wall_time
+                self.samples_per_sec = self._samples_per_sec()
+                self.samples_per_sec += 0.25 * (rate - self.samples_per_sec)
+
+    def reset(self):
+        with self._lock:
+            self.attempts.clear()
+            self.samples_per_sec = None
+
+    def _samples_per_sec(self):
+        if self.samples_per_sec is None:
+            self.samples_per_sec = pyhrv.conf.get_val("ecgpuwave.samples_per_sec")
+        return self.samples_per_sec
+
+
+_throughput = _ThroughputModel(log_size=1024)
+
+
+def ecgpuwave_attempts():
+    """
+    :return: A list of :class:`EcgpuwaveAttempt` with the timing and outcome
+    of recent ecgpuwave runs, oldest first.
+    """
+    with _throughput._lock:
+        return list(_throughput.attempts)
+
+
+def ecgpuwave_throughput() -> float:
+    """
+    :return: The current estimate of ecgpuwave's throughput, in samples per
+    second, which is used for setting timeouts.
+    """
+    with _throughput._lock:
+        return _throughput._samples_per_sec()
+
+
+def ecgpuwave_throughput_reset():
+    """
+    Clears the attempt log and resets the throughput estimate to its
+    configured initial value.
+    """
+    _throughput.reset()
 
 
 def ecgpuwave_wrapper(
@@ -92,6 +1073,7 @@ def ecgpuwave_wrapper(
     channel: int = None,
     from_time: str = None,
     to_time: str = None,
+    timeout: float = None,
 ):
     """
     A wrapper for PhysioNet's ecgpuwave [1]_ tool, which segments ECG beats.
@@ -110,14 +1092,192 @@ def ecgpuwave_wrapper(
         the PhysioNet time formats (see [2]_).
     :param to_time: Stop at the given time. Should be a string in one of
         the PhysioNet time formats (see [2]_).
+    :param timeout: Timeout in seconds. If None, it's set proportionally to
+        the number of samples to process, based on the throughput measured
+        in previous runs (see :meth:`ecgpuwave_throughput`).
     :return: True if ran without error.
 
     .. [1] https://www.physionet.org/physiotools/ecgpuwave/
        [2] https://www.physionet.org/physiotools/wag/intro.htm#time
     """
+    status = _ecgpuwave_run(
+        record, out_ann_ext, in_ann_ext, channel, from_time, to_time, timeout
+    )
+    return status == _RUN_OK
+
+
+def _ecgpuwave_run(
+    record: str,
+    out_ann_ext: str,
+    in_ann_ext: str = None,
+    channel: int = None,
+    from_time: str = None,
+    to_time: str = None,
+    timeout: float = None,
+) -> str:
+    """
+    Runs ecgpuwave, see :meth:`ecgpuwave_wrapper`.
+    :return: The status of the run: one of ``_RUN_OK``, ``_RUN_ERROR`` or
+    ``_RUN_TIMEOUT``.
+    """
+    record = str(record)
+    command, rec_dir, n_samples, timeout = _ecgpuwave_command(
+        record, out_ann_ext, in_ann_ext, channel, from_time, to_time, timeout
+    )
+
+    status = _RUN_OK
+    start = time.perf_counter()
+    try:
+        with profiling.stage("qrs.ecgpuwave", n_samples):
+            ecgpuwave_result = subprocess.run(
+                command,
+                check=True,
+                shell=False,
+                universal_newlines=True,
+                timeout=timeout,
+                cwd=rec_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+
+        # ecgpuwave can sometimes fail but still return 0, so need to
+        # also check the stderr output.
+        if not _ecgpuwave_stderr_ok(ecgpuwave_result.stderr):
+            raise subprocess.CalledProcessError(
+                0,
+                command,
+                output=ecgpuwave_result.stdout,
+                stderr=ecgpuwave_result.stderr,
+            )
+
+    except subprocess.CalledProcessError as process_err:
+        status = _RUN_ERROR
+        _warn_ecgpuwave_error(record, process_err.stdout, process_err.stderr)
+
+    except subprocess.TimeoutExpired as timeout_err:
+        status = _RUN_TIMEOUT
+        _warn_ecgpuwave_timeout(record, timeout, timeout_err.stdout)
+    finally:
+        _remove_ecgpuwave_tmpfiles(rec_dir)
+
+    _throughput.update(
+        EcgpuwaveAttempt(
+            record,
+            from_time,
+            to_time,
+            n_samples,
+            timeout,
+            time.perf_counter() - start,
+            status,
+        )
+    )
+    return status
+
+
+async def _in_executor(fn, *args):
+    """
+    Runs a blocking function in the default executor of the running loop, in
+    the current context (so that e.g. configuration overrides apply).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, contextvars.copy_context().run, fn, *args)
+
+
+# A semaphore limiting concurrent ecgpuwave processes, per event loop
+_async_semaphores = weakref.WeakKeyDictionary()
+
+
+def _async_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _async_semaphores.get(loop)
+    if semaphore is None:
+        max_processes = pyhrv.conf.get_val("ecgpuwave.max_async_processes")
+        semaphore = asyncio.Semaphore(max_processes or os.cpu_count() or 1)
+        _async_semaphores[loop] = semaphore
+    return semaphore
+
+
+async def _async_ecgpuwave_run(
+    record: str,
+    out_ann_ext: str,
+    in_ann_ext: str = None,
+    channel: int = None,
+    from_time: str = None,
+    to_time: str = None,
+    timeout: float = None,
+) -> str:
+    """
+    Runs ecgpuwave as an asyncio subprocess, see :meth:`_ecgpuwave_run`.
+    The timeout doesn't include waiting for the semaphore.
+    """
+    record = str(record)
+    command, rec_dir, n_samples, timeout = await _in_executor(
+        _ecgpuwave_command,
+        record,
+        out_ann_ext,
+        in_ann_ext,
+        channel,
+        from_time,
+        to_time,
+        timeout,
+    )
+
+    async with _async_semaphore():
+        status = _RUN_OK
+        start = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            cwd=rec_dir,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            stdout, stderr = stdout.decode(), stderr.decode()
+            if proc.returncode != 0 or not _ecgpuwave_stderr_ok(stderr):
+                status = _RUN_ERROR
+                _warn_ecgpuwave_error(record, stdout, stderr)
+
+        except asyncio.TimeoutError:
+            status = _RUN_TIMEOUT
+            _warn_ecgpuwave_timeout(record, timeout, None)
+        finally:
+            # On timeout or cancellation
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            await _in_executor(_remove_ecgpuwave_tmpfiles, rec_dir)
+
+    wall_time = time.perf_counter() - start
+    profiling.record("qrs.ecgpuwave", wall_time, n_samples)
+    _throughput.update(
+        EcgpuwaveAttempt(
+            record, from_time, to_time, n_samples, timeout, wall_time, status
+        )
+    )
+    return status
+
+
+def _ecgpuwave_command(
+    record, out_ann_ext, in_ann_ext, channel, from_time, to_time, timeout
+):
+    """
+    :return: Tuple of the ecgpuwave command line, the directory to run it in,
+    the number of samples it will process, and the timeout.
+    """
     if not utils.is_record(record):
         raise ValueError(f"Can't find record {record}")
 
+    header = utils.rdheader(record)
+    try:
+        sampfrom, sampto = _sample_range(header, from_time, to_time)
+        n_samples = max(0, sampto - sampfrom)
+    except ValueError:
+        # Unsupported time format, let ecgpuwave handle it
+        n_samples = header.sig_len
+    if timeout is None:
+        timeout = _throughput.timeout(n_samples)
+
     rec_dir = os.path.dirname(record)
     rec_name = os.path.basename(record)
     ecgpuwave_rel_path = os.path.abspath(ECGPUWAVE_BIN)
@@ -142,52 +1302,39 @@ def ecgpuwave_wrapper(
     if to_time:
         ecgpuwave_command += ["-t", to_time]
 
-    try:
-        ecgpuwave_result = subprocess.run(
-            ecgpuwave_command,
-            check=True,
-            shell=False,
-            universal_newlines=True,
-            timeout=10,
-            cwd=rec_dir,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+    return ecgpuwave_command, rec_dir, n_samples, timeout
 
-        # ecgpuwave can sometimes fail but still return 0, so need to
-        # also check the stderr output.
-        if ecgpuwave_result.stderr:
-            # Annoying case: sometimes ecgpuwave writes to stderr but it's
-            # not an error...
-            if not re.match(
-                r"Rearranging annotations[\w\s.]+done!", ecgpuwave_result.stderr
-            ):
-                raise subprocess.CalledProcessError(0, ecgpuwave_command)
 
-    except subprocess.CalledProcessError as process_err:
-        warnings.warn(
-            f"Failed to run ecgpuwave on record "
-            f"{record}:\n"
-            f"stderr: {ecgpuwave_result.stderr}\n"
-            f"stdout: {ecgpuwave_result.stdout}\n"
-        )
-        return False
+def _ecgpuwave_stderr_ok(stderr: str) -> bool:
+    # Annoying case: sometimes ecgpuwave writes to stderr but it's
+    # not an error...
+    pattern = r"Rearranging annotations[\w\s.]+done!"
+    return not stderr or re.match(pattern, stderr) is not None
 
-    except subprocess.TimeoutExpired as timeout_err:
-        warnings.warn(
-            f"Timed-out runnning ecgpuwave on record "
-            f"{record}: "
-            f"{ecgpuwave_result.stdout}"
-        )
-        return False
-    finally:
-        # Remove tmp files created by ecgpuwave
-        for tmpfile in glob.glob(f"{rec_dir}/fort.*"):
-            try:
-                os.remove(tmpfile)
-            except FileNotFoundError:
-                # When running multiple ecgpuwave processes in parallel, it's
-                # possible file was already deleted by another process
-                pass
-
-    return True
+
+def _warn_ecgpuwave_error(record, stdout, stderr):
+    warnings.warn(
+        f"Failed to run ecgpuwave on record "
+        f"{record}:\n"
+        f"stderr: {stderr}\n"
+        f"stdout: {stdout}\n"
+    )
+
+
+def _warn_ecgpuwave_timeout(record, timeout, stdout):
+    warnings.warn(
+        f"Timed-out runnning ecgpuwave on record "
+        f"{record} after {timeout:.1f}s: "
+        f"{stdout}"
+    )
+
+
+def _remove_ecgpuwave_tmpfiles(rec_dir):
+    # Remove tmp files created by ecgpuwave
+    for tmpfile in glob.glob(f"{rec_dir}/fort.*"):
+        try:
+            os.remove(tmpfile)
+        except FileNotFoundError:
+            # When running multiple ecgpuwave processes in parallel, it's
+            # possible file was already deleted by another process
+            pass
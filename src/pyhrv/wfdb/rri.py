@@ -1,4 +1,5 @@
-import wfdb
+import asyncio
+import functools
 import numpy as np
 
 import pyhrv.wfdb.qrs as qrs
@@ -24,8 +25,9 @@ def ecgrr(
     heuristically estimated if missing.
     :param from_time: Start time. A string in the PhysioNet time format.
     :param to_time: End time. A string in the PhysioNet time format.
-    :param detector: A function to use for peak-detection. Will only be used if
-    the ann_ext parameter was not provided.
+    :param detector: A function to use for peak-detection, or the name of a
+    registered detector (see :meth:`pyhrv.wfdb.qrs.list_detectors`). Will only
+    be used if the ann_ext parameter was not provided.
     :param dtype: Desired dtype of output tensors.
     :return: Tuple of time axis and interval durations.
     """
@@ -39,11 +41,64 @@ def ecgrr(
         sample_idxs = ann[ann_type]
     else:
         # Calculate r-peaks using a peak-detector
+        detector = qrs.get_detector(detector)
         sample_idxs = detector(
             rec_path, channel=channel, from_time=from_time, to_time=to_time
         )
 
-    header = wfdb.rdheader(rec_path)
+    return _samples_to_rri(rec_path, sample_idxs, dtype)
+
+
+async def async_ecgrr(
+    rec_path,
+    ann_ext=None,
+    channel=None,
+    from_time=None,
+    to_time=None,
+    detector=qrs.async_ecgpuwave_detect_rec,
+    dtype=np.float32,
+):
+    """
+    An asyncio version of :meth:`ecgrr`.
+    :param rec_path: The path to the record (without any file extension).
+    :param ann_ext: Extension of annotation file to use, see :meth:`ecgrr`.
+    Annotations are read in the event loop's default executor, like the
+    record itself.
+    :param channel: Number of ECG channel in the record.
+    :param from_time: Start time. A string in the PhysioNet time format.
+    :param to_time: End time. A string in the PhysioNet time format.
+    :param detector: An async function to use for peak-detection, e.g.
+    :meth:`pyhrv.wfdb.qrs.async_ecgpuwave_detect_rec`. Other detectors (or
+    names of registered detectors) are run in the default executor. In any
+    case, configuration overrides of the caller apply.
+    :param dtype: Desired dtype of output tensors.
+    :return: Tuple of time axis and interval durations.
+    """
+    if ann_ext is not None or not asyncio.iscoroutinefunction(detector):
+        return await qrs._in_executor(
+            functools.partial(
+                ecgrr,
+                rec_path,
+                ann_ext=ann_ext,
+                channel=channel,
+                from_time=from_time,
+                to_time=to_time,
+                detector=detector,
+                dtype=dtype,
+            ),
+        )
+
+    if not await qrs._in_executor(utils.is_record, rec_path):
+        raise ValueError(f"Can't find record {rec_path}")
+
+    sample_idxs = await detector(
+        rec_path, channel=channel, from_time=from_time, to_time=to_time
+    )
+    return await qrs._in_executor(_samples_to_rri, rec_path, sample_idxs, dtype)
+
+
+def _samples_to_rri(rec_path, sample_idxs, dtype):
+    header = utils.rdheader(rec_path)
     fs = float(header.fs)
 
     start_time = sample_idxs[0] / fs
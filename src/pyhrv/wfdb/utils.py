@@ -1,65 +1,543 @@
+import os
 import re
 import sys
+import json
 import wfdb
-import numpy as np
+import hashlib
 import os.path
+import tempfile
+import warnings
+import threading
+import numpy as np
+from typing import NamedTuple
+from collections import OrderedDict
 
+import pyhrv.conf
+from pyhrv import profiling
 from pyhrv.wfdb.consts import *
 
 
-def rdann_by_type(
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else float("nan")
+
+
+class _HeaderCache(object):
+    """
+    A thread-safe LRU cache of parsed record headers. Entries are keyed on the
+    header file's path, modification time and size, so a modified header is
+    re-read.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = self._misses = 0
+
+    def get(self, rec_path: str):
+        hea_path = os.path.abspath(f"{rec_path}.hea")
+        st = os.stat(hea_path)
+        key = (hea_path, st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            header = self._entries.get(key)
+            if header is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return header
+            self._misses += 1
+
+        with profiling.stage("wfdb.rdheader"):
+            header = wfdb.rdheader(str(rec_path))
+
+        with self._lock:
+            self._entries[key] = header
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return header
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self.maxsize, len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._misses = 0
+
+
+_header_cache = _HeaderCache(HEADER_CACHE_MAXSIZE)
+
+
+def rdheader(rec_path: str):
+    """
+    Reads the header of a record, using a process-wide cache.
+    The returned object is shared between callers, and must not be modified.
+    :param rec_path: Record path (without extension).
+    :return: A wfdb Record (or MultiRecord) object containing the header
+    fields.
+    """
+    return _header_cache.get(rec_path)
+
+
+def header_cache_info() -> CacheInfo:
+    """
+    :return: Statistics of the header cache: number of hits and misses, the
+    maximal size and the current size.
+    """
+    return _header_cache.info()
+
+
+def header_cache_clear(maxsize: int = None):
+    """
+    Clears the header cache and resets its statistics.
+    :param maxsize: If provided, sets a new maximal number of cached headers.
+    """
+    if maxsize is not None:
+        _header_cache.maxsize = maxsize
+    _header_cache.clear()
+
+
+"""
+Data type of annotation arrays: sample index, symbol code (the ASCII code of
+the annotation symbol, or zero for multi-character symbols), subtype and
+channel.
+"""
+ANN_DTYPE = np.dtype(
+    [
+        ("sample", np.int64),
+        ("symbol", np.uint8),
+        ("subtype", np.int8),
+        ("chan", np.uint8),
+    ]
+)
+
+
+def rdann_array(
     rec_path: str,
     ann_ext: str,
     from_time: str = None,
     to_time: str = None,
-    types: str = WFDB_ANN_ALL_PEAK_TYPES,
-):
+    cache: bool = None,
+    cache_dir: str = None,
+) -> np.ndarray:
     """
-    Reads WFDB annotation file and returns annotations of specific types.
+    Reads a WFDB annotation file into a structured array.
+
+    Optionally, the decoded annotations can be cached in a sidecar file, which
+    is memory-mapped by subsequent calls instead of decoding the annotation
+    file again. The cache is validated against the annotation file's
+    modification time, size and hash.
+
     :param rec_path: Record path (without extension).
     :param ann_ext: extension of annotation file to load.
     :param from_time: Start time. A string in PhysioNet time format [1]_.
     :param to_time: End time.  A string in PhysioNet time format [1]_.
-    :param types: A string of chars of the annotation types to find (see [2]_).
-    :return: A dictionary, mapping from the annotation type (a
-    char) to a numpy array of indices in the signal.
+    :param cache: Whether to use the annotation cache. None means use the
+    ``pyhrv.ann_cache.enable`` configuration parameter.
+    :param cache_dir: Directory of the cache files. None means use the
+    ``pyhrv.ann_cache.cache_dir`` configuration parameter, and if that's
+    empty, the cache files are placed next to the annotation file.
+    :return: An array of dtype ANN_DTYPE, with one element per annotation.
+    When the cache is used, it's a read-only memory-mapped array.
 
     .. [1] https://www.physionet.org/physiotools/wag/intro.htm#time
-    .. [2] https://www.physionet.org/physiobank/annotations.shtml
     """
     if not is_record(rec_path, ann_ext=ann_ext):
         raise ValueError(f"Can't find record {rec_path}")
 
-    ann_to_idx = {ann_type: [] for ann_type in types}
-
     # In case it's a Path object; wfdb can't handle that
     rec_path = str(rec_path)
 
     # Handle from/to by converting to samples
     sampfrom, sampto = 0, sys.maxsize
     if from_time is not None or to_time is not None:
-        header = wfdb.rdheader(rec_path)
+        header = rdheader(rec_path)
         if from_time is not None:
             sampfrom = wfdb_time_to_samples(from_time, header.fs)
         if to_time is not None:
             sampto = wfdb_time_to_samples(to_time, header.fs)
+            if sampto < 0:
+                sampto = sys.maxsize
+
+    if cache is None:
+        cache = pyhrv.conf.get_val("pyhrv.ann_cache.enable")
 
-    # Read annotations
-    ann = wfdb.rdann(rec_path, ann_ext, sampfrom, sampto)
+    if cache:
+        if cache_dir is None:
+            cache_dir = pyhrv.conf.get_val("pyhrv.ann_cache.cache_dir")
+        ann_arr = _rdann_cached(rec_path, ann_ext, cache_dir)
+        if ann_arr is not None:
+            samples = ann_arr["sample"]
+            start = np.searchsorted(samples, sampfrom, side="left")
+            stop = np.searchsorted(samples, sampto, side="right")
+            return ann_arr[start:stop]
 
-    # Find annotations of requested type
-    annotations_pattern = re.compile(fr"[{types}]")
-    joined_ann = str.join("", ann.symbol)
-    matches = list(annotations_pattern.finditer(joined_ann))
+    return _rdann_decode(rec_path, ann_ext, sampfrom, sampto)
 
-    for i, m in enumerate(matches):
-        ann_type = m.group()
-        ann_idx = m.start()
 
-        # Save annotation sample
-        ann_to_idx[ann_type].append(ann.sample[ann_idx])
+def _rdann_decode(rec_path: str, ann_ext: str, sampfrom=0, sampto=None):
+    with profiling.stage("wfdb.rdann") as stage:
+        ann = wfdb.rdann(rec_path, ann_ext, sampfrom, sampto)
+
+        ann_arr = np.empty(len(ann.sample), dtype=ANN_DTYPE)
+        ann_arr["sample"] = ann.sample
+        ann_arr["subtype"] = ann.subtype
+        ann_arr["chan"] = ann.chan
+        ann_arr["symbol"] = symbols_to_codes(ann.symbol)
+        stage.size = len(ann_arr)
+    return ann_arr
+
+
+def _rdann_cached(rec_path: str, ann_ext: str, cache_dir: str = None):
+    """
+    Loads annotations from the sidecar cache, creating or updating it if
+    needed.
+    :return: A memory-mapped array of all annotations in the file, or None
+    if the cache can't be written.
+    """
+    ann_path = os.path.abspath(f"{rec_path}.{ann_ext}")
+    if cache_dir:
+        path_hash = hashlib.sha1(ann_path.encode()).hexdigest()[:16]
+        cache_path = os.path.join(
+            cache_dir, f"{os.path.basename(ann_path)}.{path_hash}.npy"
+        )
+    else:
+        cache_path = f"{ann_path}.npy"
+    meta_path = f"{cache_path}.json"
+
+    st = os.stat(ann_path)
+    meta = dict(mtime_ns=st.st_mtime_ns, size=st.st_size, dtype=str(ANN_DTYPE))
+
+    try:
+        with open(meta_path, "r") as f:
+            cached_meta = json.load(f)
+    except (OSError, ValueError):
+        cached_meta = {}
+
+    valid = os.path.isfile(cache_path) and all(
+        cached_meta.get(k) == meta[k] for k in ("size", "dtype")
+    )
+    if valid and cached_meta.get("mtime_ns") != meta["mtime_ns"]:
+        # File was touched or replaced by one of the same size: compare content
+        meta["sha1"] = _file_sha1(ann_path)
+        valid = cached_meta.get("sha1") == meta["sha1"]
 
-    return {ann_type: np.array(idxs) for (ann_type, idxs) in ann_to_idx.items()}
+    try:
+        if not valid:
+            meta["sha1"] = _file_sha1(ann_path)
+            ann_arr = _rdann_decode(rec_path, ann_ext)
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            _write_atomic(cache_path, lambda f: np.save(f, ann_arr), mode="wb")
+        meta.setdefault("sha1", cached_meta.get("sha1"))
+        if meta != cached_meta:
+            _write_atomic(meta_path, lambda f: json.dump(meta, f))
+    except OSError as e:
+        warnings.warn(f"Failed to write annotation cache {cache_path}: {e}")
+        return None
+
+    return np.load(cache_path, mmap_mode="r")
+
+
+def _file_sha1(path: str):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2 ** 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _write_atomic(path: str, write_fn, mode="w"):
+    # Write to a temp file and rename it, so that concurrent readers never see
+    # a partially written file.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write_fn(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def symbols_to_codes(symbols) -> np.ndarray:
+    """
+    Converts annotation symbols to symbol codes.
+    :param symbols: A sequence of annotation symbols (strings).
+    :return: An array of uint8 containing the ASCII code of each symbol, or
+    zero for multi-character symbols.
+    """
+    joined = str.join("", symbols)
+    if len(joined) == len(symbols):
+        return np.frombuffer(joined.encode("latin-1"), dtype=np.uint8).copy()
+
+    symbols = np.array(symbols, dtype=str)
+    single = np.char.str_len(symbols) == 1
+    codes = np.zeros(len(symbols), dtype=np.uint8)
+    codes[single] = np.frombuffer(
+        str.join("", symbols[single]).encode("latin-1"), dtype=np.uint8
+    )
+    return codes
+
+
+def ann_samples_by_type(ann_arr: np.ndarray, types: str = WFDB_ANN_ALL_PEAK_TYPES):
+    """
+    Selects the samples of annotations of specific types.
+    :param ann_arr: An array of dtype ANN_DTYPE, see :meth:`rdann_array`.
+    :param types: A string of chars of the annotation types to find.
+    :return: A dictionary, mapping from the annotation type (a
+    char) to a numpy array of indices in the signal.
+    """
+    type_codes = symbols_to_codes(list(types))
+    symbols, samples = ann_arr["symbol"], ann_arr["sample"]
+
+    # Keep only annotations of the requested types, then split them by type
+    lut = np.zeros(256, dtype=bool)
+    lut[type_codes] = True
+    selected = lut[symbols]
+    symbols, samples = symbols[selected], samples[selected]
+
+    return {
+        ann_type: samples[symbols == code] for ann_type, code in zip(types, type_codes)
+    }
+
+
+def rdann_by_type(
+    rec_path: str,
+    ann_ext: str,
+    from_time: str = None,
+    to_time: str = None,
+    types: str = WFDB_ANN_ALL_PEAK_TYPES,
+    cache: bool = None,
+    cache_dir: str = None,
+):
+    """
+    Reads WFDB annotation file and returns annotations of specific types.
+    :param rec_path: Record path (without extension).
+    :param ann_ext: extension of annotation file to load.
+    :param from_time: Start time. A string in PhysioNet time format [1]_.
+    :param to_time: End time.  A string in PhysioNet time format [1]_.
+    :param types: A string of chars of the annotation types to find (see [2]_).
+    :param cache: Whether to use the annotation cache, see :meth:`rdann_array`.
+    :param cache_dir: Directory of the cache files, see :meth:`rdann_array`.
+    :return: A dictionary, mapping from the annotation type (a
+    char) to a numpy array of indices in the signal.
+
+    .. [1] https://www.physionet.org/physiotools/wag/intro.htm#time
+    .. [2] https://www.physionet.org/physiobank/annotations.shtml
+    """
+    ann_arr = rdann_array(rec_path, ann_ext, from_time, to_time, cache, cache_dir)
+    return ann_samples_by_type(ann_arr, types)
+
+
+# Value of invalid (missing) samples, per storage format
+_INVALID_SAMPLE = {"16": -(2 ** 15), "212": -(2 ** 11)}
+
+
+class SignalBlock(NamedTuple):
+    # Range of samples this block is responsible for
+    core_start: int
+    core_end: int
+    # Index of the first sample of sig in the record
+    start: int
+    # Physical signal, including the overlap around the core range
+    sig: np.ndarray
+
+    @property
+    def end(self):
+        return self.start + len(self.sig)
+
+
+def rdsignal(rec_path: str, channel: int = 0, sampfrom: int = 0, sampto: int = None):
+    """
+    Reads a range of samples of a single channel of a record.
+
+    For single-segment records stored in format 16 or 212, the data file is
+    memory-mapped and only the requested samples are decoded, so that the
+    cost doesn't depend on the record's length or number of channels.
+    Other records are read with :meth:`wfdb.rdrecord`.
+
+    :param rec_path: Path to record without extension.
+    :param channel: Index of the channel to read.
+    :param sampfrom: Index of the first sample to read.
+    :param sampto: Index of the sample after the last one to read. None means
+    the end of the record.
+    :return: The physical signal, as a float64 array. Invalid samples are NaN.
+    """
+    rec_path = str(rec_path)
+    header = rdheader(rec_path)
+    if sampto is None or sampto > header.sig_len:
+        sampto = header.sig_len
+
+    with profiling.stage("wfdb.rdsignal", max(0, sampto - sampfrom)):
+        digital = _rdsignal_mmap(rec_path, header, channel, sampfrom, sampto)
+        if digital is None:
+            record = wfdb.rdrecord(
+                rec_path, sampfrom=sampfrom, sampto=sampto, channels=[channel]
+            )
+            return record.p_signal[:, 0]
+
+        fmt = header.fmt[channel]
+        sig = (digital - header.baseline[channel]) / float(header.adc_gain[channel])
+        sig[digital == _INVALID_SAMPLE[fmt]] = np.nan
+    return sig
+
+
+def iter_signal_blocks(
+    rec_path: str,
+    channel: int = 0,
+    sampfrom: int = 0,
+    sampto: int = None,
+    block_len: int = 2 ** 20,
+    overlap_len: int = 0,
+):
+    """
+    Reads a single channel of a record in consecutive blocks, so that
+    only one block is in memory at a time.
+    :param rec_path: Path to record without extension.
+    :param channel: Index of the channel to read.
+    :param sampfrom: Index of the first sample to read.
+    :param sampto: Index of the sample after the last one to read. None means
+    the end of the record.
+    :param block_len: Number of samples in each block (not including overlap).
+    :param overlap_len: Number of samples by which to extend each block on
+    both sides (within the requested range).
+    :return: A generator of :class:`SignalBlock`.
+    """
+    if block_len < 1:
+        raise ValueError("Block length must be at least one sample")
+
+    header = rdheader(rec_path)
+    if sampto is None or sampto < 0 or sampto > header.sig_len:
+        sampto = header.sig_len
+
+    for core_start in range(sampfrom, sampto, block_len):
+        core_end = min(core_start + block_len, sampto)
+        start = max(sampfrom, core_start - overlap_len)
+        end = min(sampto, core_end + overlap_len)
+        sig = rdsignal(rec_path, channel, start, end)
+        yield SignalBlock(core_start, core_end, start, sig)
+
+
+def _rdsignal_mmap(rec_path, header, channel, sampfrom, sampto):
+    # Reads digital samples of one channel by memory-mapping the data file.
+    # Returns None if the record's storage isn't supported.
+    if isinstance(header, wfdb.MultiRecord) or not header.file_name:
+        return None
+
+    file_name, fmt = header.file_name[channel], header.fmt[channel]
+    file_chans = [i for i, f in enumerate(header.file_name) if f == file_name]
+    if (
+        fmt not in _INVALID_SAMPLE
+        or any(header.fmt[i] != fmt for i in file_chans)
+        or any((header.samps_per_frame[i] or 1) != 1 for i in file_chans)
+        or any(header.skew[i] for i in file_chans)
+    ):
+        return None
+
+    dat_path = os.path.join(os.path.dirname(rec_path), file_name)
+    byte_offset = header.byte_offset[file_chans[0]] or 0
+    try:
+        n_bytes = os.path.getsize(dat_path) - byte_offset
+    except OSError:
+        return None
+
+    n_chans, chan_idx = len(file_chans), file_chans.index(channel)
+    n = sampto - sampfrom
+    digital = np.full(n, _INVALID_SAMPLE[fmt], dtype=np.int64)
+    if n <= 0 or n_bytes <= 0:
+        return digital
+
+    if fmt == "16":
+        n_frames = min(n_bytes // (2 * n_chans), sampto)
+        if n_frames > sampfrom:
+            mm = np.memmap(
+                dat_path,
+                dtype="<i2",
+                mode="r",
+                offset=byte_offset,
+                shape=(n_frames, n_chans),
+            )
+            digital[: n_frames - sampfrom] = mm[sampfrom:n_frames, chan_idx]
+            del mm
+        return digital
+
+    # Format 212: pairs of 12-bit samples (interleaved over channels) are
+    # packed into three bytes. Decode whole pairs around the requested range.
+    flat_from = (sampfrom * n_chans) // 2 * 2
+    flat_to = -(-(sampto * n_chans) // 2) * 2
+    flat_to = min(flat_to, n_bytes // 3 * 2)
+    if flat_to > flat_from:
+        mm = np.memmap(dat_path, dtype=np.uint8, mode="r", offset=byte_offset)
+        triplets = mm[flat_from // 2 * 3 : flat_to // 2 * 3].reshape(-1, 3)
+        triplets = triplets.astype(np.int32)
+        del mm
+
+        flat = np.empty(2 * len(triplets), dtype=np.int32)
+        flat[0::2] = triplets[:, 0] | ((triplets[:, 1] & 0x0F) << 8)
+        flat[1::2] = triplets[:, 2] | ((triplets[:, 1] & 0xF0) << 4)
+        flat[flat > 2047] -= 4096
+
+        # Index in flat of the channel's samples, starting from sampfrom
+        first = sampfrom * n_chans + chan_idx - flat_from
+        chan_samples = flat[first::n_chans][:n]
+        digital[: len(chan_samples)] = chan_samples
+    return digital
+
+
+class DetectionStats(NamedTuple):
+    tp: int
+    fn: int
+    fp: int
+
+    @property
+    def sensitivity(self):
+        return self.tp / (self.tp + self.fn) if self.tp + self.fn else float("nan")
+
+    @property
+    def ppv(self):
+        return self.tp / (self.tp + self.fp) if self.tp + self.fp else float("nan")
+
+
+def match_detections(ref_samples, test_samples, tol):
+    """
+    Compares detections (e.g. of R-peaks) to reference annotations.
+    A reference sample and a detected sample match if each is the nearest one
+    to the other and they're at most tol samples apart.
+    :param ref_samples: Sorted array of reference sample indices.
+    :param test_samples: Sorted array of detected sample indices.
+    :param tol: Maximal distance, in samples, between matching samples.
+    :return: A DetectionStats object with the number of true positives,
+    false negatives and false positives.
+    """
+    ref = np.asarray(ref_samples, dtype=np.int64)
+    test = np.asarray(test_samples, dtype=np.int64)
+    if len(ref) == 0 or len(test) == 0:
+        return DetectionStats(0, len(ref), len(test))
+
+    def nearest(a, b):
+        # Index of the element of a which is nearest to each element of b
+        j = np.clip(np.searchsorted(a, b), 1, max(1, len(a) - 1))
+        j_prev = j - 1
+        j = np.minimum(j, len(a) - 1)
+        return np.where(np.abs(a[j] - b) < np.abs(a[j_prev] - b), j, j_prev)
+
+    ref_of_test = nearest(ref, test)
+    test_of_ref = nearest(test, ref)
+    matched = (test_of_ref[ref_of_test] == np.arange(len(test))) & (
+        np.abs(ref[ref_of_test] - test) <= tol
+    )
+
+    tp = int(np.count_nonzero(matched))
+    return DetectionStats(tp, len(ref) - tp, len(test) - tp)
 
 
 def find_ecg_channel(rec_path):
@@ -69,8 +547,8 @@ def find_ecg_channel(rec_path):
     :return: The index of the first ECG channel.
     """
     pattern = re.compile(ECG_CHANNEL_PATTERN, re.IGNORECASE)
-    header = wfdb.rdheader(rec_path)
-    for i, name in enumerate(header.sig_name):
+    header = rdheader(rec_path)
+    for i, name in enumerate(header.sig_name or []):
         if pattern.match(name):
             return i
     return None
@@ -91,6 +569,7 @@ def is_record(rec_path: str, dat_ext: str = "dat", ann_ext: str = None):
     :return: True if the given rec_path corresponds to a PhysioNet record
     with matching header file, data file and annotation files. If the data
     is not present but atleast one annotation exists, it's still a record.
+    Multi-segment records (which have no data file) are also records.
 
     .. [1] https://www.physionet.org/physiotools/wag/intro.htm
     """
@@ -103,6 +582,10 @@ def is_record(rec_path: str, dat_ext: str = "dat", ann_ext: str = None):
     if ann_ext and os.path.isfile(f"{rec_path}.{ann_ext}"):
         return True
 
+    # Multi-segment records have no data file of their own
+    if dat_ext:
+        return isinstance(rdheader(rec_path), wfdb.MultiRecord)
+
     return False
 
 
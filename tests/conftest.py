@@ -0,0 +1,114 @@
+import json
+import pathlib
+
+import pytest
+
+# Timings and peak memory of the benchmarks in test_benchmarks.py, to compare
+# against. The timings are only comparable on the machine they were recorded on,
+# so regenerate the baseline there (e.g. in the CI job that runs the comparison)
+# before relying on --benchmark-regression, with:
+#   pytest tests/test_benchmarks.py --benchmark-save-baseline
+# The saved baseline contains only the stats of each benchmark, without the raw
+# timings and without machine or commit info.
+BENCHMARK_BASELINE_PATH = pathlib.Path(__file__).parent.joinpath(
+    "resources", "benchmark_baseline.json"
+)
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark-regression",
+        type=int,
+        default=None,
+        metavar="PCT",
+        help="Run only the benchmarks, and fail if the median time or peak "
+        "memory of any of them is more than PCT percent higher than in the "
+        "stored baseline.",
+    )
+    parser.addoption(
+        "--benchmark-save-baseline",
+        action="store_true",
+        help="Run only the benchmarks, and save their results as the stored "
+        "baseline.",
+    )
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    if not config.pluginmanager.hasplugin("benchmark"):
+        return
+
+    option = config.option
+    regression_pct = option.benchmark_regression
+    if option.benchmark_save_baseline:
+        option.benchmark_only = True
+        option.benchmark_json = BENCHMARK_BASELINE_PATH
+    elif regression_pct is not None:
+        from pytest_benchmark.utils import parse_compare_fail
+
+        option.benchmark_only = True
+        option.benchmark_compare = str(BENCHMARK_BASELINE_PATH)
+        option.benchmark_compare_fail = [
+            parse_compare_fail(f"median:{regression_pct}%")
+        ]
+    elif not (
+        option.benchmark_only
+        or option.benchmark_enable
+        or option.benchmark_json
+        or option.benchmark_save
+        or option.benchmark_autosave
+        or option.benchmark_compare
+    ):
+        # In regular test runs, call each benchmarked function only once
+        option.benchmark_disable = True
+
+
+def pytest_benchmark_update_machine_info(config, machine_info):
+    if config.getoption("benchmark_regression") is not None:
+        # The baseline has no machine info (see below), don't warn about it
+        machine_info.clear()
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    if not config.getoption("benchmark_save_baseline"):
+        return
+
+    output_json["machine_info"] = {}
+    for key in ("commit_info", "datetime"):
+        output_json.pop(key, None)
+    for bench in output_json["benchmarks"]:
+        bench["stats"].pop("data", None)
+
+
+@pytest.fixture
+def peak_mem_regression(request):
+    """
+    Returns a function which saves the peak memory of each profiled stage
+    (see :func:`pyhrv.profiling.profile`) in the extra info of a benchmark.
+    With --benchmark-regression, it also fails the test if the peak memory
+    of any stage grew by more than the given percentage.
+    """
+    regression_pct = request.config.getoption("benchmark_regression")
+
+    def check(benchmark, stats, min_bytes=2 ** 16):
+        peaks = {stage: s.peak_mem for stage, s in stats.get().items()}
+        benchmark.extra_info["peak_mem"] = peaks
+        if regression_pct is None:
+            return
+
+        with open(BENCHMARK_BASELINE_PATH, "r") as f:
+            baseline = {b["fullname"]: b for b in json.load(f)["benchmarks"]}
+        base_peaks = baseline.get(request.node.nodeid, {}).get("extra_info", {})
+        base_peaks = base_peaks.get("peak_mem", {})
+
+        regressions = [
+            f"{stage}: {peak} > {base_peaks[stage]} bytes"
+            for stage, peak in peaks.items()
+            if stage in base_peaks
+            # Ignore small absolute differences, e.g. of temporary objects
+            and peak > max(base_peaks[stage] * (1 + regression_pct / 100), min_bytes)
+        ]
+        if regressions:
+            pytest.fail(f"Peak memory has regressed: {', '.join(regressions)}")
+
+    return check
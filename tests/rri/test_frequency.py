@@ -1,6 +1,7 @@
 import pytest
 
 import math
+import numpy as np
 import scipy.signal as sps
 import matplotlib.pyplot as plt
 
@@ -62,6 +63,96 @@ class TestPxxLomb(object):
         # plt.plot(f_axis, pxx_lomb)
         # plt.show()
 
-        # Check location of highest peak
-        peaks_idx, _ = sps.find_peaks(pxx_lomb, height=0.1)
-        assert f_axis[peaks_idx[0]] == pytest.approx(0.168299, rel=1e-5)
+        # Check location of the first peak in the HF band (respiration). The
+        # PSD is in s^2/Hz.
+        peaks_idx, _ = sps.find_peaks(pxx_lomb, height=0.05)
+        hf_peaks_idx = peaks_idx[f_axis[peaks_idx] >= 0.15]
+        assert f_axis[hf_peaks_idx[0]] == pytest.approx(0.168299, rel=1e-5)
+        assert pxx_lomb[hf_peaks_idx[0]] == pytest.approx(0.0726, rel=1e-2)
+
+    def test_windows(self):
+        t_win = 330
+        f_axis, _ = frequency.build_uniform_freq_axis(t_win, 1 / t_win, 0.4)
+        pxx = frequency.pxx_lomb(self.rri, f_axis, self.trr, t_win)
+
+        pxx_wins = _pxx_windows(self.trr, self.rri, f_axis, t_win)
+        assert np.allclose(pxx, np.mean(pxx_wins, axis=0))
+
+    def test_gap(self):
+        t_win = 300
+        f_axis, _ = frequency.build_uniform_freq_axis(t_win, 1 / t_win, 0.4)
+        # No intervals in the third window
+        gap_idx = (self.trr >= 500) & (self.trr < 1000)
+        trr, rri = self.trr[~gap_idx], self.rri[~gap_idx]
+
+        pxx = frequency.pxx_lomb(rri, f_axis, trr, t_win)
+        assert np.all(np.isfinite(pxx)) and np.all(pxx >= 0)
+
+        # Averaged over the other windows
+        pxx_wins = _pxx_windows(trr, rri, f_axis, t_win)
+        assert len(pxx_wins) == math.floor(trr[-1] / t_win) - 1
+        assert np.allclose(pxx, np.mean(pxx_wins, axis=0))
+
+    @pytest.mark.parametrize("win_func", [sps.windows.hamming, None])
+    @pytest.mark.parametrize("t_win", [300, None])
+    def test_sinusoid_power(self, win_func, t_win):
+        # Intervals modulated by a sinusoid, at the times of the beats
+        amp, f0 = 0.05, 0.1
+        trr = [0.0]
+        while trr[-1] < 1800:
+            trr.append(trr[-1] + 0.8 + amp * math.sin(2 * math.pi * f0 * trr[-1]))
+        trr = np.array(trr[1:])
+        rri = np.diff(trr, prepend=0.0)
+
+        t = t_win or math.floor(trr[-1] - trr[0])
+        f_axis, _ = frequency.build_uniform_freq_axis(t, 1 / t, 0.4)
+        pxx = frequency.pxx_lomb(rri, f_axis, trr, t_win, win_func=win_func)
+
+        # The spectrum integrates to the power of the sinusoid
+        df = f_axis[1] - f_axis[0]
+        assert np.sum(pxx) * df == pytest.approx(amp ** 2 / 2, rel=0.02)
+        assert f_axis[np.argmax(pxx)] == pytest.approx(f0, abs=df)
+
+    @pytest.mark.parametrize("n_jobs", [2, 7, None])
+    def test_n_jobs(self, n_jobs):
+        f_axis, _ = frequency.build_uniform_freq_axis(300, 1 / 300, 0.4)
+        for t_win in [300, None]:
+            pxx = frequency.pxx_lomb(self.rri, f_axis, self.trr, t_win)
+            pxx_threads = frequency.pxx_lomb(
+                self.rri, f_axis, self.trr, t_win, n_jobs=n_jobs
+            )
+            assert np.array_equal(pxx, pxx_threads)
+
+
+def _pxx_windows(trr, rri, f_axis, t_win):
+    # The periodograms of each window's tapered intervals
+    pxx_wins = []
+    for i in range(math.floor(trr[-1] / t_win)):
+        win_idx = (trr >= t_win * i) & (trr < t_win * (i + 1))
+        trr_win, rri_win = trr[win_idx], rri[win_idx]
+        if len(rri_win) < 2:
+            continue
+        win = sps.windows.hamming(len(rri_win))
+        pxx_win = sps.lombscargle(
+            trr_win, (rri_win - np.mean(rri_win)) * win, 2 * math.pi * f_axis
+        )
+        pxx_wins.append(pxx_win * 2 * t_win / (len(rri_win) * np.mean(win ** 2)))
+    return pxx_wins
+
+
+class TestPxxWelch(object):
+    @pytest.mark.parametrize("nperseg", [256, 257])
+    def test_same_as_scipy(self, nperseg):
+        x = np.random.default_rng(0).standard_normal(5000)
+        window = sps.windows.hamming(nperseg)
+        f, pxx = frequency.pxx_welch(x, 2.0, window, nperseg // 3, workers=2)
+
+        f_sps, pxx_sps = sps.welch(
+            x, fs=2.0, window=window, noverlap=nperseg // 3, detrend="constant"
+        )
+        assert np.allclose(f, f_sps)
+        assert np.allclose(pxx, pxx_sps, rtol=1e-12)
+
+    def test_too_short(self):
+        with pytest.raises(ValueError):
+            frequency.pxx_welch(np.ones(100), 2.0, sps.windows.hamming(101))
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+import numpy as np
+
+import pyhrv.batch as batch
+
+from .wfdb import TEST_RESOURCES_PATH
+
+RESOURCES_PATH = TEST_RESOURCES_PATH.joinpath("wfdb")
+
+
+def _crash_on_101(rec_path):
+    if rec_path.endswith("101"):
+        os._exit(1)
+    return rec_path
+
+
+def _unpicklable_on_101(rec_path):
+    if rec_path.endswith("101"):
+        return lambda: None
+    return rec_path
+
+
+class TestBatch(object):
+    @pytest.mark.parametrize("n_jobs", [1, 2])
+    def test_ecgrr_many(self, n_jobs):
+        rec_paths = [RESOURCES_PATH / "100", RESOURCES_PATH / "101"]
+        results = list(
+            batch.ecgrr_many(
+                rec_paths, n_jobs=n_jobs, progress=False, ann_ext="atr", to_time="05:00"
+            )
+        )
+
+        assert sorted(r.rec_path for r in results) == [str(p) for p in rec_paths]
+        for r in results:
+            assert r.ok
+            assert r.wall_time > 0
+            trr, rr = r.result
+            assert len(trr) == len(rr) > 300
+            assert np.all(trr <= 5 * 60)
+
+    def test_errors_captured(self):
+        rec_paths = [RESOURCES_PATH / "100", RESOURCES_PATH / "no_such_record"]
+        results = {
+            r.rec_path: r
+            for r in batch.ecgrr_many(
+                rec_paths, n_jobs=2, chunksize=1, progress=False, ann_ext="atr"
+            )
+        }
+
+        assert results[str(RESOURCES_PATH / "100")].ok
+        failed = results[str(RESOURCES_PATH / "no_such_record")]
+        assert not failed.ok
+        assert failed.result is None
+        assert "ValueError" in failed.error
+
+    def test_directory(self):
+        results = list(
+            batch.ecgrr_many(RESOURCES_PATH, n_jobs=1, progress=False, ann_ext="atr")
+        )
+        names = sorted(os.path.basename(r.rec_path) for r in results)
+        assert names == ["100", "101"]
+
+    def test_hrv_many(self):
+        results = list(
+            batch.hrv_many(
+                [RESOURCES_PATH / "100"],
+                progress=False,
+                ann_ext="atr",
+                to_time="05:00",
+            )
+        )
+        assert len(results) == 1 and results[0].ok
+        metrics = results[0].result
+        assert 700 < metrics["AVNN"] < 900
+        assert metrics["SDNN"] > 0
+        assert metrics["lomb.LF_POWER"] > 0
+
+    @pytest.mark.parametrize("chunksize", [1, 3])
+    def test_broken_worker(self, chunksize):
+        names = ["100", "101", "foo"] + [f"rec{i}" for i in range(8)]
+        rec_paths = [str(RESOURCES_PATH / name) for name in names]
+        results = list(
+            batch.map_records(
+                _crash_on_101, rec_paths, n_jobs=2, chunksize=chunksize, progress=False
+            )
+        )
+
+        # Only the record which crashes the worker fails
+        assert sorted(r.rec_path for r in results) == sorted(rec_paths)
+        (failed,) = [r for r in results if not r.ok]
+        assert failed.rec_path == str(RESOURCES_PATH / "101")
+        assert "BrokenProcessPool" in failed.error
+        assert all(r.result == r.rec_path for r in results if r.ok)
+
+    def test_chunk_error(self):
+        rec_paths = [str(RESOURCES_PATH / name) for name in ["100", "101", "foo"]]
+        results = list(
+            batch.map_records(
+                _unpicklable_on_101, rec_paths, n_jobs=2, chunksize=2, progress=False
+            )
+        )
+
+        assert sorted(r.rec_path for r in results) == sorted(rec_paths)
+        (failed,) = [r for r in results if not r.ok]
+        assert failed.rec_path == str(RESOURCES_PATH / "101")
+        assert "pickle" in failed.error.lower()
@@ -0,0 +1,100 @@
+"""
+Benchmarks of the hot paths, on fixed inputs. The time of each function is
+benchmarked, and then the peak memory of each of its stages is measured with
+a single traced call. In regular test runs each benchmarked function is only
+called once. Use ``--benchmark-regression=PCT`` to compare against the stored
+baseline, see conftest.py.
+"""
+import pytest
+
+import numpy as np
+
+import pyhrv.hrv as hrv
+import pyhrv.conf as conf
+import pyhrv.profiling as profiling
+import pyhrv.generator as generator
+import pyhrv.wfdb.rri as wfdb_rri
+import pyhrv.rri.frequency as frequency
+import pyhrv.rri.processing as processing
+
+from .wfdb import TEST_RESOURCES_PATH
+
+pytest.importorskip("pytest_benchmark")
+
+REC_PATH = str(TEST_RESOURCES_PATH.joinpath("wfdb", "100"))
+T_WIN = 5 * 60
+
+
+@pytest.fixture(scope="module")
+def rr_1h():
+    return generator.generate_rr(3600, seed=0)
+
+
+def _profile_memory(fn, *args, **kw):
+    with profiling.profile(memory=True) as stats:
+        with profiling.stage("total"):
+            fn(*args, **kw)
+    return stats
+
+
+@pytest.mark.benchmark(group="hrv_freq")
+@pytest.mark.parametrize("method", ["lomb", "welch"])
+def test_hrv_freq(benchmark, peak_mem_regression, rr_1h, method):
+    trr, rri = rr_1h
+    pxx, f_axis = benchmark(hrv.hrv_freq, rri, trr, methods=[method])
+    assert len(pxx[method]) > 0 and np.all(np.isfinite(pxx[method]))
+
+    stats = _profile_memory(hrv.hrv_freq, rri, trr, methods=[method])
+    peak_mem_regression(benchmark, stats)
+
+
+@pytest.mark.benchmark(group="pxx_lomb")
+def test_pxx_lomb(benchmark, peak_mem_regression, rr_1h):
+    trr, rri = rr_1h
+    f_axis, _ = frequency.build_uniform_freq_axis(
+        T_WIN,
+        conf.get_val("hrv_freq.vlf_band")[0],
+        conf.get_val("hrv_freq.hf_band")[1],
+        conf.get_val("hrv_freq.resample_factor"),
+    )
+    pxx = benchmark(frequency.pxx_lomb, rri, f_axis, trr, T_WIN)
+    assert np.all(np.isfinite(pxx))
+
+    stats = _profile_memory(frequency.pxx_lomb, rri, f_axis, trr, T_WIN)
+    peak_mem_regression(benchmark, stats)
+
+
+@pytest.mark.benchmark(group="filtrr")
+def test_filtrr(benchmark, peak_mem_regression, rr_1h):
+    trr, rri = rr_1h
+    trr_f, rri_f = benchmark(processing.filtrr, trr, rri)
+    assert 0 < len(rri_f) <= len(rri)
+
+    peak_mem_regression(benchmark, _profile_memory(processing.filtrr, trr, rri))
+
+
+@pytest.mark.benchmark(group="splitrr")
+def test_splitrr(benchmark, peak_mem_regression, rr_1h):
+    _, rri = rr_1h
+    windows = benchmark(processing.splitrr, rri, T_WIN)
+    assert windows.shape[0] == 3600 // T_WIN - 1
+
+    peak_mem_regression(benchmark, _profile_memory(processing.splitrr, rri, T_WIN))
+
+
+@pytest.mark.benchmark(group="ecgrr")
+def test_ecgrr_ann(benchmark, peak_mem_regression):
+    trr, rri = benchmark(wfdb_rri.ecgrr, REC_PATH, ann_ext="atr")
+    assert len(rri) > 2000
+
+    stats = _profile_memory(wfdb_rri.ecgrr, REC_PATH, ann_ext="atr")
+    peak_mem_regression(benchmark, stats)
+
+
+@pytest.mark.benchmark(group="ecgrr")
+def test_ecgrr_rqrs(benchmark, peak_mem_regression):
+    kw = dict(detector="rqrs", to_time="05:00")
+    trr, rri = benchmark(wfdb_rri.ecgrr, REC_PATH, **kw)
+    assert len(rri) > 300
+
+    peak_mem_regression(benchmark, _profile_memory(wfdb_rri.ecgrr, REC_PATH, **kw))
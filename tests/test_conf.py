@@ -0,0 +1,181 @@
+import sys
+import asyncio
+import threading
+import subprocess
+
+import pytest
+
+import numpy as np
+
+import pyhrv.conf as conf
+import pyhrv.hrv as hrv
+import pyhrv.batch as batch
+
+
+@pytest.fixture
+def isolated_conf(monkeypatch):
+    # Restore the configuration state after the test
+    monkeypatch.setattr(conf, "_config_files", list(conf._config_files))
+    monkeypatch.setattr(conf, "_config", None)
+    monkeypatch.setattr(conf, "_snapshot", None)
+
+
+def _get_pnn_thresh(rec_path):
+    return conf.get_val("hrv_time.pnn_thresh_ms")
+
+
+@pytest.fixture
+def override_file(tmp_path):
+    path = tmp_path / "override.yaml"
+    path.write_text("hrv_time:\n    pnn_thresh_ms:\n        value: 20\n")
+    return str(path)
+
+
+class TestConf(object):
+    def test_get_val(self):
+        assert conf.get_val("filtrr.range.rr_min") == 0.3
+        assert conf.get_val("hrv_freq.methods") == ["lomb", "ar", "welch"]
+        assert conf.get_desc("hrv_time.pnn_thresh_ms") == "Threshold value for PNNx"
+        with pytest.raises(KeyError):
+            conf.get_val("no.such.param")
+
+    def test_get_vals(self):
+        vals = conf.get_vals("filtrr.range")
+        assert vals == {
+            "filtrr.range.enable": True,
+            "filtrr.range.rr_max": 1.5,
+            "filtrr.range.rr_min": 0.3,
+        }
+        assert conf.get_vals("filtrr.range.rr_min") == {"filtrr.range.rr_min": 0.3}
+        assert conf.get_vals("filtr") == {}
+
+    def test_snapshot_immutable(self):
+        with pytest.raises(TypeError):
+            conf._get_snapshot().values["filtrr.range.rr_min"] = 1.0
+
+        # Values are returned as new lists, as in the YAML file
+        methods = conf.get_val("hrv_freq.methods")
+        methods.append("fft")
+        assert conf.get_val("hrv_freq.methods") == ["lomb", "ar", "welch"]
+
+    def test_load_after_import(self, isolated_conf, override_file):
+        assert conf.get_val("hrv_time.pnn_thresh_ms") == 50
+        assert "pNN50" in hrv.hrv_time(np.array([0.8, 0.9, 0.8]))
+
+        conf.load(override_file)
+        assert conf.get_val("hrv_time.pnn_thresh_ms") == 20
+        assert conf.get_desc("hrv_time.pnn_thresh_ms") == "Threshold value for PNNx"
+        assert "pNN20" in hrv.hrv_time(np.array([0.8, 0.9, 0.8]))
+
+        conf.load_default()
+        assert conf.get_val("hrv_time.pnn_thresh_ms") == 50
+
+    def test_read_file(self, override_file):
+        assert conf.read_file(override_file) == {"hrv_time.pnn_thresh_ms": 20}
+        assert conf.get_val("hrv_time.pnn_thresh_ms") == 50
+
+        values = conf.read_file(conf.CONFIG_DEFAULT_FILENAME)
+        assert values["hrv_freq.lf_band"] == [0.04, 0.15]
+        assert values["filtrr.range.rr_min"] == 0.3
+
+    def test_resolve_params(self):
+        @conf.resolve_params
+        def fn(
+            a, b=conf.param("filtrr.range.rr_min"), *, c=conf.param("hrv_freq.ar_order")
+        ):
+            return a, b, c
+
+        assert fn(1) == (1, 0.3, 24)
+        assert fn(1, 2) == (1, 2, 24)
+        assert fn(1, b=None, c=3) == (1, None, 3)
+        assert fn(1, b=conf.param("filtrr.range.rr_max")) == (1, 1.5, 24)
+
+    def test_resolve_params_async(self):
+        @conf.resolve_params
+        async def fn(a, b=conf.param("filtrr.range.rr_min")):
+            return a, b
+
+        assert asyncio.iscoroutinefunction(fn)
+        assert asyncio.run(fn(1)) == (1, 0.3)
+        with conf.override("filtrr.range", rr_min=0.2):
+            assert asyncio.run(fn(1)) == (1, 0.2)
+
+    def test_import_is_lazy(self):
+        code = "import sys, pyhrv; sys.exit('confuse' in sys.modules)"
+        assert subprocess.run([sys.executable, "-c", code], check=False).returncode == 0
+
+
+class TestOverride(object):
+    def test_override(self):
+        with conf.override("filtrr.range", rr_min=0.2, rr_max=2):
+            assert conf.get_val("filtrr.range.rr_min") == 0.2
+            assert conf.get_vals("filtrr.range")["filtrr.range.rr_max"] == 2
+            assert conf.get_desc("filtrr.range.rr_min")
+
+            with conf.override(**{"filtrr.range.rr_min": 0.1}):
+                assert conf.get_val("filtrr.range.rr_min") == 0.1
+                assert conf.get_val("filtrr.range.rr_max") == 2
+            assert conf.get_val("filtrr.range.rr_min") == 0.2
+
+        assert conf.get_val("filtrr.range.rr_min") == 0.3
+        assert conf.get_overrides() == {}
+
+    def test_override_resolve_params(self):
+        rri = np.array([0.8, 0.9, 0.8])
+        with conf.override("hrv_time", pnn_thresh_ms=20):
+            assert "pNN20" in hrv.hrv_time(rri)
+            assert "pNN10" in hrv.hrv_time(rri, pnn_thresh_ms=10)
+            with conf.override("hrv_freq", lf_band=[0.05, 0.15]):
+                assert conf.get_val("hrv_freq.lf_band") == [0.05, 0.15]
+        assert "pNN50" in hrv.hrv_time(rri)
+
+    def test_override_unknown(self):
+        with pytest.raises(KeyError):
+            with conf.override("hrv_time", no_such_param=1):
+                pass
+
+    def test_override_cached(self, isolated_conf, override_file):
+        with conf.override("filtrr.range", rr_min=0.2):
+            snapshot = conf._get_snapshot()
+            assert conf._get_snapshot() is snapshot
+
+            # Loading a file applies beneath the overrides
+            conf.load(override_file)
+            assert conf._get_snapshot() is not snapshot
+            assert conf.get_val("hrv_time.pnn_thresh_ms") == 20
+            assert conf.get_val("filtrr.range.rr_min") == 0.2
+
+    def test_override_threads(self):
+        barrier = threading.Barrier(4)
+        results = {}
+
+        def worker(thresh):
+            with conf.override("hrv_time", pnn_thresh_ms=thresh):
+                barrier.wait()
+                results[thresh] = conf.get_val("hrv_time.pnn_thresh_ms")
+
+        threads = [threading.Thread(target=worker, args=(t,)) for t in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == {t: t for t in range(4)}
+
+    def test_override_asyncio(self):
+        async def task(thresh):
+            with conf.override("hrv_time", pnn_thresh_ms=thresh):
+                await asyncio.sleep(0.01)
+                return conf.get_val("hrv_time.pnn_thresh_ms")
+
+        async def main():
+            return await asyncio.gather(*[task(t) for t in range(4)])
+
+        assert asyncio.run(main()) == list(range(4))
+
+    @pytest.mark.parametrize("n_jobs", [1, 2])
+    def test_override_batch(self, n_jobs):
+        with conf.override("hrv_time", pnn_thresh_ms=20):
+            results = batch.map_records(
+                _get_pnn_thresh, ["a", "b"], n_jobs=n_jobs, progress=False
+            )
+            assert [r.result for r in results] == [20, 20]
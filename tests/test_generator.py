@@ -0,0 +1,94 @@
+import pytest
+
+import numpy as np
+
+import pyhrv.generator as generator
+import pyhrv.wfdb.qrs as qrs
+import pyhrv.wfdb.rri as rri
+import pyhrv.wfdb.utils as wfdb_utils
+
+
+@pytest.fixture(scope="module")
+def beats():
+    return generator.generate_beats(
+        3600, ectopic_rate=0.01, artifact_rate=0.005, gap_rate=2, seed=1
+    )
+
+
+class TestGenerateBeats(object):
+    def test_deterministic(self):
+        beats1 = generator.generate_beats(600, ectopic_rate=0.05, seed=3)
+        beats2 = generator.generate_beats(600, ectopic_rate=0.05, seed=3)
+        beats3 = generator.generate_beats(600, ectopic_rate=0.05, seed=4)
+        assert np.array_equal(beats1.time, beats2.time)
+        assert np.array_equal(beats1.symbol, beats2.symbol)
+        assert not np.array_equal(beats1.time[:10], beats3.time[:10])
+
+    def test_rr(self):
+        trr, rr = generator.generate_rr(3600, mean_rr=0.9, sdnn=0.04, seed=0)
+        assert np.all(np.diff(trr) > 0)
+        assert trr[-1] < 3600
+        assert np.mean(rr) == pytest.approx(0.9, rel=0.02)
+        assert np.std(rr) == pytest.approx(0.04, rel=0.2)
+        assert np.allclose(trr[1:], trr[:-1] + rr[:-1])
+
+    @pytest.mark.parametrize("lf_hf_ratio", [0.5, 4])
+    def test_spectrum(self, lf_hf_ratio):
+        trr, rr = generator.generate_rr(3600, lf_hf_ratio=lf_hf_ratio, seed=0)
+        t = np.arange(trr[0], trr[-1], 0.25)
+        x = np.interp(t, trr, rr)
+        pxx = np.abs(np.fft.rfft(x - np.mean(x))) ** 2
+        f = np.fft.rfftfreq(len(x), 0.25)
+        lf = np.sum(pxx[(f >= 0.04) & (f < 0.15)])
+        hf = np.sum(pxx[(f >= 0.15) & (f < 0.4)])
+        assert (lf > hf) == (lf_hf_ratio > 1)
+
+    def test_ectopic_artifacts_gaps(self, beats):
+        n = len(beats.time)
+        assert np.all(np.diff(beats.time) > 0)
+        assert np.sum(beats.symbol == "V") == pytest.approx(0.01 * n, rel=0.5)
+        assert np.sum(beats.symbol == "|") == pytest.approx(0.005 * n, rel=0.5)
+        assert beats.gaps.shape[1] == 2
+        for start, end in beats.gaps:
+            assert not np.any((beats.time >= start) & (beats.time < end))
+
+        # Ectopic beats are premature
+        rr = np.diff(beats.time[beats.symbol != "|"])
+        is_v = beats.symbol[beats.symbol != "|"][1:] == "V"
+        assert np.mean(rr[is_v]) < 0.8 * np.mean(rr[~is_v])
+
+    def test_short(self):
+        assert len(generator.generate_beats(0.1).time) == 0
+        trr, rr = generator.generate_rr(1.0, artifact_rate=1.0)
+        assert len(trr) == len(rr)
+
+
+class TestWriteRecord(object):
+    def test_write_record(self, beats, tmp_path):
+        rec_path = generator.write_record(tmp_path / "sub" / "syn", beats, fs=250)
+        header = wfdb_utils.rdheader(rec_path)
+        assert header.fs == 250
+        assert header.sig_len == 3600 * 250
+
+        sig = wfdb_utils.rdsignal(rec_path)
+        expected = generator.generate_ecg(beats, fs=250)
+        assert np.array_equal(np.isnan(sig), np.isnan(expected))
+        assert np.nanmax(np.abs(sig - expected)) <= 0.5 / 200
+
+        # Annotations
+        trr, rr = rri.ecgrr(rec_path, ann_ext="atr", dtype=np.float64)
+        samples = np.round(beats.time[beats.symbol == "N"] * 250)
+        assert np.allclose(rr, np.diff(samples) / 250)
+
+        # Detection finds real beats, not artifacts
+        ref = np.round(beats.time[beats.symbol != "|"] * 250).astype(np.int64)
+        stats = wfdb_utils.match_detections(ref, qrs.rqrs_detect_rec(rec_path), 12)
+        assert stats.sensitivity > 0.99
+        assert stats.ppv > 0.99
+
+    def test_write_header_only(self, beats, tmp_path):
+        rec_path = generator.write_record(tmp_path / "syn", beats, signal=False)
+        assert wfdb_utils.is_record(rec_path, ann_ext="atr")
+        assert not (tmp_path / "syn.dat").exists()
+        trr, rr = rri.ecgrr(rec_path, ann_ext="atr")
+        assert len(rr) == np.sum(beats.symbol == "N") - 1
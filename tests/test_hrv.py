@@ -0,0 +1,83 @@
+import pytest
+
+import numpy as np
+
+import pyhrv.conf
+import pyhrv.hrv as hrv
+import pyhrv.generator as generator
+
+
+class TestHRVTime(object):
+    def test_constant(self):
+        metrics = hrv.hrv_time(np.full(100, 0.8))
+        assert metrics["AVNN"] == pytest.approx(800)
+        assert metrics["SDNN"] == pytest.approx(0)
+        assert metrics["RMSSD"] == pytest.approx(0)
+        assert metrics["pNN50"] == 0
+
+    def test_alternating(self):
+        rri = np.tile([0.8, 0.9], 50)
+        metrics = hrv.hrv_time(rri, pnn_thresh_ms=20)
+        assert metrics["AVNN"] == pytest.approx(850)
+        assert metrics["RMSSD"] == pytest.approx(100)
+        assert metrics["pNN20"] == pytest.approx(100)
+
+
+class TestHRVFreq(object):
+    def test_band_powers(self):
+        trr, rri = generator.generate_rr(1800, lf_hf_ratio=2.0, seed=0)
+        pxx, f_axis = hrv.hrv_freq(rri, trr, methods=["lomb", "welch"])
+        assert all(len(pxx[m]) == len(f_axis) for m in ["lomb", "welch"])
+
+        powers = hrv.band_powers(pxx, f_axis, extra_bands=[(0.09, 0.11)])
+        for metrics in powers.values():
+            band_sum = sum(metrics[f"{b}_POWER"] for b in ["VLF", "LF", "HF"])
+            assert 0 < band_sum <= metrics["TOTAL_POWER"]
+            assert metrics["LF_NORM"] + metrics["HF_NORM"] < 100
+            assert metrics["LF_TO_HF"] > 1
+            assert 0 < metrics["0.09-0.11Hz_POWER"] < metrics["LF_POWER"]
+
+        powers = hrv.band_powers(pxx, f_axis, norm_method="lf_hf")
+        for metrics in powers.values():
+            assert metrics["LF_NORM"] + metrics["HF_NORM"] == pytest.approx(100)
+
+    def test_norm_method(self):
+        trr, rri = generator.generate_rr(600, seed=0)
+        pxx, f_axis = hrv.hrv_freq(rri, trr, methods=["welch"], norm_method="lf_hf")
+        with pyhrv.conf.override("hrv_freq", norm_method="lf_hf"):
+            pxx_conf, _ = hrv.hrv_freq(rri, trr, methods=["welch"])
+            metrics = hrv.band_powers(pxx_conf, f_axis)["welch"]
+        assert np.array_equal(pxx["welch"], pxx_conf["welch"])
+        assert metrics["LF_NORM"] + metrics["HF_NORM"] == pytest.approx(100)
+
+        with pytest.raises(ValueError, match="norm_method"):
+            hrv.hrv_freq(rri, trr, norm_method="lf_af")
+
+    def test_n_jobs(self):
+        trr, rri = generator.generate_rr(3600, seed=0)
+        kw = dict(methods=["lomb", "welch"], window_minutes=5)
+        pxx, f_axis = hrv.hrv_freq(rri, trr, n_jobs=1, **kw)
+        pxx_threads, _ = hrv.hrv_freq(rri, trr, n_jobs=4, **kw)
+        assert list(pxx_threads) == ["lomb", "welch"]
+        for method in pxx:
+            assert np.array_equal(pxx[method], pxx_threads[method])
+
+    def test_beta(self):
+        f_axis = np.linspace(0.001, 0.5, 500)
+        rng = np.random.default_rng(0)
+        spectra = f_axis ** -np.arange(0.5, 2.5, 0.5)[:, None]
+        spectra *= rng.uniform(0.5, 1.5, size=spectra.shape)
+        spectra[-1, 10] = 0
+
+        betas = hrv.beta({"welch": spectra, "lomb": spectra[0]}, f_axis)
+        idx = (f_axis >= 0.003) & (f_axis < 0.04)
+        for spectrum, beta in zip(spectra[:-1], betas["welch"]):
+            slope, _ = np.polyfit(np.log10(f_axis[idx]), np.log10(spectrum[idx]), 1)
+            assert beta == pytest.approx(slope)
+        assert np.isnan(betas["welch"][-1])
+        assert betas["lomb"] == pytest.approx(betas["welch"][0])
+
+        betas = hrv.beta({"welch": f_axis ** -1.0}, f_axis, beta_band=(0.1, 0.2))
+        assert betas["welch"] == pytest.approx(-1.0)
+        with pytest.raises(ValueError):
+            hrv.beta({"welch": spectra}, f_axis, beta_band=(0.1, 0.1005))
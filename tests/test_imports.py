@@ -0,0 +1,65 @@
+import sys
+import subprocess
+
+import pytest
+
+import pyhrv
+
+# Dependencies which must only be imported when something that needs them is
+# used, not by importing pyhrv or computing time-domain metrics.
+HEAVY_MODULES = ("scipy", "wfdb", "pandas", "matplotlib", "confuse", "yaml", "tqdm")
+
+
+def _importtime(stmt: str) -> dict:
+    """
+    Runs a statement in a fresh interpreter with ``-X importtime``.
+    :return: A dict mapping each imported module to its cumulative import
+    time, in microseconds.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", stmt],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            continue  # The header line
+    return times
+
+
+class TestLazyImports(object):
+    @pytest.mark.parametrize(
+        "stmt",
+        [
+            "import pyhrv",
+            "import pyhrv; pyhrv.__version__",
+            "import pyhrv.hrv",
+            "import pyhrv.rri.processing",
+            "import pyhrv.wfdb",
+        ],
+    )
+    def test_no_heavy_imports(self, stmt):
+        imported = {name.split(".")[0] for name in _importtime(stmt)}
+        assert not imported.intersection(HEAVY_MODULES)
+
+    def test_import_time(self):
+        times = _importtime("import pyhrv.hrv")
+        # Most of the time is numpy's; this only catches gross regressions,
+        # e.g. a heavy module-level import (scipy alone takes longer).
+        assert times["pyhrv"] + times["pyhrv.hrv"] < 1e6
+        print(f"import pyhrv.hrv: {times['pyhrv.hrv'] / 1e3:.1f}ms")
+
+    def test_submodule_access(self):
+        assert pyhrv.wfdb.qrs.rqrs_detect_rec
+        assert pyhrv.rri.frequency.pxx_lomb
+        assert "wfdb" in dir(pyhrv)
+        assert isinstance(pyhrv.__version__, str)
+        with pytest.raises(AttributeError):
+            pyhrv.foo
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import pyhrv.main as main
+
+from .wfdb import TEST_RESOURCES_PATH
+
+RESOURCES_PATH = TEST_RESOURCES_PATH.joinpath("wfdb")
+
+
+class TestMain(object):
+    def test_find_records(self):
+        rec_100 = str(RESOURCES_PATH / "100")
+        rec_101 = str(RESOURCES_PATH / "101")
+        assert main.find_records([rec_100, f"{rec_100}.hea"]) == [rec_100]
+        assert sorted(main.find_records([RESOURCES_PATH], ann_ext="atr")) == [
+            rec_100,
+            rec_101,
+        ]
+        assert main.find_records([str(RESOURCES_PATH / "10*.hea"), rec_100]) == [
+            rec_100,
+            rec_101,
+        ]
+
+    def test_hrv_record_rows(self):
+        rec_path = RESOURCES_PATH / "100"
+        rows = main.hrv_record_rows(rec_path, ann_ext="atr", methods=["welch"])
+        assert len(rows) == 1
+        assert rows[0]["n_rr"] > 2000
+        assert rows[0]["AVNN"] > 0
+        assert rows[0]["welch.LF_POWER"] > 0
+        assert rows[0]["welch.BETA"] < 0
+        assert "lomb.LF_POWER" not in rows[0]
+
+        rows = main.hrv_record_rows(
+            rec_path, ann_ext="atr", to_time="15:00", window_minutes=5, methods=()
+        )
+        assert [row["window"] for row in rows] == [0, 1]
+        assert [row["t_start"] for row in rows] == [0, 300]
+        assert all("SDNN" in row and "welch.LF_POWER" not in row for row in rows)
+
+    @pytest.mark.parametrize("n_jobs", [1, 2])
+    def test_main(self, tmp_path, n_jobs):
+        config_path = tmp_path / "config.yaml"
+        config_path.write_text("hrv_time:\n    pnn_thresh_ms:\n        value: 20\n")
+        out_path = tmp_path / "out.jsonl"
+
+        args = [str(RESOURCES_PATH), str(RESOURCES_PATH / "no_such_record")]
+        args += ["-a", "atr", "--to-time", "11:00", "-w", "5", "-m", "welch"]
+        args += ["-j", str(n_jobs), "-c", str(config_path), "-o", str(out_path)]
+        assert main.main(args) == 1
+
+        with open(out_path, "r") as f:
+            rows = [json.loads(line) for line in f]
+        errors = [row for row in rows if "error" in row]
+        rows = [row for row in rows if "error" not in row]
+        assert len(errors) == 1 and "no_such_record" in errors[0]["rec_path"]
+        assert len(rows) == 2 * 2
+        assert all("pNN20" in row and "welch.HF_POWER" in row for row in rows)
+        assert all("welch.BETA" in row for row in rows)
@@ -0,0 +1,149 @@
+import pytest
+
+import numpy as np
+
+import pyhrv.hrv as hrv
+import pyhrv.profiling as profiling
+import pyhrv.wfdb.qrs as qrs
+import pyhrv.wfdb.utils as wfdb_utils
+import pyhrv.rri.processing as processing
+
+from .wfdb import TEST_RESOURCES_PATH
+
+REC_PATH = str(TEST_RESOURCES_PATH.joinpath("wfdb", "100"))
+
+
+@pytest.fixture
+def rri():
+    rng = np.random.RandomState(42)
+    return 0.8 + 0.05 * rng.randn(600)
+
+
+class TestProfiling(object):
+    def test_disabled(self, rri):
+        assert not profiling.is_enabled()
+        assert profiling.stage("foo") is profiling._NULL_STAGE
+        with profiling.stage("foo") as stage:
+            stage.size = 1
+        hrv.hrv_time(rri)
+        assert len(profiling.get_stats()) == 0
+
+    def test_profile_pipeline(self, rri):
+        wfdb_utils.header_cache_clear()
+        with profiling.profile() as stats:
+            assert profiling.is_enabled()
+            wfdb_utils.rdann_array(REC_PATH, "atr", cache=False)
+            sig = wfdb_utils.rdsignal(REC_PATH, sampto=3600)
+            qrs.rqrs_detect_sig(sig, 360)
+            trr = np.cumsum(rri)
+            processing.filtrr(trr, rri)
+            hrv.hrv_time(rri)
+            pxx, f_axis = hrv.hrv_freq(rri, trr, methods=("welch",))
+            hrv.band_powers(pxx, f_axis)
+            hrv.beta(pxx, f_axis)
+        assert not profiling.is_enabled()
+
+        assert list(stats) == [
+            "filtrr",
+            "hrv_freq.band_powers",
+            "hrv_freq.beta",
+            "hrv_freq.resample",
+            "hrv_freq.welch",
+            "hrv_time",
+            "qrs.rqrs",
+            "wfdb.rdann",
+            "wfdb.rdheader",
+            "wfdb.rdsignal",
+        ]
+        assert stats["wfdb.rdheader"].calls == 1
+        assert stats["wfdb.rdann"].total_size == 2274
+        assert stats["wfdb.rdsignal"].total_size == 3600
+        assert stats["qrs.rqrs"].total_size == 3600
+        assert stats["hrv_time"].total_size == len(rri)
+        assert stats["hrv_freq.band_powers"].total_size == len(f_axis)
+        assert list(stats.get("hrv_freq")) == [
+            "hrv_freq.band_powers",
+            "hrv_freq.beta",
+            "hrv_freq.resample",
+            "hrv_freq.welch",
+        ]
+        assert all(
+            s.total_time >= s.max_time >= s.min_time >= 0 for s in stats.get().values()
+        )
+        assert "qrs.rqrs" in stats.summary()
+
+    def test_nested(self, rri):
+        with profiling.profile() as outer:
+            hrv.hrv_time(rri)
+            with profiling.profile() as inner:
+                hrv.hrv_time(rri)
+        assert outer["hrv_time"].calls == 2
+        assert inner["hrv_time"].calls == 1
+
+    def test_enable(self, rri):
+        stats = profiling.get_stats()
+        profiling.enable()
+        try:
+            hrv.hrv_time(rri)
+        finally:
+            profiling.disable()
+        hrv.hrv_time(rri)
+
+        assert stats["hrv_time"].calls == 1
+        stats.reset()
+        assert len(stats) == 0
+
+    def test_sink(self, rri):
+        calls = []
+
+        def sink(stage, wall_time, size):
+            calls.append((stage, size))
+
+        def bad_sink(*args):
+            raise RuntimeError("sink failed")
+
+        profiling.add_sink(sink)
+        profiling.add_sink(bad_sink)
+        try:
+            assert profiling.is_enabled()
+            hrv.hrv_time(rri)
+        finally:
+            profiling.remove_sink(sink)
+            profiling.remove_sink(bad_sink)
+
+        assert calls == [("hrv_time", len(rri))]
+        assert not profiling.is_enabled()
+
+
+class TestProfileMemory(object):
+    def test_memory(self):
+        with profiling.profile(memory=True) as stats:
+            with profiling.stage("outer"):
+                with profiling.stage("temp"):
+                    np.ones(2 ** 20)  # 8MB, freed
+                with profiling.stage("kept"):
+                    kept = np.ones(2 ** 18)  # 2MB
+                del kept
+
+        assert stats["temp"].peak_mem >= 8 * 2 ** 20
+        assert abs(stats["temp"].net_mem) < 2 ** 16
+        assert stats["kept"].net_mem >= 2 * 2 ** 20
+        assert stats["outer"].peak_mem >= stats["temp"].peak_mem
+        assert abs(stats["outer"].net_mem) < 2 ** 16
+        assert "peak [MB]" in stats.summary()
+
+    def test_no_memory(self, rri):
+        with profiling.profile() as stats:
+            hrv.hrv_time(rri)
+        assert stats["hrv_time"].peak_mem == -1
+
+    def test_profile_pipeline(self):
+        results = profiling.profile_pipeline([600, 1200], methods=["welch"])
+        assert list(results) == [600, 1200]
+        for stage in ["filtrr", "splitrr", "hrv_time", "hrv_freq.welch"]:
+            assert results[600][stage].peak_mem > 0
+            assert results[1200][stage].total_size > results[600][stage].total_size
+        stages = ["hrv_freq.resample", "hrv_freq.band_powers", "hrv_freq.beta"]
+        assert all(stage in results[600] for stage in stages)
+        table = profiling.format_pipeline_stats(results)
+        assert all(stage in table for stage in stages)
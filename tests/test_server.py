@@ -0,0 +1,87 @@
+import sys
+import asyncio
+import subprocess
+
+import pytest
+
+import pyhrv.server as server
+import pyhrv.generator as generator
+
+from .wfdb import TEST_RESOURCES_PATH
+
+REC_PATH = str(TEST_RESOURCES_PATH.joinpath("wfdb", "100"))
+
+
+def _run_with_server(requests, **start_kw):
+    async def _run():
+        hrv_server = server.HRVServer(n_jobs=1, max_concurrent=1)
+        await hrv_server.start(**start_kw)
+        try:
+            address = hrv_server.address
+            if isinstance(address, str):
+                kw = dict(path=address)
+            else:
+                kw = dict(host=address[0], port=address[1])
+
+            loop = asyncio.get_running_loop()
+            return await asyncio.gather(
+                *(
+                    loop.run_in_executor(None, lambda r=r: server.request(r, **kw))
+                    for r in requests
+                )
+            )
+        finally:
+            await hrv_server.close()
+
+    return asyncio.run(_run())
+
+
+class TestServer(object):
+    @pytest.mark.parametrize("unix_socket", [False, True])
+    def test_requests(self, tmp_path, unix_socket):
+        trr, rr = generator.generate_rr(1200, seed=0)
+        requests = [
+            dict(id=1, rec_path=REC_PATH, ann_ext="atr", to_time="05:00"),
+            dict(id=2, rr=rr.tolist(), window_minutes=5, methods=["welch"]),
+            dict(id=3, rr=rr.tolist(), trr=(trr + 60).tolist(), filter=False),
+        ]
+        start_kw = dict(path=tmp_path / "pyhrv.sock") if unix_socket else {}
+        responses = _run_with_server(requests, **start_kw)
+
+        assert [r["id"] for r in responses] == [1, 2, 3]
+        assert all(r["ok"] for r in responses)
+        for r in responses:
+            timing = r["timing"]
+            assert 0 < timing["worker"] < timing["total"]
+            assert timing["queue"] < timing["total"]
+
+        assert responses[0]["result"][0]["rec_path"] == REC_PATH
+        assert responses[0]["result"][0]["n_rr"] > 300
+        assert [row["window"] for row in responses[1]["result"]] == [0, 1, 2]
+        assert "welch.LF_POWER" in responses[1]["result"][0]
+        assert responses[2]["result"][0]["t_start"] == pytest.approx(trr[0] + 60)
+        assert responses[2]["result"][0]["n_rr"] == len(rr)
+        if unix_socket:
+            assert not (tmp_path / "pyhrv.sock").exists()
+
+    def test_errors(self):
+        requests = [
+            dict(id="a", rr=[0.8, 0.9], foo=1),
+            dict(id="b", rr=[0.8, 0.9], rec_path=REC_PATH),
+            dict(id="c", rec_path=REC_PATH + "_no_such_record"),
+            dict(id="d", rr=[0.8, 0.9, 0.8], filter=False),
+        ]
+        responses = _run_with_server(requests)
+
+        assert [r["ok"] for r in responses] == [False, False, False, True]
+        assert "foo" in responses[0]["error"]
+        assert "either rec_path or rr" in responses[1]["error"]
+        assert "Can't find record" in responses[2]["error"]
+        assert all(r["timing"]["worker"] is None for r in responses[:3])
+
+    def test_cli_requires_address(self):
+        proc = subprocess.run(
+            [sys.executable, "-m", "pyhrv.main", "serve"], capture_output=True
+        )
+        assert proc.returncode != 0
+        assert b"--socket or --port" in proc.stderr
@@ -0,0 +1,105 @@
+import functools
+
+import pytest
+
+import numpy as np
+
+import pyhrv.conf
+import pyhrv.store as store
+import pyhrv.batch as batch
+import pyhrv.wfdb.rri as rri
+import pyhrv.rri.processing as processing
+
+from .wfdb import TEST_RESOURCES_PATH
+
+REC_PATH = TEST_RESOURCES_PATH.joinpath("wfdb", "100")
+ECGRR_KW = dict(ann_ext="atr", to_time="05:00")
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    # Counts the calls to each stage of the pipeline
+    calls = dict(ecgrr=0, filtrr=0)
+
+    def counting(name, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kw):
+            calls[name] += 1
+            return fn(*args, **kw)
+
+        return wrapper
+
+    monkeypatch.setattr(rri, "ecgrr", counting("ecgrr", rri.ecgrr))
+    monkeypatch.setattr(processing, "filtrr", counting("filtrr", processing.filtrr))
+    return calls
+
+
+class TestResultsStore(object):
+    def test_put_get(self, tmp_path):
+        results = store.ResultsStore(tmp_path)
+        assert "abc" not in results
+        assert results.get("abc") is None
+
+        results.put("abc", "rr", "rec", dict(foo=1), trr=np.arange(3), rr=np.ones(3))
+        assert "abc" in results
+        stored = results.get("abc")
+        assert np.array_equal(stored["trr"], np.arange(3))
+        assert np.array_equal(stored["rr"], np.ones(3))
+
+        index = store.ResultsStore(tmp_path).index()
+        assert index["abc"]["stage"] == "rr"
+        assert index["abc"]["params"] == dict(foo=1)
+
+    def test_resume(self, tmp_path, calls):
+        metrics = store.hrv_record(REC_PATH, tmp_path, **ECGRR_KW)
+        assert calls == dict(ecgrr=1, filtrr=1)
+        assert len(store.ResultsStore(tmp_path).index()) == 3
+
+        assert store.hrv_record(REC_PATH, tmp_path, **ECGRR_KW) == metrics
+        assert calls == dict(ecgrr=1, filtrr=1)
+
+    def test_invalidation(self, tmp_path, calls, monkeypatch):
+        store.hrv_record(REC_PATH, tmp_path, **ECGRR_KW)
+
+        # Changing a filtering parameter only invalidates filtering and HRV
+        params = store.filtrr_params()
+        params["filtrr.range.rr_min"] = 0.5
+        monkeypatch.setattr(store, "filtrr_params", lambda: params)
+        store.hrv_record(REC_PATH, tmp_path, **ECGRR_KW)
+        assert calls == dict(ecgrr=1, filtrr=2)
+
+        # Changing an ecgrr parameter invalidates everything
+        store.hrv_record(REC_PATH, tmp_path, ann_ext="atr", to_time="04:00")
+        assert calls == dict(ecgrr=2, filtrr=3)
+
+        # HRV parameters don't affect the intervals
+        monkeypatch.setattr(store, "hrv_params", lambda: {"hrv_time.pnn_thresh_ms": 20})
+        metrics = store.hrv_record(REC_PATH, tmp_path, **ECGRR_KW)
+        assert calls == dict(ecgrr=2, filtrr=3)
+        assert "pNN20" in metrics
+
+    def test_unused_filtrr_params(self, tmp_path, calls):
+        store.hrv_record(REC_PATH, tmp_path, **ECGRR_KW)
+
+        # The quotient filter isn't implemented
+        with pyhrv.conf.override("filtrr.quotient", rr_max_change=50):
+            store.hrv_record(REC_PATH, tmp_path, **ECGRR_KW)
+        assert calls == dict(ecgrr=1, filtrr=1)
+
+        # Parameters of a disabled filter don't matter
+        with pyhrv.conf.override("filtrr.moving_average", enable=False):
+            metrics = store.hrv_record(REC_PATH, tmp_path, **ECGRR_KW)
+            assert calls == dict(ecgrr=1, filtrr=2)
+            with pyhrv.conf.override("filtrr.moving_average", win_samples=5):
+                assert store.hrv_record(REC_PATH, tmp_path, **ECGRR_KW) == metrics
+        assert calls == dict(ecgrr=1, filtrr=2)
+        assert len(store.ResultsStore(tmp_path).index()) == 5
+
+    def test_hrv_many(self, tmp_path):
+        kw = dict(n_jobs=1, progress=False, store_dir=tmp_path, **ECGRR_KW)
+        results = list(batch.hrv_many([REC_PATH], **kw))
+        assert results[0].ok
+
+        rerun = list(batch.hrv_many([REC_PATH], **kw))
+        assert rerun[0].result == results[0].result
+        assert len(store.ResultsStore(tmp_path).index()) == 3
@@ -0,0 +1,78 @@
+import pytest
+
+import pyhrv.wfdb.qrs as qrs
+import pyhrv.wfdb.rri as rri
+import pyhrv.wfdb.benchmark as benchmark
+
+from . import TEST_RESOURCES_PATH
+
+RESOURCES_PATH = TEST_RESOURCES_PATH.joinpath("wfdb")
+
+
+class TestDetectorRegistry(object):
+    def test_builtin_detectors(self):
+        detectors = qrs.list_detectors()
+        for name in ["ecgpuwave", "rqrs", "gqrs", "xqrs"]:
+            assert name in detectors
+        assert qrs.get_detector("rqrs") is qrs.rqrs_detect_rec
+        assert qrs.get_detector("ecgpuwave") is qrs.ecgpuwave_detect_rec
+
+    def test_callable_passthrough(self):
+        assert qrs.get_detector(qrs.rqrs_detect_rec) is qrs.rqrs_detect_rec
+
+    def test_unknown_detector(self):
+        with pytest.raises(ValueError):
+            qrs.get_detector("no_such_detector")
+
+    def test_register(self):
+        @qrs.register_detector("test_detector")
+        def detector(rec_path, channel=None, from_time=None, to_time=None):
+            return qrs.rqrs_detect_rec(rec_path, channel, from_time, to_time)
+
+        try:
+            t, rr = rri.ecgrr(RESOURCES_PATH / "100", detector="test_detector")
+            assert len(t) == len(rr) > 0
+        finally:
+            del qrs._DETECTORS["test_detector"]
+
+
+class TestBenchmark(object):
+    def test_find_records(self):
+        rec_paths = benchmark.find_records(RESOURCES_PATH, ann_ext="atr")
+        assert [p.split("/")[-1] for p in rec_paths] == ["100", "101"]
+
+    def test_benchmark_detectors(self):
+        detectors = ["rqrs", "xqrs"]
+        results = benchmark.benchmark_detectors(
+            RESOURCES_PATH, detectors=detectors, to_time="01:00"
+        )
+        assert len(results) == 2 * len(detectors)
+        for r in results:
+            assert r.error is None
+            assert r.n_samples == 60 * 360
+            assert r.wall_time > 0
+            assert r.peak_mem > 0
+            assert r.sensitivity > 0.98
+
+        summary = benchmark.summarize(results)
+        assert list(summary.keys()) == detectors
+        assert summary["rqrs"]["n_records"] == 2
+        assert benchmark.fastest_detector(summary, 0.98, 0.98) in detectors
+        assert benchmark.fastest_detector(summary, 1.01, 1.01) is None
+        assert "rqrs" in benchmark.format_summary(summary)
+
+    def test_detector_errors_are_captured(self):
+        @qrs.register_detector("failing_detector")
+        def detector(rec_path, **kw):
+            raise RuntimeError("failed")
+
+        try:
+            results = benchmark.benchmark_detectors(
+                RESOURCES_PATH, detectors=["failing_detector"], measure_memory=False
+            )
+        finally:
+            del qrs._DETECTORS["failing_detector"]
+
+        assert len(results) == 2
+        assert all("failed" in r.error for r in results)
+        assert benchmark.summarize(results)["failing_detector"]["n_errors"] == 2
@@ -0,0 +1,107 @@
+import os
+import shutil
+
+import pytest
+
+from pyhrv.wfdb.catalog import INDEX_FILENAME, RecordCatalog
+
+from . import TEST_RESOURCES_PATH
+
+RESOURCES_PATH = TEST_RESOURCES_PATH.joinpath("wfdb")
+
+
+@pytest.fixture
+def db_dir(tmp_path):
+    # Database tree with a nested directory, built from the test resources
+    for name in ["100.hea", "100.atr", "foo.hea", "foo.bar"]:
+        shutil.copy(RESOURCES_PATH / name, tmp_path / name)
+    os.symlink(RESOURCES_PATH / "100.dat", tmp_path / "100.dat")
+
+    sub_dir = tmp_path / "sub"
+    sub_dir.mkdir()
+    for name in ["101.hea", "101.atr"]:
+        shutil.copy(RESOURCES_PATH / name, sub_dir / name)
+    os.symlink(RESOURCES_PATH / "101.dat", sub_dir / "101.dat")
+
+    # Not records
+    (tmp_path / "README").write_text("not a record")
+    (tmp_path / "100.atr.npy").write_bytes(b"")
+    return tmp_path
+
+
+class TestRecordCatalog(object):
+    @pytest.mark.parametrize("n_jobs", [1, 2])
+    def test_build(self, db_dir, n_jobs):
+        catalog = RecordCatalog.build(db_dir, n_jobs=n_jobs)
+        assert [r.name for r in catalog] == ["100", "foo", os.path.join("sub", "101")]
+
+        rec = catalog["100"]
+        assert rec.fs == 360
+        assert rec.sig_len == 650000
+        assert rec.duration == pytest.approx(650000 / 360)
+        assert rec.sig_name == ("MLII", "V5")
+        assert rec.ecg_channel == 0
+        assert rec.ann_exts == ("atr",)
+        assert rec.dat_files == ("100.dat",)
+
+        rec = catalog["foo"]
+        assert rec.sig_name == ()
+        assert rec.ecg_channel is None
+        assert rec.ann_exts == ("bar",)
+
+    def test_dotted_name(self, db_dir):
+        for ext in ["hea", "atr"]:
+            shutil.copy(RESOURCES_PATH / f"100.{ext}", db_dir / f"100.v2.{ext}")
+        catalog = RecordCatalog.build(db_dir, n_jobs=1)
+        assert catalog["100.v2"].ann_exts == ("atr",)
+        assert catalog["100"].ann_exts == ("atr",)
+
+    def test_query(self, db_dir):
+        catalog = RecordCatalog.build(db_dir, n_jobs=1)
+
+        recs = catalog.query(ann_ext="atr", require_ecg=True, min_duration=30 * 60)
+        assert [r.name for r in recs] == ["100", os.path.join("sub", "101")]
+        assert catalog.query(ann_ext="atr", min_duration=6 * 3600) == []
+        assert [r.name for r in catalog.query(ann_ext="bar")] == ["foo"]
+        assert len(catalog.query(fs=360)) == 3
+        assert len(catalog.query(where=lambda r: "V1" in r.sig_name)) == 1
+        assert catalog.path(catalog["100"]) == os.path.join(str(db_dir), "100")
+
+    def test_save_load(self, db_dir, tmp_path):
+        catalog = RecordCatalog.build(db_dir, n_jobs=1)
+        index_path = tmp_path / "index.json"
+        catalog.save(index_path)
+
+        loaded = RecordCatalog.load(index_path)
+        assert loaded.db_dir == catalog.db_dir
+        assert loaded.records == catalog.records
+
+    def test_refresh_incremental(self, db_dir):
+        catalog = RecordCatalog.build(db_dir, n_jobs=1)
+        assert catalog.refresh(n_jobs=1) == 0
+
+        # New annotation file: no header needs to be parsed
+        shutil.copy(RESOURCES_PATH / "100.atr", db_dir / "100.qrs")
+        assert catalog.refresh(n_jobs=1) == 0
+        assert catalog["100"].ann_exts == ("atr", "qrs")
+
+        # Modified header is parsed again
+        hea = (db_dir / "foo.hea").read_text()
+        (db_dir / "foo.hea").write_text(hea.replace("360", "250", 1))
+        assert catalog.refresh(n_jobs=1) == 1
+        assert catalog["foo"].fs == 250
+
+        # Removed record is dropped
+        os.remove(db_dir / "sub" / "101.hea")
+        catalog.refresh(n_jobs=1)
+        assert os.path.join("sub", "101") not in catalog.records
+
+    def test_open(self, db_dir):
+        catalog = RecordCatalog.open(db_dir, n_jobs=1)
+        index_path = db_dir / INDEX_FILENAME
+        assert index_path.is_file()
+
+        mtime_ns = index_path.stat().st_mtime_ns
+        reopened = RecordCatalog.open(db_dir, n_jobs=1)
+        assert reopened.records == catalog.records
+        assert index_path.stat().st_mtime_ns == mtime_ns
@@ -1,10 +1,22 @@
 import pytest
 
 import os
+import sys
 import glob
+import time
 import wfdb
+import asyncio
+import tempfile
+import subprocess
+import wfdb.processing
+import numpy as np
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
+import pyhrv.conf
+import pyhrv.wfdb.qrs as qrs
+import pyhrv.wfdb.rri as rri_module
+import pyhrv.wfdb.utils as utils
 from pyhrv.wfdb.qrs import ecgpuwave_wrapper
 
 from . import TEST_RESOURCES_PATH
@@ -68,3 +80,447 @@ class TestECGPuWaveWrapper(object):
         ann = wfdb.rdann(self.test_rec, TEST_ANN_EXT)
         actual = len(ann.sample)
         assert expected == actual, "Incorrect number of annotations"
+
+
+class TestECGPuWaveSegmented(object):
+    def setup_method(self):
+        self.test_rec = f"{RESOURCES_PATH}/100s"
+
+    def teardown_method(self):
+        assert not glob.glob(f"{RESOURCES_PATH}/fort.*")
+        assert not glob.glob(f"{RESOURCES_PATH}/*.ecgatr*")
+
+    @pytest.mark.parametrize("segment_sec", [15, 25])
+    def test_same_as_single_pass(self, segment_sec):
+        expected = qrs.ecgpuwave_detect_rec(self.test_rec, channel=0)
+        actual = qrs.ecgpuwave_detect_rec(
+            self.test_rec, channel=0, segment_sec=segment_sec, n_jobs=3
+        )
+        assert np.all(np.diff(actual) > 0)
+
+        # Detections near a segment boundary may move by up to the merge
+        # tolerance, all others are the same as in a single pass
+        fs, merge_tol = 360, 36
+        boundaries = _segment_boundaries(self.test_rec, segment_sec)
+        assert len(boundaries) > 0
+        stats = utils.match_detections(expected, actual, tol=merge_tol)
+        assert stats.fn == stats.fp == 0
+
+        dist = np.min(np.abs(expected[:, None] - boundaries[None, :]), axis=1)
+        far_from_boundary = dist > 2 * fs
+        assert np.all(np.isin(expected[far_from_boundary], actual))
+
+    @pytest.mark.parametrize("segment_sec", [15, 25])
+    def test_same_as_single_pass_fake(self, fake_ecgpuwave, segment_sec):
+        fake_ecgpuwave(max_samples=10**9)
+        expected = qrs.ecgpuwave_detect_rec(self.test_rec, channel=0)
+        actual = qrs.ecgpuwave_detect_rec(
+            self.test_rec, channel=0, segment_sec=segment_sec, n_jobs=3
+        )
+        assert np.array_equal(expected, actual)
+
+        # One single pass, and one run per segment
+        n_segments = len(_segment_boundaries(self.test_rec, segment_sec)) + 1
+        assert n_segments > 1
+        assert len(qrs.ecgpuwave_attempts()) == 1 + n_segments
+
+    def test_split_segments_on_timeout(self, fake_ecgpuwave, monkeypatch):
+        # Only ranges of up to about 16s can complete, so each segment is
+        # split once (which takes the given overlap)
+        fake_ecgpuwave(max_samples=6000)
+        detect_kw = []
+        detect_rec = qrs.ecgpuwave_detect_rec
+
+        def spy(*args, **kw):
+            detect_kw.append((kw.get("overlap_sec"), kw.get("merge_tol_sec")))
+            return detect_rec(*args, **kw)
+
+        monkeypatch.setattr(qrs, "ecgpuwave_detect_rec", spy)
+        with pytest.warns(UserWarning, match="Timed-out"):
+            detections = qrs.ecgpuwave_detect_rec(
+                self.test_rec,
+                channel=0,
+                segment_sec=30,
+                overlap_sec=1,
+                merge_tol_sec=0.05,
+                timeout=2,
+                max_splits=1,
+            )
+
+        expected = utils.rdann_by_type(self.test_rec, "atr", types="N")["N"]
+        stats = utils.match_detections(expected, detections, tol=1)
+        assert stats.fn == stats.fp == 0
+        # The segments and their halves got the overlap and merge tolerance
+        assert len(detect_kw) == 1 + 2 + 4
+        assert set(detect_kw) == {(1, 0.05)}
+
+
+def _segment_boundaries(rec_path, segment_sec, fs=360):
+    sig_len = utils.rdheader(rec_path).sig_len
+    segments = qrs._split_segments(0, -1, sig_len, segment_sec * fs, 10 * fs)
+    return np.array([seg.core_end for seg in segments[:-1]])
+
+
+class TestECGPuWaveSignal(object):
+    @classmethod
+    def setup_class(cls):
+        cls.test_rec = f"{RESOURCES_PATH}/100s"
+        record = wfdb.rdrecord(cls.test_rec, channels=[0], physical=False)
+        cls.sig = record.d_signal[:, 0]
+        cls.adc_gain = record.adc_gain[0]
+
+    def setup_method(self):
+        self.scratch_dirs_before = set(glob.glob("/dev/shm/pyhrv_*"))
+
+    def teardown_method(self):
+        assert set(glob.glob("/dev/shm/pyhrv_*")) == self.scratch_dirs_before
+
+    def test_same_as_record(self):
+        expected = qrs.ecgpuwave_detect_rec(self.test_rec, channel=0)
+        actual = qrs.ecgpuwave_detect_sig(self.sig, 360, adc_gain=self.adc_gain)
+        assert np.array_equal(expected, actual)
+
+    def test_from_samp(self):
+        expected = qrs.ecgpuwave_detect_sig(self.sig, 360, adc_gain=self.adc_gain)
+        actual = qrs.ecgpuwave_detect_sig(
+            self.sig, 360, from_samp=3600, adc_gain=self.adc_gain
+        )
+        assert np.all(actual >= 3600)
+        assert len(actual) == pytest.approx(np.sum(expected >= 3600), abs=1)
+
+    def test_concurrent(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(
+                pool.map(
+                    lambda _: qrs.ecgpuwave_detect_sig(
+                        self.sig, 360, adc_gain=self.adc_gain
+                    ),
+                    range(8),
+                )
+            )
+        for res in results[1:]:
+            assert np.array_equal(results[0], res)
+
+    def test_batch(self):
+        sigs = [self.sig[:7200], self.sig[7200:]]
+        batch_detections = qrs.ecgpuwave_detect_sigs(sigs, 360, adc_gain=self.adc_gain)
+        assert len(batch_detections) == len(sigs)
+        for sig, detections in zip(sigs, batch_detections):
+            expected = qrs.ecgpuwave_detect_sig(sig, 360, adc_gain=self.adc_gain)
+            assert np.array_equal(expected, detections)
+
+    def test_batch_float(self):
+        sigs = [self.sig[:7200], self.sig[7200:]]
+        expected = qrs.ecgpuwave_detect_sigs(sigs, 360, adc_gain=self.adc_gain)
+        float_sigs = [sig / self.adc_gain for sig in sigs]
+        actual = qrs.ecgpuwave_detect_sigs(float_sigs, 360)
+        for sig_expected, sig_actual in zip(expected, actual):
+            stats = utils.match_detections(sig_expected, sig_actual, tol=1)
+            assert stats.fn == stats.fp == 0
+
+
+class TestScratchRecord(object):
+    def test_batch_scaling(self, tmp_path):
+        rng = np.random.default_rng(0)
+        sigs = [rng.normal(size=1000), 3 + 0.1 * rng.normal(size=500)]
+        sigs.append(np.array([1, -2, 3], dtype=np.int16))
+        rec_path, seg_starts = qrs._write_scratch_batch(
+            str(tmp_path), "batch", sigs, 360, gap_len=20, adc_gain=100.0
+        )
+        assert seg_starts == [0, 1020, 1540]
+
+        # All segments have the same scaling, so the gaps are at 0 mV
+        headers = [utils.rdheader(str(tmp_path / f"seg{i:06d}")) for i in range(3)]
+        headers.append(utils.rdheader(str(tmp_path / "gap")))
+        assert len({(h.adc_gain[0], h.baseline[0], h.fmt[0]) for h in headers}) == 1
+        adc_gain = headers[0].adc_gain[0]
+        assert adc_gain > 5000
+
+        # Read through links, as ecgpuwave does
+        with qrs._scratch_record(rec_path) as scratch_rec_path:
+            sig = wfdb.rdrecord(scratch_rec_path).p_signal[:, 0]
+        sigs[-1] = sigs[-1] / 100.0
+        for start, expected in zip(seg_starts, sigs):
+            end = start + len(expected)
+            assert np.allclose(sig[start:end], expected, atol=1 / adc_gain)
+            assert np.allclose(sig[end : end + 20], 0)
+
+    def test_digital_as_is(self):
+        sigs = [np.array([1, -2, 3]), np.array([40000, 0])]
+        d_sigs, adc_gain, baseline, fmt = qrs._digitize(sigs, 200.0)
+        assert (adc_gain, baseline, fmt) == (200.0, 0, "32")
+        assert all(np.array_equal(d, s) for d, s in zip(d_sigs, sigs))
+
+    def test_concurrent_same_record(self, fake_ecgpuwave):
+        fake_ecgpuwave(max_samples=10**9)
+        test_rec = f"{RESOURCES_PATH}/100s"
+        files = set(os.listdir(RESOURCES_PATH))
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(
+                pool.map(
+                    lambda _: qrs.ecgpuwave_detect_rec(test_rec, channel=0), range(4)
+                )
+            )
+
+        expected = utils.rdann_by_type(test_rec, "atr", types="N")["N"]
+        for detections in results:
+            assert np.array_equal(detections, expected)
+        assert set(os.listdir(RESOURCES_PATH)) == files
+
+    def test_no_annotation_cache(self, fake_ecgpuwave, tmp_path):
+        fake_ecgpuwave(max_samples=10**9)
+        test_rec = f"{RESOURCES_PATH}/100s"
+        files = set(os.listdir(RESOURCES_PATH))
+        with pyhrv.conf.override("pyhrv.ann_cache", enable=True):
+            qrs.ecgpuwave_detect_rec(test_rec, channel=0)
+            asyncio.run(qrs.async_ecgpuwave_detect_rec(test_rec, channel=0))
+        assert set(os.listdir(RESOURCES_PATH)) == files
+
+        cache_dir = tmp_path / "cache"
+        with pyhrv.conf.override(
+            "pyhrv.ann_cache", enable=True, cache_dir=str(cache_dir)
+        ):
+            qrs.ecgpuwave_detect_rec(test_rec, channel=0)
+        assert not cache_dir.exists() or not list(cache_dir.iterdir())
+
+
+class TestSplitMergeSegments(object):
+    def test_split_covers_range(self):
+        segments = qrs._split_segments(100, 1000, 2000, seg_len=200, overlap_len=30)
+        assert segments[0].core_start == segments[0].start == 100
+        assert segments[-1].core_end == segments[-1].end == 1000
+        for prev, seg in zip(segments[:-1], segments[1:]):
+            assert prev.core_end == seg.core_start
+            assert seg.start == seg.core_start - 30
+            assert prev.end == prev.core_end + 30
+
+    def test_split_to_end_of_record(self):
+        segments = qrs._split_segments(0, -1, 1000, seg_len=300, overlap_len=10)
+        assert len(segments) == 3
+        assert segments[-1].core_end == 1000
+
+    def test_merge_drops_overlap_detections(self):
+        segments = qrs._split_segments(0, 600, 600, seg_len=300, overlap_len=50)
+        detections = [np.array([10, 150, 290, 320]), np.array([260, 290, 450])]
+        merged = qrs._merge_segment_detections(detections, segments, tol=5)
+        assert np.array_equal(merged, [10, 150, 290, 450])
+
+    def test_merge_boundary_duplicates(self):
+        segments = qrs._split_segments(0, 600, 600, seg_len=300, overlap_len=50)
+        detections = [np.array([100, 298]), np.array([302, 400])]
+        merged = qrs._merge_segment_detections(detections, segments, tol=5)
+        assert np.array_equal(merged, [100, 298, 400])
+
+        # Far from boundary, close detections are not merged
+        detections = [np.array([100, 103]), np.array([302, 400])]
+        merged = qrs._merge_segment_detections(detections, segments, tol=5)
+        assert np.array_equal(merged, [100, 103, 302, 400])
+
+
+# A stand-in for the ecgpuwave binary (for record 100s only), which copies
+# the reference beat annotations and hangs when asked to process more than a given number of
+# samples.
+FAKE_ECGPUWAVE = """#!{python}
+import os, re, sys, time, argparse
+
+parser = argparse.ArgumentParser()
+for flag in "rafts":
+    parser.add_argument(f"-{{flag}}")
+args = parser.parse_args()
+
+def to_samples(t, default):
+    m = re.match(r"s(\\d+)$", t or "")
+    return int(m.group(1)) if m else default
+
+sampfrom, sampto = to_samples(args.f, 0), to_samples(args.t, {sig_len})
+if sampto - sampfrom > {max_samples}:
+    time.sleep(60)
+
+import wfdb
+ann = wfdb.rdann({ref_rec!r}, "atr", sampfrom=sampfrom, sampto=sampto - 1)
+samples = ann.sample[[sym == "N" for sym in ann.symbol]]
+wfdb.wrann(args.r, "fake", samples, symbol=["N"] * len(samples))
+os.replace(f"{{args.r}}.fake", f"{{args.r}}.{{args.a}}")
+"""
+
+
+@pytest.fixture
+def fake_ecgpuwave(tmp_path, monkeypatch):
+    def install(max_samples):
+        bin_path = tmp_path / "ecgpuwave"
+        bin_path.write_text(
+            FAKE_ECGPUWAVE.format(
+                python=sys.executable,
+                ref_rec=f"{RESOURCES_PATH}/100s",
+                sig_len=utils.rdheader(f"{RESOURCES_PATH}/100s").sig_len,
+                max_samples=max_samples,
+            )
+        )
+        bin_path.chmod(0o755)
+        monkeypatch.setattr(qrs, "ECGPUWAVE_BIN", str(bin_path))
+        qrs.ecgpuwave_throughput_reset()
+
+    yield install
+    qrs.ecgpuwave_throughput_reset()
+
+
+class TestECGPuWaveTimeout(object):
+    def setup_method(self):
+        self.test_rec = f"{RESOURCES_PATH}/100s"
+
+    def test_attempt_log(self, fake_ecgpuwave):
+        fake_ecgpuwave(max_samples=10**9)
+        assert ecgpuwave_wrapper(self.test_rec, TEST_ANN_EXT, to_time="s7200")
+        os.remove(f"{self.test_rec}.{TEST_ANN_EXT}")
+
+        (attempt,) = qrs.ecgpuwave_attempts()
+        assert attempt.status == "ok"
+        assert attempt.n_samples == 7200
+        assert attempt.timeout >= 10
+        assert attempt.wall_time > 0
+        assert qrs.ecgpuwave_throughput() != 50000
+
+    def test_timeout(self, fake_ecgpuwave):
+        fake_ecgpuwave(max_samples=0)
+        with pytest.warns(UserWarning, match="Timed-out"):
+            assert not ecgpuwave_wrapper(self.test_rec, TEST_ANN_EXT, timeout=1)
+        assert qrs.ecgpuwave_attempts()[-1].status == "timeout"
+        assert not glob.glob(f"{RESOURCES_PATH}/fort.*")
+
+    def test_split_on_timeout(self, fake_ecgpuwave):
+        # Only ranges of up to about a quarter of the record can complete
+        fake_ecgpuwave(max_samples=6000)
+        with pytest.warns(UserWarning, match="Timed-out"):
+            detections = qrs.ecgpuwave_detect_rec(
+                self.test_rec, channel=0, timeout=5, overlap_sec=1
+            )
+
+        expected = utils.rdann_by_type(self.test_rec, "atr", types="N")["N"]
+        stats = utils.match_detections(expected, detections, tol=1)
+        assert stats.fn == stats.fp == 0
+
+        statuses = [a.status for a in qrs.ecgpuwave_attempts()]
+        assert statuses.count("timeout") == 3
+        assert statuses.count("ok") == 4
+
+    def test_no_more_splits(self, fake_ecgpuwave):
+        fake_ecgpuwave(max_samples=0)
+        with pytest.warns(UserWarning, match="Timed-out"):
+            with pytest.raises(RuntimeError, match="timeout"):
+                qrs.ecgpuwave_detect_rec(
+                    self.test_rec, channel=0, timeout=1, max_splits=1
+                )
+        assert len(qrs.ecgpuwave_attempts()) == 3
+
+
+def _scratch_dirs():
+    return {
+        *glob.glob("/dev/shm/pyhrv_*"),
+        *glob.glob(os.path.join(tempfile.gettempdir(), "pyhrv_*")),
+    }
+
+
+class TestAsyncECGPuWave(object):
+    def setup_method(self):
+        self.test_rec = f"{RESOURCES_PATH}/100s"
+        self.expected = utils.rdann_by_type(self.test_rec, "atr", types="N")["N"]
+
+    def test_concurrent(self, fake_ecgpuwave):
+        fake_ecgpuwave(max_samples=10**9)
+
+        async def detect_all():
+            return await asyncio.gather(
+                *(qrs.async_ecgpuwave_detect_rec(self.test_rec) for _ in range(4)),
+                qrs.async_ecgpuwave_detect_rec(self.test_rec, segment_sec=20),
+            )
+
+        for detections in asyncio.run(detect_all()):
+            stats = utils.match_detections(self.expected, detections, tol=1)
+            assert stats.fn == stats.fp == 0
+        assert [a.status for a in qrs.ecgpuwave_attempts()] == ["ok"] * 7
+        assert not glob.glob(f"{RESOURCES_PATH}/fort.*")
+
+    def test_max_processes(self, fake_ecgpuwave):
+        fake_ecgpuwave(max_samples=10**9)
+
+        async def detect_all():
+            start = time.perf_counter()
+            await asyncio.gather(
+                *(qrs.async_ecgpuwave_detect_rec(self.test_rec) for _ in range(3))
+            )
+            return time.perf_counter() - start
+
+        with pyhrv.conf.override("ecgpuwave", max_async_processes=1):
+            elapsed = asyncio.run(detect_all())
+        # The processes ran one after the other
+        assert elapsed >= sum(a.wall_time for a in qrs.ecgpuwave_attempts())
+
+    def test_timeout(self, fake_ecgpuwave):
+        fake_ecgpuwave(max_samples=0)
+        scratch_dirs = _scratch_dirs()
+        start = time.perf_counter()
+        with pytest.warns(UserWarning, match="Timed-out"):
+            with pytest.raises(RuntimeError, match="timeout"):
+                asyncio.run(
+                    qrs.async_ecgpuwave_detect_rec(
+                        self.test_rec, channel=0, timeout=1, max_splits=1
+                    )
+                )
+        assert time.perf_counter() - start < 30
+        # Once one half fails, the other is cancelled
+        statuses = [a.status for a in qrs.ecgpuwave_attempts()]
+        assert 2 <= len(statuses) <= 3 and set(statuses) == {"timeout"}
+        assert _scratch_dirs() <= scratch_dirs
+
+    def test_conf_override(self, fake_ecgpuwave):
+        fake_ecgpuwave(max_samples=0)
+        overrides = dict(max_splits=0, timeout_min_sec=1, timeout_factor=0)
+        with pyhrv.conf.override("ecgpuwave", **overrides):
+            with pytest.warns(UserWarning, match="Timed-out"):
+                with pytest.raises(RuntimeError, match="timeout"):
+                    asyncio.run(qrs.async_ecgpuwave_detect_rec(self.test_rec))
+        # No retries of the halves, and the timeout is estimated (in the
+        # executor) with the overridden parameters
+        (attempt,) = qrs.ecgpuwave_attempts()
+        assert attempt.timeout == 1
+
+    def test_cancel(self, fake_ecgpuwave):
+        fake_ecgpuwave(max_samples=0)
+        scratch_dirs = _scratch_dirs()
+
+        async def detect_and_cancel():
+            task = asyncio.ensure_future(
+                qrs.async_ecgpuwave_detect_rec(self.test_rec, channel=0, timeout=60)
+            )
+            await asyncio.sleep(1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(detect_and_cancel())
+        assert _scratch_dirs() <= scratch_dirs
+        bin_path = qrs.ECGPUWAVE_BIN
+        assert subprocess.run(["pgrep", "-f", bin_path]).returncode == 1
+
+    def test_ecgrr(self, fake_ecgpuwave):
+        fake_ecgpuwave(max_samples=10**9)
+        trr, rri = asyncio.run(rri_module.async_ecgrr(self.test_rec))
+        trr_ann, rri_ann = rri_module.ecgrr(self.test_rec, ann_ext="atr")
+        assert np.allclose(trr, trr_ann) and np.allclose(rri, rri_ann)
+
+        trr, rri = asyncio.run(rri_module.async_ecgrr(self.test_rec, ann_ext="atr"))
+        assert np.array_equal(trr, trr_ann) and np.array_equal(rri, rri_ann)
+
+    def test_ecgrr_conf_override(self):
+        max_splits = []
+
+        def detector(rec_path, **kw):
+            # Not async, so it runs in the executor
+            max_splits.append(pyhrv.conf.get_val("ecgpuwave.max_splits"))
+            return self.expected
+
+        with pyhrv.conf.override("ecgpuwave", max_splits=7):
+            trr, rri = asyncio.run(
+                rri_module.async_ecgrr(self.test_rec, detector=detector)
+            )
+        assert max_splits == [7] and len(rri) == len(self.expected) - 1
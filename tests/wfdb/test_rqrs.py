@@ -0,0 +1,74 @@
+import pytest
+
+import wfdb
+import numpy as np
+
+import pyhrv.wfdb.rri as rri
+import pyhrv.wfdb.qrs as qrs
+import pyhrv.wfdb.utils as utils
+
+from . import TEST_RESOURCES_PATH
+
+RESOURCES_PATH = TEST_RESOURCES_PATH.joinpath("wfdb")
+
+# Note: The data file of record 101 is truncated, and its samples are
+# garbled after about 12 minutes.
+TEST_RECORDS = [("100", None), ("101", "12:00")]
+
+
+class TestRQRS(object):
+    @pytest.mark.parametrize("use_gqpost", [False, True])
+    @pytest.mark.parametrize("rec_name, to_time", TEST_RECORDS)
+    def test_accuracy(self, rec_name, to_time, use_gqpost):
+        rec_path = RESOURCES_PATH / rec_name
+        detections = qrs.rqrs_detect_rec(
+            rec_path, to_time=to_time, use_gqpost=use_gqpost
+        )
+
+        ref = utils.rdann_by_type(rec_path, "atr", to_time=to_time)
+        ref = np.sort(np.concatenate(list(ref.values())))
+        stats = utils.match_detections(ref, detections, tol=0.15 * 360)
+
+        assert stats.sensitivity > 0.99
+        assert stats.ppv > 0.99
+
+    def test_from_to_time(self):
+        rec_path = RESOURCES_PATH / "100"
+        all_detections = qrs.rqrs_detect_rec(rec_path)
+        detections = qrs.rqrs_detect_rec(rec_path, from_time="01:00", to_time="02:00")
+
+        assert np.all((detections >= 60 * 360) & (detections < 120 * 360))
+        stats = utils.match_detections(all_detections, detections, tol=1)
+        assert stats.fp == 0
+
+    def test_sig_same_as_rec(self):
+        rec_path = RESOURCES_PATH / "100"
+        sig = wfdb.rdrecord(str(rec_path), channels=[0]).p_signal[:, 0]
+        assert np.array_equal(
+            qrs.rqrs_detect_sig(sig, 360), qrs.rqrs_detect_rec(rec_path)
+        )
+
+    def test_nan_samples(self):
+        rec_path = RESOURCES_PATH / "100"
+        sig = wfdb.rdrecord(str(rec_path), channels=[0]).p_signal[:, 0]
+        sig[1000:1100] = np.nan
+        sig_orig = sig.copy()
+        assert len(qrs.rqrs_detect_sig(sig, 360)) > 0
+        # The NaNs are interpolated in a copy
+        assert np.array_equal(sig, sig_orig, equal_nan=True)
+        assert len(qrs.rqrs_detect_sig(np.full(1000, np.nan), 360)) == 0
+
+    def test_ecgrr_detector(self):
+        t, rr = rri.ecgrr(RESOURCES_PATH / "100", detector=qrs.rqrs_detect_rec)
+        assert len(t) == len(rr)
+        assert np.mean(rr) == pytest.approx(0.8, rel=0.05)
+
+    @pytest.mark.parametrize("block_sec", [60, 100.5])
+    def test_blocks_same_as_whole(self, block_sec):
+        rec_path = RESOURCES_PATH / "100"
+        whole = qrs.rqrs_detect_rec(rec_path, block_sec=None)
+        blocks = qrs.rqrs_detect_rec(rec_path, block_sec=block_sec)
+
+        stats = utils.match_detections(whole, blocks, tol=1)
+        assert stats.fn == stats.fp == 0
+        assert np.all(np.diff(blocks) > 0)
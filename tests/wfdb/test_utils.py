@@ -1,7 +1,11 @@
 import pytest
 
 import re
+import os
 import random
+import wfdb
+import shutil
+import numpy as np
 from pathlib import Path
 
 import pyhrv.wfdb.utils as utils
@@ -115,6 +119,223 @@ class TestIsRecord(object):
     def test_header_data_ann_record(self):
         assert utils.is_record(self.resource_path / "101", ann_ext="atr")
 
+    def test_multi_segment_record(self, tmp_path):
+        with open(tmp_path / "multi.hea", "w") as f:
+            f.write("multi/2 1 360 1000\n100 500\n101 500\n")
+        assert utils.is_record(tmp_path / "multi")
+        assert not utils.is_record(tmp_path / "multi", dat_ext=None)
+
+
+class TestAnnotations(object):
+    def setup_method(self):
+        self.rec_path = f"{TEST_RESOURCES_PATH}/wfdb/100"
+
+    def test_rdann_array(self):
+        ann_arr = utils.rdann_array(self.rec_path, "atr")
+        assert ann_arr.dtype == utils.ANN_DTYPE
+        assert len(ann_arr) == 2274
+        assert np.all(np.diff(ann_arr["sample"]) >= 0)
+        assert chr(ann_arr["symbol"][0]) == "+"
+        assert np.sum(ann_arr["symbol"] == ord("N")) == 2239
+
+    def test_rdann_array_from_to_time(self):
+        ann_arr = utils.rdann_array(self.rec_path, "atr", "01:00", "02:00")
+        assert np.all(ann_arr["sample"] >= 60 * 360)
+        assert np.all(ann_arr["sample"] < 120 * 360)
+
+    def test_rdann_by_type(self):
+        ann = utils.rdann_by_type(self.rec_path, "atr", types="NAV+")
+        assert list(ann.keys()) == list("NAV+")
+        assert [len(ann[t]) for t in "NAV+"] == [2239, 33, 1, 1]
+        assert all(ann[t].dtype == np.int64 for t in "NAV+")
+
+        ann_arr = utils.rdann_array(self.rec_path, "atr")
+        assert np.array_equal(ann["A"], ann_arr["sample"][ann_arr["symbol"] == 65])
+
+    def test_symbols_to_codes(self):
+        codes = utils.symbols_to_codes(["N", "V", "+"])
+        assert codes.dtype == np.uint8
+        assert list(codes) == [78, 86, 43]
+        assert list(utils.symbols_to_codes(["N", "(AB", "V"])) == [78, 0, 86]
+        assert len(utils.symbols_to_codes([])) == 0
+
+
+class TestAnnotationCache(object):
+    @pytest.fixture
+    def rec_path(self, tmp_path):
+        for ext in ["hea", "dat", "atr"]:
+            shutil.copy(f"{TEST_RESOURCES_PATH}/wfdb/100.{ext}", tmp_path)
+        return tmp_path / "100"
+
+    def test_same_as_uncached(self, rec_path):
+        for from_time, to_time in [(None, None), ("01:00", "02:00"), ("s946", "s2044")]:
+            expected = utils.rdann_array(rec_path, "atr", from_time, to_time)
+            for _ in range(2):
+                actual = utils.rdann_array(rec_path, "atr", from_time, to_time, True)
+                assert isinstance(actual, np.memmap)
+                assert np.array_equal(expected, actual)
+
+        ann = utils.rdann_by_type(rec_path, "atr", "01:00", "02:00", "NA", cache=True)
+        expected = utils.rdann_by_type(rec_path, "atr", "01:00", "02:00", "NA")
+        for ann_type in "NA":
+            assert np.array_equal(expected[ann_type], ann[ann_type])
+
+    def test_sidecar_files(self, rec_path, tmp_path):
+        utils.rdann_array(rec_path, "atr", cache=True)
+        assert os.path.isfile(f"{rec_path}.atr.npy")
+        assert os.path.isfile(f"{rec_path}.atr.npy.json")
+
+        cache_dir = tmp_path / "cache"
+        utils.rdann_array(rec_path, "atr", cache=True, cache_dir=cache_dir)
+        assert len(list(cache_dir.glob("100.atr.*.npy"))) == 1
+
+    def test_invalidation(self, rec_path):
+        utils.rdann_array(rec_path, "atr", cache=True)
+        cache_mtime = os.stat(f"{rec_path}.atr.npy").st_mtime_ns
+
+        # Touching the file doesn't invalidate the cache, since the content
+        # is the same.
+        os.utime(f"{rec_path}.atr", ns=(0, 0))
+        assert len(utils.rdann_array(rec_path, "atr", cache=True)) == 2274
+        assert os.stat(f"{rec_path}.atr.npy").st_mtime_ns == cache_mtime
+
+        # Replacing the annotations does
+        shutil.copy(f"{TEST_RESOURCES_PATH}/wfdb/101.atr", f"{rec_path}.atr")
+        expected = utils.rdann_array(rec_path, "atr")
+        assert np.array_equal(expected, utils.rdann_array(rec_path, "atr", cache=True))
+
+
+class TestRdSignal(object):
+    def setup_method(self):
+        self.rec_path = str(TEST_RESOURCES_PATH.joinpath("wfdb", "100"))
+
+    @pytest.mark.parametrize("channel", [0, 1])
+    @pytest.mark.parametrize("sampfrom, sampto", [(0, None), (1, 2), (1001, 54321)])
+    def test_format_212(self, channel, sampfrom, sampto):
+        expected = wfdb.rdrecord(
+            self.rec_path, sampfrom=sampfrom, sampto=sampto, channels=[channel]
+        ).p_signal[:, 0]
+        sig = utils.rdsignal(self.rec_path, channel, sampfrom, sampto)
+        assert np.array_equal(sig, expected)
+
+    @pytest.mark.parametrize("channel", [0, 2])
+    def test_format_16(self, tmp_path, channel):
+        d_signal = np.random.randint(-1000, 1000, size=(5000, 3))
+        d_signal[100, :] = -(2**15)
+        wfdb.wrsamp(
+            "rec16",
+            fs=250,
+            units=["mV"] * 3,
+            sig_name=["I", "II", "III"],
+            d_signal=d_signal,
+            fmt=["16"] * 3,
+            adc_gain=[200.0] * 3,
+            baseline=[10] * 3,
+            write_dir=str(tmp_path),
+        )
+        rec_path = str(tmp_path / "rec16")
+
+        expected = (d_signal[:, channel] - 10) / 200.0
+        sig = utils.rdsignal(rec_path, channel, 50, 4000)
+        assert np.isnan(sig[50])
+        assert np.array_equal(np.delete(sig, 50), np.delete(expected[50:4000], 50))
+
+    def test_truncated_file(self):
+        # The last sample of record 101 is missing from its data file
+        rec_path = str(TEST_RESOURCES_PATH.joinpath("wfdb", "101"))
+        sig = utils.rdsignal(rec_path, 1, 649990)
+        assert len(sig) == 10
+        assert np.isnan(sig[-1]) and not np.any(np.isnan(sig[:-1]))
+
+    @pytest.mark.parametrize("overlap_len", [0, 100])
+    def test_iter_blocks(self, overlap_len):
+        blocks = list(
+            utils.iter_signal_blocks(
+                self.rec_path, 0, 1000, 51000, block_len=7000, overlap_len=overlap_len
+            )
+        )
+        expected = utils.rdsignal(self.rec_path, 0, 1000, 51000)
+
+        assert blocks[0].core_start == 1000 and blocks[-1].core_end == 51000
+        for block, next_block in zip(blocks, blocks[1:]):
+            assert block.core_end == next_block.core_start
+        for block in blocks:
+            assert block.start == max(1000, block.core_start - overlap_len)
+            assert block.end == min(51000, block.core_end + overlap_len)
+            assert np.array_equal(
+                block.sig, expected[block.start - 1000 : block.end - 1000]
+            )
+
+
+class TestMatchDetections(object):
+    def test_exact(self):
+        ref = np.array([10, 20, 30])
+        stats = utils.match_detections(ref, ref, tol=0)
+        assert stats == (3, 0, 0)
+        assert stats.sensitivity == stats.ppv == 1.0
+
+    def test_tolerance(self):
+        ref = np.array([10, 20, 30])
+        assert utils.match_detections(ref, [12, 19, 35], tol=2) == (2, 1, 1)
+        assert utils.match_detections(ref, [12, 19, 35], tol=5) == (3, 0, 0)
+
+    def test_each_matched_once(self):
+        stats = utils.match_detections([10, 50], [9, 10, 11, 50], tol=3)
+        assert stats == (2, 0, 2)
+        assert stats.ppv == 0.5
+
+    def test_empty(self):
+        assert utils.match_detections([], [1, 2], tol=1) == (0, 0, 2)
+        assert utils.match_detections([1, 2], [], tol=1) == (0, 2, 0)
+
+
+class TestHeaderCache(object):
+    def setup_method(self):
+        utils.header_cache_clear()
+
+    def teardown_method(self):
+        utils.header_cache_clear(maxsize=utils.HEADER_CACHE_MAXSIZE)
+
+    def test_hits(self):
+        rec_path = f"{TEST_RESOURCES_PATH}/wfdb/100"
+        header = utils.rdheader(rec_path)
+        assert header.fs == 360
+        assert utils.rdheader(Path(rec_path)) is header
+        assert utils.find_ecg_channel(rec_path) == 0
+
+        info = utils.header_cache_info()
+        assert (info.hits, info.misses, info.currsize) == (2, 1, 1)
+        assert info.hit_rate == pytest.approx(2 / 3)
+
+    def test_modified_header(self, tmp_path):
+        rec_path = tmp_path / "100"
+        shutil.copy(f"{TEST_RESOURCES_PATH}/find_ecg_channel/ch1.hea", tmp_path)
+        os.rename(tmp_path / "ch1.hea", f"{rec_path}.hea")
+        assert utils.find_ecg_channel(rec_path) == 1
+
+        shutil.copy(
+            f"{TEST_RESOURCES_PATH}/find_ecg_channel/ch0.hea", f"{rec_path}.hea"
+        )
+        os.utime(f"{rec_path}.hea", ns=(0, 0))
+        assert utils.find_ecg_channel(rec_path) == 0
+        assert utils.header_cache_info().misses == 2
+
+    def test_lru_eviction(self):
+        utils.header_cache_clear(maxsize=2)
+        rec_paths = [f"{TEST_RESOURCES_PATH}/wfdb/{name}" for name in ["100", "101"]]
+        rec_paths.append(f"{TEST_RESOURCES_PATH}/ecgpuwave/100s")
+
+        for rec_path in rec_paths:
+            utils.rdheader(rec_path)
+        assert utils.header_cache_info().currsize == 2
+
+        # Most recent entries are still cached, the first was evicted
+        utils.rdheader(rec_paths[2])
+        utils.rdheader(rec_paths[1])
+        utils.rdheader(rec_paths[0])
+        info = utils.header_cache_info()
+        assert (info.hits, info.misses) == (2, 4)
+
 
 class TestWFDBTimeToSamples(object):
     fs = 128